@@ -1,22 +1,42 @@
+import io
 from typing import List, Optional
-from datetime import date
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import date, datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
 
 from ..database import get_session
 from ..models.user import User
 from ..schemas.user import UserRead, UserBase
+from ..schemas.analytics import AssignmentAnalytics
+from ..schemas.telemetry import ItemResponseTimes
+from ..utils import bindings
+from ..utils.admission import admission
+from ..utils.cache import cache
+from ..utils.onboarding import import_users
+from ..utils.queries import query_budget
 from ..utils.security import require_role
-from pydantic import validator
+from ..utils.telemetry import response_times, telemetry
+from ..utils.tracing import TracedRoute
+from pydantic import BaseModel, Field, validator
 
-router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_role(1))])
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_role(1))], route_class=TracedRoute)
 
 @router.get("/users", response_model=List[UserRead])
+@query_budget(2)
 async def list_users(session: AsyncSession = Depends(get_session)):
     result = await session.execute(select(User))
     return result.scalars().all()
 
+# Bulk onboarding from CSV (see utils/onboarding.py for the columns)
+@router.post("/users/import")
+async def import_users_csv(file: UploadFile = File(...), dry_run: bool = False):
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV file must be UTF-8")
+    return await import_users(io.StringIO(text, newline=""), dry_run=dry_run)
+
 @router.get("/users/{user_id}", response_model=UserRead)
 async def get_user(user_id: int, session: AsyncSession = Depends(get_session)):
     result = await session.execute(select(User).filter(User.id == user_id))
@@ -59,4 +79,90 @@ async def update_user(user_id: int, data: UserUpdate, session: AsyncSession = De
 
     await session.commit()
     await session.refresh(user)
-    return user 
\ No newline at end of file
+    return user
+
+# ---------------------------------------------------------------------------
+# Caseload transfer: move or unbind many patients at once (utils/bindings.py)
+# ---------------------------------------------------------------------------
+
+class CaseloadTransfer(BaseModel):
+    from_doctor_id: int
+    to_doctor_id: int
+    patient_ids: Optional[List[int]] = Field(None, max_length=10000)  # None: all of from_doctor's patients
+    reviewer_id: Optional[int] = None  # route pending reviews here instead of to the new doctor
+
+class CaseloadUnbind(BaseModel):
+    doctor_id: int
+    patient_ids: Optional[List[int]] = Field(None, max_length=10000)
+    reviewer_id: Optional[int] = None  # otherwise pending reviews wait for the next doctor
+
+class CaseloadMoved(BaseModel):
+    moved: int
+    patient_ids: List[int]
+    reviews_routed: int
+
+async def _doctors(session: AsyncSession, *ids: int | None) -> dict[int, str]:
+    wanted = {i for i in ids if i is not None}
+    rows = (await session.execute(select(User.id, User.username).filter(User.id.in_(wanted), User.role == 2))).all()
+    found = dict(rows)
+    if missing := wanted - found.keys():
+        raise HTTPException(status_code=404, detail=f"Doctor(s) not found: {sorted(missing)}")
+    return found
+
+@router.post("/caseload/transfer", response_model=CaseloadMoved)
+@query_budget(4)
+async def transfer_caseload(data: CaseloadTransfer, current: User = Depends(require_role(1)), session: AsyncSession = Depends(get_session)):
+    if data.from_doctor_id == data.to_doctor_id:
+        raise HTTPException(status_code=400, detail="Source and target doctor are the same")
+    names = await _doctors(session, data.from_doctor_id, data.to_doctor_id, data.reviewer_id)
+    rebound = await bindings.rebind(
+        session,
+        from_doctor=(data.from_doctor_id, names[data.from_doctor_id]),
+        to_doctor=(data.to_doctor_id, names[data.to_doctor_id]),
+        patient_ids=data.patient_ids, actor_id=current.id, reviewer_id=data.reviewer_id,
+    )
+    await session.commit()
+    await cache.invalidate(*{f"doctor:{d}:caseload" for d in names})
+    return CaseloadMoved(moved=len(rebound.patient_ids), patient_ids=rebound.patient_ids, reviews_routed=rebound.reviews_routed)
+
+@router.post("/caseload/unbind", response_model=CaseloadMoved)
+@query_budget(4)
+async def unbind_caseload(data: CaseloadUnbind, current: User = Depends(require_role(1)), session: AsyncSession = Depends(get_session)):
+    names = await _doctors(session, data.doctor_id, data.reviewer_id)
+    rebound = await bindings.rebind(
+        session, from_doctor=(data.doctor_id, names[data.doctor_id]), to_doctor=None,
+        patient_ids=data.patient_ids, actor_id=current.id, reviewer_id=data.reviewer_id,
+    )
+    await session.commit()
+    await cache.invalidate(*{f"doctor:{d}:caseload" for d in names})
+    return CaseloadMoved(moved=len(rebound.patient_ids), patient_ids=rebound.patient_ids, reviews_routed=rebound.reviews_routed)
+
+# ---------------------------------------------------------------------------
+# Item analysis
+# ---------------------------------------------------------------------------
+
+@router.get("/analytics/assignments/{assignment_id}", response_model=AssignmentAnalytics)
+async def analytics_assignment(assignment_id: int, session: AsyncSession = Depends(get_session)):
+    from ..utils.analytics import assignment_analytics  # NumPy: loaded on first use
+
+    return await assignment_analytics(session, assignment_id)
+
+# Per-item response times of several assignments (?assignment_id=1&assignment_id=2)
+@router.get("/analytics/response-times", response_model=List[ItemResponseTimes])
+async def analytics_response_times(assignment_id: List[int] = Query(..., max_length=100), since: datetime | None = None, max_seconds: float = Query(1800, gt=0), session: AsyncSession = Depends(get_session)):
+    return await response_times(session, assignment_id, since=since, max_seconds=max_seconds)
+
+# Admission control counters of this worker (see utils/admission.py)
+@router.get("/admission")
+async def admission_stats():
+    return admission.stats()
+
+# Response cache counters of this worker (see utils/cache.py)
+@router.get("/cache")
+async def cache_stats():
+    return cache.stats()
+
+# Telemetry buffer and writer counters of this worker (see utils/telemetry.py)
+@router.get("/telemetry")
+async def telemetry_stats():
+    return telemetry.stats()
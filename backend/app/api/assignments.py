@@ -1,39 +1,60 @@
+from datetime import datetime, timedelta, timezone
 from typing import List
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.orm import selectinload
 import uuid, os
 
+from ..utils.cache import cache
 from ..utils.security import require_role
+from ..utils.tracing import TracedRoute, span
+from ..core import tenancy
+from ..core.config import settings
 from ..database import get_session
-from ..models.assignment import Assignment
-from ..utils.images import process_upload, ImageValidationError
-from ..schemas.assignment import AssignmentCreate, AssignmentRead
+from ..models.assignment import Assignment, property_filters
+from ..models.job import Job
+from ..utils.images import process_upload, ImageValidationError, MAX_SIZE
+from ..utils.cloning import clone_assignment
+from ..worker import enqueue
+from ..schemas.assignment import AssignmentClone, AssignmentCloneBulk, AssignmentCreate, AssignmentRead
 from ..models.assignment_details import AssignmentItemBase, MCQItem, WritingItem
 from ..schemas.assignment_v2 import AssignmentReadV2, MCQItemRead, WritingItemRead
 
-UPLOAD_DIR = "uploaded"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-router = APIRouter(prefix="/assignments", tags=["assignments"], dependencies=[Depends(require_role(1))])
+router = APIRouter(prefix="/assignments", tags=["assignments"], dependencies=[Depends(require_role(1))], route_class=TracedRoute)
 
 @router.post("/image")
-async def upload_image(file: UploadFile = File(...)):
+async def upload_image(file: UploadFile = File(...), defer: bool = False, session: AsyncSession = Depends(get_session)):
     data = await file.read()
+    if defer:
+        # Store the raw upload and let a worker transcode it; the returned path
+        # becomes available once the job (see /jobs/{job_id}) is done.
+        if len(data) > MAX_SIZE:
+            raise HTTPException(status_code=400, detail="File too large (max 200KB)")
+        key = uuid.uuid4().hex
+        src = os.path.join(settings.upload_dir, f"{key}.upload")
+        with span("file.write", bytes=len(data)), open(src, "wb") as f:
+            f.write(data)
+        path = f"/static/{key}.webp"
+        job = await enqueue(session, "image.transcode", {"src": src, "dst": os.path.join(settings.upload_dir, f"{key}.webp"), "path": path})
+        await session.commit()
+        return {"path": path, "job_id": job.id}
     try:
         processed = process_upload(data)
     except ImageValidationError as e:
         raise HTTPException(status_code=400, detail=str(e))
     name = f"{uuid.uuid4().hex}.webp"
-    path = os.path.join(UPLOAD_DIR, name)
-    with open(path, "wb") as f:
+    path = os.path.join(settings.upload_dir, name)
+    with span("file.write", bytes=len(processed)), open(path, "wb") as f:
         f.write(processed)
     return {"path": f"/static/{name}"}
 
+def _properties(payload: AssignmentCreate) -> dict | None:
+    return payload.properties.model_dump(exclude_none=True) if payload.properties else None
+
 @router.post("/", response_model=AssignmentRead)
 async def create_assignment(payload: AssignmentCreate, current=Depends(require_role(1)), session: AsyncSession = Depends(get_session)):
-    ass = Assignment(topic=payload.topic, title=payload.title, qtype=payload.qtype, properties=payload.properties, created_by=current.id)
+    ass = Assignment(topic=payload.topic, title=payload.title, qtype=payload.qtype, properties=_properties(payload), created_by=current.id)
     session.add(ass)
     await session.flush()
     for i, item in enumerate(payload.items):
@@ -54,8 +75,9 @@ async def create_assignment(payload: AssignmentCreate, current=Depends(require_r
                 )
             )
         else:  # writing
-            session.add(WritingItem(id=base.id, answer_key=item.answer_key, manual_review=payload.properties.get("manualReview", False) if payload.properties else False))
+            session.add(WritingItem(id=base.id, answer_key=item.answer_key, manual_review=bool(payload.properties and payload.properties.manualReview)))
     await session.commit()
+    await cache.invalidate("assignments")
     await session.refresh(ass)
     return ass
 
@@ -64,23 +86,74 @@ async def create_assignment(payload: AssignmentCreate, current=Depends(require_r
 # ---------------------------------------------------------------------------
 
 @router.get("/", response_model=List[AssignmentRead])
-async def list_assignments(topic: int | None = None, session: AsyncSession = Depends(get_session)):
-    stmt = select(Assignment).order_by(Assignment.created_at.desc())
+async def list_assignments(topic: int | None = None, manual_review: bool | None = None, num_choices: int | None = None, session: AsyncSession = Depends(get_session)):
+    stmt = select(Assignment).filter(Assignment.deleted_at.is_(None), *property_filters(manual_review, num_choices)).order_by(Assignment.created_at.desc())
     if topic:
         stmt = stmt.filter(Assignment.topic == topic)
     result = await session.execute(stmt)
     return result.scalars().all()
 
-# delete assignment
-@router.delete("/{assignment_id}")
+# delete assignment: hide it now, purge its data in batches after the restore
+# window (see tasks.purge_assignment)
+@router.delete("/{assignment_id}", status_code=status.HTTP_202_ACCEPTED)
 async def delete_assignment(assignment_id: int, session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Assignment).filter(Assignment.id == assignment_id))
-    ass = result.scalar_one_or_none()
+    ass = await session.scalar(select(Assignment).filter(Assignment.id == assignment_id, Assignment.deleted_at.is_(None)))
+    if not ass:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    ass.deleted_at = datetime.now(timezone.utc)
+    delay = settings.assignment_restore_hours * 3600
+    job = await enqueue(session, "assignment.purge", {"assignment_id": assignment_id}, delay=delay)
+    await session.commit()
+    await cache.invalidate("assignments")
+    return {"status": "deleted", "job_id": job.id, "purge_after": ass.deleted_at + timedelta(seconds=delay)}
+
+@router.get("/deleted", response_model=List[AssignmentRead])
+async def list_deleted_assignments(session: AsyncSession = Depends(get_session)):
+    stmt = select(Assignment).filter(Assignment.deleted_at.is_not(None)).order_by(Assignment.deleted_at.desc())
+    result = await session.execute(stmt)
+    return result.scalars().all()
+
+@router.post("/{assignment_id}/restore", response_model=AssignmentRead)
+async def restore_assignment(assignment_id: int, session: AsyncSession = Depends(get_session)):
+    # the row lock orders this against the purge, which re-checks deleted_at
+    # under a share lock before every batch (tasks.purge_assignment)
+    ass = await session.scalar(
+        select(Assignment).filter(Assignment.id == assignment_id, Assignment.deleted_at.is_not(None)).with_for_update()
+    )
     if not ass:
+        raise HTTPException(status_code=404, detail="Deleted assignment not found (already purged?)")
+    # jobs of every clinic share public.jobs, and assignment ids are per clinic
+    purge = (Job.tenant_id == tenancy.current().id, Job.kind == "assignment.purge",
+             Job.payload["assignment_id"].as_integer() == assignment_id)
+    if await session.scalar(select(Job.id).filter(*purge, Job.status == "running").limit(1)):
+        raise HTTPException(status_code=409, detail="Purge already in progress")
+    ass.deleted_at = None
+    await session.execute(update(Job).where(*purge, Job.status == "queued").values(status="cancelled"))
+    await session.commit()
+    await cache.invalidate("assignments")
+    await session.refresh(ass)
+    return ass
+
+# ---------------------------------------------------------------------------
+# Clone assignment (copied inside the database, see utils.cloning)
+# ---------------------------------------------------------------------------
+
+async def _clone(assignment_id: int, variants: List[AssignmentClone], current, session: AsyncSession) -> List[Assignment]:
+    ids = await clone_assignment(session, assignment_id, variants, created_by=current.id)
+    if not ids:
         raise HTTPException(status_code=404, detail="Assignment not found")
-    await session.delete(ass)
     await session.commit()
-    return {"status": "deleted"}
+    await cache.invalidate("assignments")
+    clones = {a.id: a for a in (await session.scalars(select(Assignment).filter(Assignment.id.in_(ids)))).all()}
+    return [clones[i] for i in ids]
+
+@router.post("/{assignment_id}/clone", response_model=AssignmentRead)
+async def clone_one(assignment_id: int, payload: AssignmentClone, current=Depends(require_role(1)), session: AsyncSession = Depends(get_session)):
+    return (await _clone(assignment_id, [payload], current, session))[0]
+
+@router.post("/{assignment_id}/clone/bulk", response_model=List[AssignmentRead])
+async def clone_bulk(assignment_id: int, payload: AssignmentCloneBulk, current=Depends(require_role(1)), session: AsyncSession = Depends(get_session)):
+    return await _clone(assignment_id, payload.variants, current, session)
 
 # --------- V2 read using detail tables ----------
 
@@ -93,7 +166,7 @@ async def get_assignment_v2(assignment_id: int, session: AsyncSession = Depends(
             selectinload(Assignment.items_detail).selectinload(AssignmentItemBase.mcq),
             selectinload(Assignment.items_detail).selectinload(AssignmentItemBase.writing),
         )
-        .filter(Assignment.id == assignment_id)
+        .filter(Assignment.id == assignment_id, Assignment.deleted_at.is_(None))
     )
     result = await session.execute(stmt)
     ass = result.scalar_one_or_none()
@@ -139,7 +212,7 @@ async def get_assignment_v2(assignment_id: int, session: AsyncSession = Depends(
 
 @router.put("/{assignment_id}", response_model=AssignmentRead)
 async def update_assignment(assignment_id: int, payload: AssignmentCreate, current=Depends(require_role(1)), session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Assignment).options(selectinload(Assignment.items_detail)).filter(Assignment.id == assignment_id))
+    result = await session.execute(select(Assignment).options(selectinload(Assignment.items_detail)).filter(Assignment.id == assignment_id, Assignment.deleted_at.is_(None)))
     ass = result.scalar_one_or_none()
     if not ass:
         raise HTTPException(status_code=404, detail="Assignment not found")
@@ -148,7 +221,7 @@ async def update_assignment(assignment_id: int, payload: AssignmentCreate, curre
     ass.topic = payload.topic
     ass.title = payload.title
     ass.qtype = payload.qtype
-    ass.properties = payload.properties
+    ass.properties = _properties(payload)
 
     # Clear existing typed items
     for base in ass.items_detail:  # type: ignore[attr-defined]
@@ -174,9 +247,10 @@ async def update_assignment(assignment_id: int, payload: AssignmentCreate, curre
                 )
             )
         else:  # writing
-            session.add(WritingItem(id=base.id, answer_key=item.answer_key, manual_review=payload.properties.get("manualReview", False) if payload.properties else False))
+            session.add(WritingItem(id=base.id, answer_key=item.answer_key, manual_review=bool(payload.properties and payload.properties.manualReview)))
 
     await session.commit()
+    await cache.invalidate("assignments")
 
     # Return refreshed model
     await session.refresh(ass)
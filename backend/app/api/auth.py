@@ -3,12 +3,14 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordRequestForm
 
+from ..core import tenancy
 from ..database import get_session
 from ..models.user import User
 from ..schemas.user import UserCreate, UserRead
 from ..utils.security import hash_password, verify_password, create_access_token
+from ..utils.tracing import TracedRoute
 
-router = APIRouter(prefix="/auth", tags=["auth"])
+router = APIRouter(prefix="/auth", tags=["auth"], route_class=TracedRoute)
 
 
 @router.post("/register", response_model=UserRead, status_code=status.HTTP_201_CREATED)
@@ -51,5 +53,5 @@ async def login(
     if not user or not verify_password(form_data.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
 
-    access_token = create_access_token(user.username, user.role)
+    access_token = create_access_token(user.username, user.role, tenancy.current().id)
     return {"access_token": access_token, "token_type": "bearer"} 
\ No newline at end of file
@@ -1,26 +1,36 @@
-from typing import List
+from typing import List, Literal
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, join
+from sqlalchemy import select, join, or_, and_
 from sqlalchemy.orm import selectinload, joinedload
 from sqlalchemy.exc import IntegrityError
 
+from ..core.config import settings
 from ..utils.security import require_role
+from ..utils.tracing import TracedRoute
 from ..database import get_session
 from ..models.user import User
-from ..models.binding import DoctorPatientBinding
-from ..models.assignment import Assignment
+from ..models.assignment import Assignment, property_filters
 from ..schemas.user import UserRead
 from ..schemas.assignment import AssignmentRead
 from ..schemas.assignment_v2 import AssignmentReadV2, MCQItemRead, WritingItemRead
+from ..schemas.analytics import AssignmentAnalytics
+from ..schemas.telemetry import ItemResponseTimes
+from ..utils import bindings, export, recommendations
+from ..utils.caseload import SORT_COLUMNS, caseload
+from ..utils.answers import load_answers
+from ..utils.cache import cache
+from ..utils.queries import query_budget
+from ..utils.telemetry import response_times
 from ..models.assignment_details import AssignmentItemBase, WritingItem
 from ..models.assignment_patient import AssignmentPatient
 from ..models.assignment_record import AssignmentRecord, MCQAnswer, WritingAnswer
 from pydantic import BaseModel
 
-router = APIRouter(prefix="/doctor", tags=["doctor"], dependencies=[Depends(require_role(2))])
+router = APIRouter(prefix="/doctor", tags=["doctor"], dependencies=[Depends(require_role(2))], route_class=TracedRoute)
 
 @router.get("/patients", response_model=List[UserRead])
 async def my_patients(current: User = Depends(require_role(2)), session: AsyncSession = Depends(get_session)):
@@ -37,25 +47,45 @@ async def available_patients(q: str | None = None, session: AsyncSession = Depen
 
 @router.post("/patients/{patient_id}/bind", response_model=UserRead)
 async def bind_patient(patient_id: int, current: User = Depends(require_role(2)), session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(User).filter(User.id == patient_id, User.role == 3))
-    patient = result.scalar_one_or_none()
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
-    if patient.doctor_id is not None:
+    # conditional on the patient being unbound: concurrent binds cannot both win
+    rebound = await bindings.rebind(session, from_doctor=None, to_doctor=(current.id, current.username), patient_ids=[patient_id], actor_id=current.id)
+    if not rebound.patient_ids:
+        patient = await session.get(User, patient_id)
+        if not patient or patient.role != 3:
+            raise HTTPException(status_code=404, detail="Patient not found")
         raise HTTPException(status_code=400, detail="Patient already bounded")
-    patient.doctor_id = current.id
-    binding = DoctorPatientBinding(
-        doctor_id=current.id,
-        doctor_name=current.username,
-        patient_id=patient.id,
-        patient_name=patient.username,
-        state="bounded",
-    )
-    session.add(binding)
     await session.commit()
-    await session.refresh(patient)
+    patient = await session.get(User, patient_id)
+    await cache.invalidate(f"doctor:{current.id}:caseload")
     return patient
 
+# ---------------------------------------------------------------------------
+# Caseload overview: one row per bound patient, one query per page
+# ---------------------------------------------------------------------------
+
+class CaseloadPatient(BaseModel):
+    patient_id:int
+    username:str
+    first_name:str|None=None
+    last_name:str|None=None
+    assigned:int
+    completed:int
+    last_activity:datetime|None=None
+    latest_scores:dict[str,int]  # topic -> score of the latest finished attempt
+    pending_reviews:int
+
+class CaseloadPage(BaseModel):
+    total:int
+    patients:list[CaseloadPatient]
+
+@router.get("/caseload", response_model=CaseloadPage)
+@query_budget(2)
+async def my_caseload(sort:Literal[tuple(SORT_COLUMNS)]="username", order:Literal["asc","desc"]="asc", limit:int=Query(50, ge=1, le=200), offset:int=Query(0, ge=0), current:User=Depends(require_role(2)), session:AsyncSession=Depends(get_session)):
+    async def load():
+        return await caseload(session, current.id, sort=sort, desc=order=="desc", limit=limit, offset=offset)
+    key=f"doctor.caseload:{current.id}:{sort}:{order}:{limit}:{offset}"
+    return await cache.get_or_load(key, load, tags=[f"doctor:{current.id}:caseload"], ttl=settings.caseload_cache_ttl)
+
 # ---------------------------------------------------------------------------
 # Inspect specific patient (only if bound to doctor)
 # ---------------------------------------------------------------------------
@@ -75,12 +105,16 @@ async def inspect_patient(patient_id: int, current: User = Depends(require_role(
 # ---------------------------------------------------------------------------
 
 @router.get("/assignments", response_model=list[AssignmentRead])
-async def list_assignments(topic: int | None = None, session: AsyncSession = Depends(get_session)):
-    stmt = select(Assignment).order_by(Assignment.created_at.desc())
-    if topic:
-        stmt = stmt.filter(Assignment.topic == topic)
-    result = await session.execute(stmt)
-    return result.scalars().all()
+@query_budget(4)
+async def list_assignments(topic: int | None = None, manual_review: bool | None = None, num_choices: int | None = None, session: AsyncSession = Depends(get_session)):
+    async def load():
+        stmt = select(Assignment).filter(Assignment.deleted_at.is_(None), *property_filters(manual_review, num_choices)).order_by(Assignment.created_at.desc())
+        if topic:
+            stmt = stmt.filter(Assignment.topic == topic)
+        result = await session.execute(stmt)
+        return [AssignmentRead.model_validate(a, from_attributes=True).model_dump(mode="json") for a in result.scalars().all()]
+    # the same for every doctor: one entry per filter combination
+    return await cache.get_or_load(f"doctor.assignments:{topic}:{manual_review}:{num_choices}", load, tags=["assignments"])
 
 @router.get("/assignments/v2/{assignment_id}", response_model=AssignmentReadV2)
 async def get_assignment_v2(assignment_id: int, session: AsyncSession = Depends(get_session)):
@@ -91,7 +125,7 @@ async def get_assignment_v2(assignment_id: int, session: AsyncSession = Depends(
             selectinload(Assignment.items_detail).selectinload(AssignmentItemBase.mcq),
             selectinload(Assignment.items_detail).selectinload(AssignmentItemBase.writing),
         )
-        .filter(Assignment.id == assignment_id)
+        .filter(Assignment.id == assignment_id, Assignment.deleted_at.is_(None))
     )
     result = await session.execute(stmt)
     ass = result.scalar_one_or_none()
@@ -134,12 +168,25 @@ async def get_assignment_v2(assignment_id: int, session: AsyncSession = Depends(
 
 @router.get("/assignments/{assignment_id}", response_model=AssignmentRead)
 async def get_assignment(assignment_id: int, session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Assignment).filter(Assignment.id == assignment_id))
+    result = await session.execute(select(Assignment).filter(Assignment.id == assignment_id, Assignment.deleted_at.is_(None)))
     ass = result.scalar_one_or_none()
     if not ass:
         raise HTTPException(status_code=404, detail="Assignment not found")
     return ass
 
+# item statistics across all attempts; trends only for the doctor's patients
+@router.get("/analytics/assignments/{assignment_id}", response_model=AssignmentAnalytics)
+async def analytics_assignment(assignment_id: int, current: User = Depends(require_role(2)), session: AsyncSession = Depends(get_session)):
+    from ..utils.analytics import assignment_analytics  # NumPy: loaded on first use
+
+    result = await session.execute(select(User.id).filter(User.doctor_id == current.id))
+    return await assignment_analytics(session, assignment_id, patient_ids=set(result.scalars().all()))
+
+# per-item response times of the doctor's patients (?assignment_id=1&assignment_id=2)
+@router.get("/analytics/response-times", response_model=List[ItemResponseTimes])
+async def analytics_response_times(assignment_id: List[int] = Query(..., max_length=100), since: datetime | None = None, max_seconds: float = Query(1800, gt=0), current: User = Depends(require_role(2)), session: AsyncSession = Depends(get_session)):
+    return await response_times(session, assignment_id, doctor_id=current.id, since=since, max_seconds=max_seconds)
+
 # ------------------- Assign existing assignments to patient -----------------
 
 class AssignPayload(BaseModel):
@@ -153,14 +200,19 @@ async def assign_assignments_to_patient(patient_id: int, payload: AssignPayload,
     if not patient or patient.doctor_id != current.id:
         raise HTTPException(status_code=403, detail="Not your patient")
 
-    # insert links
-    for aid in payload.assignment_ids:
+    # insert links (deleted assignments cannot be assigned)
+    live = (await session.execute(select(Assignment.id).filter(Assignment.id.in_(payload.assignment_ids), Assignment.deleted_at.is_(None)))).scalars().all()
+    for aid in live:
         link = AssignmentPatient(assignment_id=aid, patient_id=patient_id)
         session.add(link)
     try:
         await session.commit()
     except IntegrityError:
         await session.rollback()
+    # new pairs enter the patient's due queue
+    await recommendations.refresh(session, [patient_id], live)
+    await session.commit()
+    await cache.invalidate(f"patient:{patient_id}:assignments", f"doctor:{current.id}:caseload")
     return {"status": "ok"}
 
 # list assignments for a patient
@@ -175,14 +227,14 @@ async def patient_assignments(patient_id: int, current: User = Depends(require_r
 
     # get assignments ids
     sub = select(AssignmentPatient.assignment_id).filter(AssignmentPatient.patient_id == patient_id)
-    result = await session.execute(select(Assignment).filter(Assignment.id.in_(sub)))
+    result = await session.execute(select(Assignment).filter(Assignment.id.in_(sub), Assignment.deleted_at.is_(None)))
     return result.scalars().all()
 
 # ---------------- Patient assignment records ----------------
 class MCQAnswerOut(BaseModel):
     item_id:int
-    choice_index:int
-    is_correct:bool
+    choice_index:int|None=None
+    is_correct:bool|None=None
     class Config: from_attributes=True
 
 class WritingAnswerOut(BaseModel):
@@ -202,16 +254,15 @@ class RecordOut(BaseModel):
     class Config: from_attributes=True
 
 @router.get("/patients/{patient_id}/records", response_model=list[RecordOut])
+@query_budget(5)
 async def patient_records(patient_id:int, current:User=Depends(require_role(2)), session:AsyncSession=Depends(get_session)):
     # ensure patient belongs to doctor
     pat=await session.scalar(select(User).filter(User.id==patient_id, User.role==3))
     if not pat or pat.doctor_id!=current.id:
         raise HTTPException(status_code=403, detail="Not your patient")
-    stmt=(select(AssignmentRecord)
-           .options(selectinload(AssignmentRecord.mcq_answers), selectinload(AssignmentRecord.writing_answers))
-           .filter_by(patient_id=patient_id))
-    res=await session.execute(stmt)
-    records=res.scalars().all()
+    stmt=select(AssignmentRecord.__table__).filter_by(patient_id=patient_id).order_by(AssignmentRecord.id)
+    records=(await session.execute(stmt)).all()
+    answers=await load_answers(session, records)
     out=[]
     for r in records:
         out.append(RecordOut(
@@ -219,11 +270,36 @@ async def patient_records(patient_id:int, current:User=Depends(require_role(2)),
             assignment_id=r.assignment_id,
             finished_at=r.finished_at,
             score=r.score,
-            mcq_answers=[MCQAnswerOut(**a.__dict__) for a in getattr(r,'mcq_answers',[])],
-            writing_answers=[WritingAnswerOut(**a.__dict__) for a in getattr(r,'writing_answers',[])]
+            **answers[r.id],
         ))
     return out 
 
+# ---------------- Streaming export (CSV / NDJSON) ----------------
+
+def _export_response(patients, name:str, fmt:str, gzip:bool, since:datetime|None, until:datetime|None, assignment_id:int|None):
+    stmt=export.export_statement(patients, since=since, until=until, assignment_id=assignment_id)
+    body=export.encode(stmt, fmt)
+    filename=f"{name}.{fmt}"
+    media_type=export.MEDIA_TYPES[fmt]
+    if gzip:
+        body=export.gzipped(body)
+        filename+=".gz"
+        media_type="application/gzip"
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@router.get("/patients/{patient_id}/export")
+async def export_patient_records(patient_id:int, format:Literal["csv","ndjson"]="csv", gzip:bool=False, since:datetime|None=None, until:datetime|None=None, assignment_id:int|None=None, current:User=Depends(require_role(2)), session:AsyncSession=Depends(get_session)):
+    pat=await session.scalar(select(User).filter(User.id==patient_id, User.role==3))
+    if not pat or pat.doctor_id!=current.id:
+        raise HTTPException(status_code=403, detail="Not your patient")
+    patients=select(User.id).filter(User.id==patient_id, User.doctor_id==current.id)
+    return _export_response(patients, f"patient-{patient_id}-records", format, gzip, since, until, assignment_id)
+
+@router.get("/export")
+async def export_caseload_records(format:Literal["csv","ndjson"]="csv", gzip:bool=False, since:datetime|None=None, until:datetime|None=None, assignment_id:int|None=None, current:User=Depends(require_role(2))):
+    patients=select(User.id).filter(User.doctor_id==current.id, User.role==3)
+    return _export_response(patients, f"caseload-{current.id}-records", format, gzip, since, until, assignment_id)
+
 # Review endpoints
 class ReviewOut(BaseModel):
     answer_id:int
@@ -238,30 +314,30 @@ class ReviewOut(BaseModel):
     correct:bool|None=None
 
 @router.get("/reviews", response_model=list[ReviewOut])
+@query_budget(2)
 async def pending_reviews(current:User=Depends(require_role(2)), session:AsyncSession=Depends(get_session)):
-    # fetch pending writing answers for doctor patients
-    stmt=(select(WritingAnswer, AssignmentRecord, Assignment, User, AssignmentItemBase)
+    # fetch pending writing answers for doctor patients; plain columns, so the
+    # selectin relationships of Assignment are not loaded for every row
+    stmt=(select(
+              WritingAnswer.id.label("answer_id"),
+              AssignmentRecord.id.label("record_id"),
+              User.id.label("patient_id"),
+              User.username.label("patient_name"),
+              Assignment.id.label("assignment_id"),
+              Assignment.title.label("assignment_title"),
+              AssignmentItemBase.prompt,
+              WritingAnswer.answer_text,
+              WritingAnswer.reviewed,
+              WritingAnswer.correct,
+          )
           .join(AssignmentRecord, WritingAnswer.record_id==AssignmentRecord.id)
           .join(Assignment, Assignment.id==AssignmentRecord.assignment_id)
           .join(User, User.id==AssignmentRecord.patient_id)
           .join(AssignmentItemBase, AssignmentItemBase.id==WritingAnswer.item_id, isouter=True)
-          .filter(User.doctor_id==current.id, WritingAnswer.reviewed==False))
+          .filter(or_(WritingAnswer.reviewer_id==current.id, and_(WritingAnswer.reviewer_id.is_(None), User.doctor_id==current.id)),
+                  WritingAnswer.reviewed==False, Assignment.deleted_at.is_(None)))
     res=await session.execute(stmt)
-    out=[]
-    for wa, rec, ass, pat, item in res.all():
-        out.append(ReviewOut(
-            answer_id=wa.id,
-            record_id=rec.id,
-            patient_id=pat.id,
-            patient_name=pat.username,
-            assignment_id=ass.id,
-            assignment_title=ass.title,
-            prompt=getattr(item,'prompt',None),
-            answer_text=wa.answer_text,
-            reviewed=wa.reviewed,
-            correct=wa.correct
-        ))
-    return out
+    return [ReviewOut(**row) for row in res.mappings().all()]
 
 class ReviewUpdate(BaseModel):
     correct: bool
@@ -274,12 +350,15 @@ async def mark_review(answer_id:int, payload:ReviewUpdate, current:User=Depends(
     # ensure doctor owns patient
     rec=await session.get(AssignmentRecord, wa.record_id)
     pat=await session.get(User, rec.patient_id) if rec else None
-    if not pat or pat.doctor_id!=current.id:
+    # routed to another doctor (utils/bindings.py), or the patient's doctor's
+    if not pat or (wa.reviewer_id or pat.doctor_id)!=current.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     wa.reviewed=True
     wa.correct=payload.correct
     # update record score if auto graded previously not counted
     if payload.correct:
         rec.score=(rec.score or 0)+1
+        await recommendations.refresh(session, [rec.patient_id], [rec.assignment_id])
     await session.commit()
+    await cache.invalidate(*{f"doctor:{current.id}:caseload", f"doctor:{pat.doctor_id}:caseload"})
     return {"status":"ok"} 
\ No newline at end of file
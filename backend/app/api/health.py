@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from ..database import ping_db
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+# liveness: the process and its event loop respond; never touches the database
+@router.get("/live")
+async def live():
+    return {"status": "ok"}
+
+# readiness: startup (migrations, pool warm-up) finished and the database answers
+@router.get("/ready")
+async def ready(request: Request):
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse({"status": "starting"}, status_code=503)
+    if not await ping_db():
+        return JSONResponse({"status": "database unavailable"}, status_code=503)
+    return {"status": "ok"}
@@ -0,0 +1,48 @@
+from datetime import datetime
+from typing import Any, List
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core import tenancy
+from ..database import get_session
+from ..models.job import Job
+from ..utils.security import require_role
+from ..utils.tracing import TracedRoute
+
+router = APIRouter(prefix="/jobs", tags=["jobs"], dependencies=[Depends(require_role(1))], route_class=TracedRoute)
+
+class JobRead(BaseModel):
+    id: int
+    kind: str
+    status: str
+    attempts: int
+    max_attempts: int
+    progress: Any | None = None
+    result: Any | None = None
+    last_error: str | None = None
+    created_at: datetime | None = None
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+    class Config:
+        from_attributes = True
+
+@router.get("/", response_model=List[JobRead])
+async def list_jobs(status: str | None = None, kind: str | None = None, limit: int = 100, session: AsyncSession = Depends(get_session)):
+    stmt = select(Job).filter(Job.tenant_id == tenancy.current().id).order_by(Job.id.desc()).limit(min(limit, 500))
+    if status:
+        stmt = stmt.filter(Job.status == status)
+    if kind:
+        stmt = stmt.filter(Job.kind == kind)
+    result = await session.execute(stmt)
+    return result.scalars().all()
+
+@router.get("/{job_id}", response_model=JobRead)
+async def get_job(job_id: int, session: AsyncSession = Depends(get_session)):
+    job = await session.get(Job, job_id)
+    if not job or job.tenant_id != tenancy.current().id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -1,39 +1,86 @@
 from datetime import datetime
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update, and_, func
+from sqlalchemy.orm import selectinload, noload
 from sqlalchemy.dialects.postgresql import insert
 
+from ..core.config import settings
 from ..database import get_session
 from ..utils.security import require_role
+from ..utils.tracing import TracedRoute
 from ..models.user import User
-from ..models.assignment import Assignment
+from ..models.assignment import Assignment, property_filters
 from ..models.assignment_patient import AssignmentPatient
 from ..models.assignment_record import AssignmentRecord, MCQAnswer, WritingAnswer
+from ..models.patient_recommendation import PatientRecommendation
 from ..schemas.assignment import AssignmentRead
-from pydantic import BaseModel
-from ..schemas.assignment_v2 import AssignmentReadV2, MCQItemRead, WritingItemRead
+from pydantic import BaseModel, Field
+from ..schemas.assignment_v2 import AssignmentReadV2
+from ..schemas.sync import SyncOut, SyncUpload, SyncUploadResult
+from ..schemas.telemetry import DB_INT, ItemEventIn, ItemEventsIn
 from ..models.assignment_details import AssignmentItemBase
+from ..utils.autosave import autosave
+from ..utils.cache import cache
+from ..utils.telemetry import telemetry
+from ..utils.archive import archived_records, load_archived
+from ..utils.answers import load_answers, pack_records
+from ..utils import grading, recommendations, sync
+from ..utils.queries import query_budget
 
-router = APIRouter(prefix="/patient", tags=["patient"], dependencies=[Depends(require_role(3))])
+router = APIRouter(prefix="/patient", tags=["patient"], dependencies=[Depends(require_role(3))], route_class=TracedRoute)
 
 # list doctor-assigned assignments
 @router.get("/assignments", response_model=List[AssignmentRead])
-async def my_assignments(topic: int | None = None, current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
-    sub = select(AssignmentPatient.assignment_id).filter(AssignmentPatient.patient_id == current.id)
-    stmt = select(Assignment).filter(Assignment.id.in_(sub))
+@query_budget(4)
+async def my_assignments(topic: int | None = None, manual_review: bool | None = None, num_choices: int | None = None, current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
+    async def load():
+        sub = select(AssignmentPatient.assignment_id).filter(AssignmentPatient.patient_id == current.id)
+        stmt = select(Assignment).filter(Assignment.id.in_(sub), Assignment.deleted_at.is_(None), *property_filters(manual_review, num_choices))
+        if topic:
+            stmt = stmt.filter(Assignment.topic == topic)
+        res = await session.execute(stmt)
+        return [AssignmentRead.model_validate(a, from_attributes=True).model_dump(mode="json") for a in res.scalars().all()]
+    key = f"patient.assignments:{current.id}:{topic}:{manual_review}:{num_choices}"
+    return await cache.get_or_load(key, load, tags=["assignments", f"patient:{current.id}:assignments"])
+
+# what to practise next: the patient's due queue (utils/recommendations.py)
+class NextOut(BaseModel):
+    assignment_id: int
+    title: str
+    topic: int
+    due_at: datetime
+    overdue: bool
+    interval_days: float
+    repetitions: int
+    attempts: int
+    last_quality: int | None = None
+
+@router.get("/next", response_model=List[NextOut])
+@query_budget(2)
+async def next_assignments(limit: int = Query(1, ge=1, le=50), topic: int | None = None, current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
+    R = PatientRecommendation
+    stmt = (
+        select(R.assignment_id, Assignment.title, Assignment.topic, R.due_at, (R.due_at <= func.now()).label("overdue"),
+               R.interval_days, R.repetitions, R.attempts, R.last_quality)
+        .join(Assignment, Assignment.id == R.assignment_id)
+        .filter(R.patient_id == current.id, Assignment.deleted_at.is_(None))
+        .order_by(R.due_at, R.ease)
+        .limit(limit)
+    )
     if topic:
         stmt = stmt.filter(Assignment.topic == topic)
     res = await session.execute(stmt)
-    return res.scalars().all()
+    return [NextOut(**row) for row in res.mappings().all()]
 
 # helper: get or create record
 async def _get_record(session: AsyncSession, assignment_id: int, patient_id: int) -> AssignmentRecord:
     # Try to locate the most recent **unfinished** record.
     rec_stmt = (
         select(AssignmentRecord)
+        .join(Assignment, Assignment.id == AssignmentRecord.assignment_id)
+        .filter(Assignment.deleted_at.is_(None))
         .filter_by(assignment_id=assignment_id, patient_id=patient_id, finished_at=None)
         .order_by(AssignmentRecord.id.desc())
         .limit(1)
@@ -41,39 +88,87 @@ async def _get_record(session: AsyncSession, assignment_id: int, patient_id: int
     rec = await session.scalar(rec_stmt)
     # If none exists (first time or previous attempt already finished) -> create new record
     if rec is None:
+        await _lock_live_assignment(session, assignment_id)
         rec = AssignmentRecord(assignment_id=assignment_id, patient_id=patient_id)
         session.add(rec)
         await session.flush()
     return rec
 
+# Answers to a deleted assignment are refused. The row stays share-locked until
+# the caller commits, so a concurrent delete or purge waits for the new record.
+async def _lock_live_assignment(session: AsyncSession, assignment_id: int) -> None:
+    live = await session.scalar(
+        select(Assignment.id).filter(Assignment.id == assignment_id, Assignment.deleted_at.is_(None)).with_for_update(read=True)
+    )
+    if live is None:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+
 # Fetch the most recent record for an assignment/patient regardless of whether it
 # has been finished. Unlike `_get_record`, this helper never creates a new
 # record – it merely returns `None` if nothing exists yet.
 async def _get_latest_record(session: AsyncSession, assignment_id:int, patient_id:int) -> AssignmentRecord|None:
     stmt=(select(AssignmentRecord)
+           .join(Assignment, Assignment.id == AssignmentRecord.assignment_id)
+           .filter(Assignment.deleted_at.is_(None))
            .filter_by(assignment_id=assignment_id, patient_id=patient_id)
            .order_by(AssignmentRecord.id.desc())
            .limit(1))
     return await session.scalar(stmt)
 
+# Submissions may carry item view/answer/change events; they are only
+# buffered here and written in batches (utils/telemetry.py).
 class MCQSubmit(BaseModel):
     item_id: int
     choice_index: int
     is_correct: bool
+    events: List[ItemEventIn] = Field(default_factory=list, max_length=50)
 
 @router.post("/records/{assignment_id}/mcq")
 async def submit_mcq(assignment_id: int, payload: MCQSubmit, current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
     rec = await _get_record(session, assignment_id, current.id)
-    session.add(MCQAnswer(record_id=rec.id, **payload.model_dump()))
+    session.add(MCQAnswer(record_id=rec.id, **payload.model_dump(exclude={"events"})))
     await session.commit()
+    telemetry.put(current.id, assignment_id, payload.events)
     return {"ok": True}
 
 class WritingSubmit(BaseModel):
-    item_id: int
+    item_id: int = DB_INT  # drafts share one upsert with other patients'
     answer_text: str
+    events: List[ItemEventIn] = Field(default_factory=list, max_length=50)
+
+# events not tied to a submission, e.g. views of items left unanswered; only
+# for assignments the patient has (cached like /patient/assignments)
+@router.post("/records/{assignment_id}/events")
+async def item_events(assignment_id: int = Path(ge=1, le=2**31 - 1), payload: ItemEventsIn = Body(...), current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
+    async def load():
+        stmt = (select(AssignmentPatient.assignment_id)
+                .join(Assignment, Assignment.id == AssignmentPatient.assignment_id)
+                .filter(AssignmentPatient.patient_id == current.id, Assignment.deleted_at.is_(None)))
+        return list((await session.scalars(stmt)).all())
+    assigned = await cache.get_or_load(f"patient.assigned:{current.id}", load, tags=["assignments", f"patient:{current.id}:assignments"])
+    if assignment_id not in assigned:
+        raise HTTPException(status_code=403, detail="Not assigned")
+    telemetry.put(current.id, assignment_id, payload.events)
+    return {"ok": True, "queued": len(payload.events)}
 
 @router.post("/records/{assignment_id}/writing")
-async def submit_writing(assignment_id: int, payload: WritingSubmit, current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
+async def submit_writing(assignment_id: int, payload: WritingSubmit, draft: bool = False, current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
+    # Autosave: buffer the draft in memory, it is written in a batched upsert
+    # shortly after (see utils/autosave.py). The record id is cached so that
+    # typing does not cost a query per keystroke either.
+    if draft:
+        rec_id = autosave.record_for(assignment_id, current.id)
+        if rec_id is None:
+            rec = await _get_latest_record(session, assignment_id, current.id)
+            if rec is None:
+                rec = await _get_record(session, assignment_id, current.id)
+                await session.commit()
+            rec_id = rec.id
+            autosave.remember(assignment_id, current.id, rec_id)
+        autosave.put(rec_id, payload.item_id, payload.answer_text)
+        telemetry.put(current.id, assignment_id, payload.events)
+        return {"ok": True, "buffered": True}
+
     # Use the most recent record even if it has already been finished so that
     # answers submitted AFTER the finish call are still attached correctly
     # instead of spawning a brand-new, rogue record.
@@ -81,12 +176,37 @@ async def submit_writing(assignment_id: int, payload: WritingSubmit, current: Us
     if rec is None:
         # Fallback: no record yet – create one (should rarely happen)
         rec = await _get_record(session, assignment_id, current.id)
-    stmt = insert(WritingAnswer).values(record_id=rec.id, **payload.model_dump()).on_conflict_do_update(
+    # Explicit submit wins over any buffered draft of the same item; write the
+    # remaining drafts of this record first.
+    autosave.discard(rec.id, payload.item_id)
+    await autosave.flush(rec.id)
+    # Submits to one attempt (and its finish) take turns on the record row, so
+    # the previous answer read below is the one the upsert replaces. A changed
+    # answer is pending again and graded anew; if the old text had been
+    # accepted, its point is taken back first.
+    await session.execute(select(AssignmentRecord.id).filter_by(id=rec.id).with_for_update())
+    old = (await session.execute(
+        select(WritingAnswer.answer_text, WritingAnswer.reviewed, WritingAnswer.correct)
+        .filter_by(record_id=rec.id, item_id=payload.item_id)
+    )).first()
+    changed = old is None or old.answer_text != payload.answer_text
+    stmt = insert(WritingAnswer).values(record_id=rec.id, **payload.model_dump(exclude={"events"})).on_conflict_do_update(
         index_elements=[WritingAnswer.record_id, WritingAnswer.item_id],
-        set_={"answer_text": payload.answer_text}
+        set_={"answer_text": payload.answer_text, "submitted": True,
+              **({"reviewed": False, "correct": None, "auto_graded": None} if changed else {})}
     )
     await session.execute(stmt)
+    if changed and old is not None and old.reviewed and old.correct:
+        await session.execute(
+            update(AssignmentRecord).where(AssignmentRecord.id == rec.id)
+            .values(score=func.coalesce(AssignmentRecord.score, 0) - 1)
+        )
+    if rec.finished_at is not None:
+        # a late answer to a finished attempt is graded at once
+        await grading.grade_records(session, [rec.id])
+        await recommendations.refresh(session, [current.id], [assignment_id])
     await session.commit()
+    telemetry.put(current.id, assignment_id, payload.events)
     return {"ok": True}
 
 class FinishPayload(BaseModel):
@@ -95,14 +215,25 @@ class FinishPayload(BaseModel):
 @router.post("/records/{assignment_id}/finish")
 async def finish_assignment(assignment_id: int, payload: FinishPayload, current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
     rec = await _get_record(session, assignment_id, current.id)
+    await autosave.flush(rec.id)
+    # the next draft belongs to a new attempt; drafts other workers still
+    # hold can no longer change the answers graded here (utils/autosave.py)
+    autosave.forget(assignment_id, current.id)
+    await session.execute(update(WritingAnswer).where(WritingAnswer.record_id == rec.id).values(submitted=True))
     rec.finished_at = datetime.utcnow()
     rec.score = payload.score
+    await grading.grade_records(session, [rec.id])
+    if settings.compact_mcq_answers:
+        await pack_records(session, [rec.id])
+    await recommendations.refresh(session, [current.id], [assignment_id])
     await session.commit()
     return {"done": True}
 
 # ensure record exists (start)
 @router.post("/records/{assignment_id}/start")
 async def start_assignment(assignment_id:int, current:User=Depends(require_role(3)), session:AsyncSession=Depends(get_session)):
+    # a new attempt may start here, drop the cached autosave record
+    autosave.forget(assignment_id, current.id)
     await _get_record(session, assignment_id, current.id)
     await session.commit()
     return {"started":True}
@@ -115,54 +246,38 @@ class RecordOut(BaseModel):
     class Config: from_attributes = True
 
 @router.get("/records", response_model=List[RecordOut])
+@query_budget(3)
 async def my_records(current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
     res = await session.execute(select(AssignmentRecord).filter_by(patient_id=current.id))
-    return res.scalars().all()
+    # archived attempts keep their summary row, so progress stays complete
+    return [*res.scalars().all(), *await archived_records(session, patient_id=current.id)]
 
 # detailed assignment (v2) only if assigned to patient
 @router.get("/assignments/v2/{assignment_id}", response_model=AssignmentReadV2)
+@query_budget(3)
 async def assigned_assignment_v2(assignment_id:int, current:User=Depends(require_role(3)), session:AsyncSession=Depends(get_session)):
-    # confirm assigned
-    assigned = await session.scalar(
-        select(AssignmentPatient).filter_by(assignment_id=assignment_id, patient_id=current.id)
-    )
-    if not assigned:
-        raise HTTPException(status_code=403, detail="Not assigned")
-
+    # One query for the assignment (joined to the patient's link, so it doubles
+    # as the assignment check) and one for the items with their typed details;
+    # the legacy JSON items are not needed here.
     stmt=(select(Assignment)
+          .join(AssignmentPatient, and_(AssignmentPatient.assignment_id==Assignment.id, AssignmentPatient.patient_id==current.id))
           .options(
-              selectinload(Assignment.items_detail),
-              selectinload(Assignment.items_detail).selectinload(AssignmentItemBase.mcq),
-              selectinload(Assignment.items_detail).selectinload(AssignmentItemBase.writing),
+              noload(Assignment.items),
+              selectinload(Assignment.items_detail).joinedload(AssignmentItemBase.mcq),
+              selectinload(Assignment.items_detail).joinedload(AssignmentItemBase.writing),
           )
-          .filter(Assignment.id==assignment_id))
+          .filter(Assignment.id==assignment_id, Assignment.deleted_at.is_(None)))
     res=await session.execute(stmt)
-    ass=res.scalar_one()
-
-    items_out=[]
-    for base in ass.items_detail:  # type: ignore[attr-defined]
-        if base.mcq:
-            items_out.append(
-                MCQItemRead(
-                    id=base.id,
-                    prompt=base.prompt,
-                    image_path=base.image_path,
-                    choices=base.mcq.choices,
-                    answer_key=base.mcq.answer_key,
-                )
-            )
-        elif base.writing:
-            items_out.append(
-                WritingItemRead(
-                    id=base.id,
-                    prompt=base.prompt,
-                    image_path=base.image_path,
-                    answer_key=base.writing.answer_key,
-                    manual_review=base.writing.manual_review,
-                )
-            )
+    ass=res.scalar_one_or_none()
+    if not ass:
+        assigned = await session.scalar(
+            select(AssignmentPatient.id).filter_by(assignment_id=assignment_id, patient_id=current.id)
+        )
+        if not assigned:
+            raise HTTPException(status_code=403, detail="Not assigned")
+        raise HTTPException(status_code=404, detail="Assignment not found")
 
-    return AssignmentReadV2(id=ass.id,topic=ass.topic,title=ass.title,qtype=ass.qtype,properties=ass.properties,items=items_out)
+    return AssignmentReadV2.from_assignment(ass)
 
 # legacy assignment read (JSON)
 
@@ -171,7 +286,7 @@ async def assigned_assignment_legacy(assignment_id:int, current:User=Depends(req
     assigned=await session.scalar(select(AssignmentPatient).filter_by(assignment_id=assignment_id, patient_id=current.id))
     if not assigned:
         raise HTTPException(status_code=403, detail="Not assigned")
-    res=await session.execute(select(Assignment).options(selectinload(Assignment.items)).filter(Assignment.id==assignment_id))
+    res=await session.execute(select(Assignment).options(selectinload(Assignment.items)).filter(Assignment.id==assignment_id, Assignment.deleted_at.is_(None)))
     ass=res.scalar_one_or_none()
     if not ass:
         raise HTTPException(status_code=404, detail="Assignment not found")
@@ -180,8 +295,8 @@ async def assigned_assignment_legacy(assignment_id:int, current:User=Depends(req
 # ---------------- History helpers & endpoint ----------------
 class MCQAnswerOut(BaseModel):
     item_id: int
-    choice_index: int
-    is_correct: bool
+    choice_index: int | None = None  # mcq_answer columns are nullable, and so are archived values
+    is_correct: bool | None = None
 
     class Config:
         from_attributes = True
@@ -203,13 +318,31 @@ class RecordDetailOut(BaseModel):
     score: int | None
     mcq_answers: List[MCQAnswerOut]
     writing_answers: List[WritingAnswerOut]
+    archived: bool = False
 
     class Config:
         from_attributes = True
 
+async def _archived_details(records) -> List[RecordDetailOut]:
+    answers = await load_archived(records)
+    return [
+        RecordDetailOut(
+            id=r.id,
+            assignment_id=r.assignment_id,
+            started_at=r.started_at,
+            finished_at=r.finished_at,
+            score=r.score,
+            archived=True,
+            **answers[r.id],
+        )
+        for r in records
+    ]
+
 @router.get("/records/{assignment_id}/history", response_model=List[RecordDetailOut])
+@query_budget(5)
 async def assignment_history(
     assignment_id: int,
+    include_archived: bool = False,
     current: User = Depends(require_role(3)),
     session: AsyncSession = Depends(get_session),
 ):
@@ -221,13 +354,12 @@ async def assignment_history(
         raise HTTPException(status_code=403, detail="Not assigned")
 
     stmt = (
-        select(AssignmentRecord)
-        .options(selectinload(AssignmentRecord.mcq_answers), selectinload(AssignmentRecord.writing_answers))
+        select(AssignmentRecord.__table__)
         .filter_by(assignment_id=assignment_id, patient_id=current.id)
         .order_by(AssignmentRecord.started_at.desc())
     )
-    res = await session.execute(stmt)
-    records: List[AssignmentRecord] = res.scalars().all()
+    records = (await session.execute(stmt)).all()
+    answers = await load_answers(session, records)
 
     # Build output list
     out: List[RecordDetailOut] = []
@@ -239,21 +371,22 @@ async def assignment_history(
                 started_at=r.started_at,
                 finished_at=r.finished_at,
                 score=r.score,
-                mcq_answers=[MCQAnswerOut(**a.__dict__) for a in getattr(r, "mcq_answers", [])],  # type: ignore[arg-type]
-                writing_answers=[WritingAnswerOut(**a.__dict__) for a in getattr(r, "writing_answers", [])],  # type: ignore[arg-type]
+                **answers[r.id],
             )
         )
+    # Older attempts live in the monthly archive files (utils/archive.py)
+    if include_archived:
+        out.extend(await _archived_details(await archived_records(session, assignment_id=assignment_id, patient_id=current.id)))
     return out
 
 @router.get("/records/detail/{record_id}", response_model=RecordDetailOut)
 async def assignment_record_detail(record_id:int, current:User=Depends(require_role(3)), session:AsyncSession=Depends(get_session)):
-    rec_stmt=(
-        select(AssignmentRecord)
-        .options(selectinload(AssignmentRecord.mcq_answers), selectinload(AssignmentRecord.writing_answers))
-        .filter_by(id=record_id, patient_id=current.id)
-    )
-    rec=await session.scalar(rec_stmt)
+    rec_stmt=select(AssignmentRecord.__table__).filter_by(id=record_id, patient_id=current.id)
+    rec=(await session.execute(rec_stmt)).first()
     if not rec:
+        archived=await archived_records(session, id=record_id, patient_id=current.id)
+        if archived:
+            return (await _archived_details(archived))[0]
         raise HTTPException(status_code=404, detail="Record not found")
     return RecordDetailOut(
         id=rec.id,
@@ -261,6 +394,19 @@ async def assignment_record_detail(record_id:int, current:User=Depends(require_r
         started_at=rec.started_at,
         finished_at=rec.finished_at,
         score=rec.score,
-        mcq_answers=[MCQAnswerOut(**a.__dict__) for a in getattr(rec,"mcq_answers",[])],
-        writing_answers=[WritingAnswerOut(**a.__dict__) for a in getattr(rec,"writing_answers",[])]
-    ) 
\ No newline at end of file
+        **(await load_answers(session, [rec]))[rec.id],
+    )
+
+# ---------------- Delta sync (offline clients) ----------------
+@router.get("/sync", response_model=SyncOut)
+@query_budget(9)
+async def sync_changes(since: int = Query(0, ge=0), current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
+    # since=0 is a full sync; otherwise only rows stamped after the cursor
+    upto = await sync.horizon(session, floor=since)
+    return await sync.changes(session, current.id, since, upto)
+
+@router.post("/sync/attempts", response_model=List[SyncUploadResult])
+async def upload_attempts(payload: SyncUpload, current: User = Depends(require_role(3)), session: AsyncSession = Depends(get_session)):
+    results = await sync.upload(session, current.id, payload.attempts)
+    await session.commit()
+    return results
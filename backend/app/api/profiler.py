@@ -0,0 +1,51 @@
+from typing import List, Literal
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field, model_validator
+
+from ..utils.profiler import profiler
+from ..utils.security import require_role
+from ..utils.tracing import TracedRoute
+
+router = APIRouter(prefix="/admin/profiler", tags=["admin"], dependencies=[Depends(require_role(1))], route_class=TracedRoute)
+
+class ArmRequest(BaseModel):
+    route: str | None = None  # path template as in /docs, e.g. "/patient/assignments/v2/{assignment_id}"
+    method: str | None = None
+    percent: float = Field(100.0, gt=0, le=100)
+    count: int = Field(10, ge=1, le=1000)  # profiles per worker before disarming
+    minutes: float = Field(10.0, gt=0, le=24 * 60)
+    interval_ms: float = Field(5.0, ge=1, le=1000)
+
+    @model_validator(mode="after")
+    def _scoped(self):
+        # sampling every request of every route is too much for production
+        if self.route is None and self.percent > 10:
+            raise ValueError("percent above 10 needs a route")
+        return self
+
+@router.get("/")
+async def profiler_status():
+    return profiler.status()
+
+@router.post("/arm")
+async def arm_profiler(payload: ArmRequest):
+    return profiler.arm(**payload.model_dump())
+
+@router.post("/disarm")
+async def disarm_profiler():
+    profiler.disarm()
+    return {"armed": False}
+
+@router.get("/profiles", response_model=List[dict])
+async def list_profiles():
+    return profiler.list()
+
+@router.get("/profiles/{name}")
+async def get_profile(name: str, kind: Literal["wall", "cpu", "json"] = "wall"):
+    path = profiler.path(name, kind)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "application/json" if kind == "json" else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=path.rsplit("/", 1)[-1])
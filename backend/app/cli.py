@@ -0,0 +1,162 @@
+"""Maintenance commands.
+
+    python -m app.cli archive [--before YYYY-MM]
+    python -m app.cli import-users users.csv [--dry-run]
+    python -m app.cli pack-mcq [--batch-size N]
+    python -m app.cli precompress [--dir uploaded]
+    python -m app.cli recommend [--batch-size N]
+    python -m app.cli grade [--batch-size N]
+    python -m app.cli create-clinic SLUG --name NAME [--database-url URL]
+    python -m app.cli list-clinics
+    python -m app.cli move-clinic SLUG DATABASE_URL
+
+Commands that work on clinic data take ``--clinic SLUG`` (default: the
+default clinic).
+"""
+import argparse
+import asyncio
+import json
+from datetime import datetime
+
+from .core import tenancy
+from .core.config import settings
+from .database import dispose_engines
+from .middleware.static import precompress
+from .utils import archive, clinics, grading, onboarding, recommendations
+from .utils.answers import pack_finished
+from .utils.onboarding import import_users
+
+
+async def _archive(args: argparse.Namespace) -> None:
+    cutoff = datetime.strptime(args.before, "%Y-%m").date() if args.before else archive.default_cutoff()
+    counts = await archive.archive_before(cutoff, batch_size=args.batch_size)
+    for month, n in sorted(counts.items()):
+        print(f"{month}: {n} record(s) -> {archive.month_path(month)}")
+    if not counts:
+        print(f"Nothing to archive before {cutoff:%Y-%m}")
+
+
+async def _import_users(args: argparse.Namespace) -> None:
+    with open(args.path, encoding="utf-8-sig", newline="") as f:
+        try:
+            report = await import_users(f, dry_run=args.dry_run, workers=args.workers)
+        finally:
+            onboarding.shutdown_pool()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+async def _pack_mcq(args: argparse.Namespace) -> None:
+    records, rows = await pack_finished(batch_size=args.batch_size)
+    print(f"Packed {rows} answer row(s) of {records} record(s)")
+    if rows:
+        print("Run VACUUM (or pg_repack) on mcq_answer to return the space to the OS.")
+
+
+async def _precompress(args: argparse.Namespace) -> None:
+    stats = await asyncio.to_thread(precompress, args.dir, min_size=args.min_size, force=args.force)
+    saved = stats["bytes_in"] - stats["bytes_out"]
+    print(f"{stats['files']} file(s) checked, {stats['written']} sibling(s) written, {saved} byte(s) saved")
+
+
+async def _recommend(args: argparse.Namespace) -> None:
+    patients, rows = await recommendations.recompute_all(batch_size=args.batch_size)
+    print(f"Recomputed {rows} recommendation(s) for {patients} patient(s)")
+
+
+async def _grade(args: argparse.Namespace) -> None:
+    counts = await grading.backfill(batch_size=args.batch_size)
+    print(f"Graded {counts['records']} record(s): {counts['correct']} correct, {counts['wrong']} wrong, {counts['manual']} left for review")
+
+
+async def _create_clinic(args: argparse.Namespace) -> None:
+    tenant = await clinics.create(args.slug, args.name, args.database_url)
+    print(f"Created clinic {tenant.slug} (id {tenant.id}, schema {tenant.schema})")
+
+
+async def _list_clinics(args: argparse.Namespace) -> None:
+    for t in await clinics.registry.all():
+        print(f"{t.id}\t{t.slug}\t{t.schema}\t{t.status}\t{t.database_url or '(main database)'}")
+
+
+async def _move_clinic(args: argparse.Namespace) -> None:
+    counts = await clinics.move(args.slug, args.database_url, drain_seconds=args.drain_seconds,
+                                settle_seconds=args.settle_seconds)
+    for table, n in counts.items():
+        print(f"{table}: {n} row(s)")
+    print(f"Clinic {args.slug} now runs on the new database; its old schema was left in place.")
+
+
+async def _run(args: argparse.Namespace) -> None:
+    try:
+        tenant = tenancy.DEFAULT if args.clinic == "default" else await clinics.registry.by_slug(args.clinic)
+        if tenant is None:
+            raise SystemExit(f"Unknown clinic {args.clinic!r}")
+        try:
+            async with clinics.hold(tenant) as tenant:
+                with tenancy.use(tenant):
+                    await args.func(args)
+        except clinics.ClinicMoving as e:
+            raise SystemExit(str(e))
+    finally:
+        await dispose_engines()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    sub = parser.add_subparsers(dest="command", required=True)
+    clinic = argparse.ArgumentParser(add_help=False)
+    clinic.add_argument("--clinic", default="default", help="clinic slug (default: %(default)s)")
+
+    p = sub.add_parser("archive", parents=[clinic], help="move finished attempts of cold months to compressed files")
+    p.add_argument("--before", help="archive months before YYYY-MM (default: keep archive_after_months)")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.set_defaults(func=_archive)
+
+    p = sub.add_parser("import-users", parents=[clinic], help="create users (and doctor bindings) from a CSV file")
+    p.add_argument("path")
+    p.add_argument("--dry-run", action="store_true", help="validate only, write nothing")
+    p.add_argument("--workers", type=int, help="password hashing processes (default: IMPORT_HASH_WORKERS, else CPU count)")
+    p.set_defaults(func=_import_users)
+
+    p = sub.add_parser("pack-mcq", parents=[clinic], help="fold mcq_answer rows of finished attempts into packed arrays")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.set_defaults(func=_pack_mcq)
+
+    p = sub.add_parser("precompress", help="write .br/.gz siblings of compressible static files")
+    p.add_argument("--dir", default=settings.upload_dir)
+    p.add_argument("--min-size", type=int, default=1024)
+    p.add_argument("--force", action="store_true", help="rewrite siblings that are up to date")
+    p.set_defaults(func=_precompress)
+
+    p = sub.add_parser("recommend", parents=[clinic], help="recompute every patient's next-exercise queue (after algorithm changes)")
+    p.add_argument("--batch-size", type=int, default=500, help="patients per transaction")
+    p.set_defaults(func=_recommend)
+
+    p = sub.add_parser("grade", parents=[clinic], help="auto-grade pending writing answers of finished attempts")
+    p.add_argument("--batch-size", type=int, default=1000, help="records per transaction")
+    p.set_defaults(func=_grade)
+
+    p = sub.add_parser("create-clinic", help="register a clinic and create its schema")
+    p.add_argument("slug")
+    p.add_argument("--name", required=True)
+    p.add_argument("--database-url", help="keep the clinic in its own database (default: the main one)")
+    p.set_defaults(func=_create_clinic)
+
+    p = sub.add_parser("list-clinics", help="show the clinics and where they live")
+    p.set_defaults(func=_list_clinics)
+
+    p = sub.add_parser("move-clinic", help="copy a clinic to another database and switch it over")
+    p.add_argument("slug")
+    p.add_argument("database_url")
+    p.add_argument("--drain-seconds", type=float, default=10.0, help="wait for in-flight writes before copying")
+    p.add_argument("--settle-seconds", type=float, default=900.0,
+                   help="how long to wait for the clinic's running jobs and commands before giving up")
+    p.set_defaults(func=_move_clinic)
+
+    args = parser.parse_args(argv)
+    args.clinic = getattr(args, "clinic", "default")
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,117 @@ class Settings(BaseSettings):
     secret_key: str = "replace_me"
     access_token_expire_minutes: int = 120
 
+    # Background jobs (app/worker). Turn the in-process pool off when running
+    # dedicated `python -m app.worker` processes instead.
+    job_worker_in_app: bool = True
+    job_poll_interval: float = 1.0
+    job_stale_after: int = 600  # seconds without progress before a "running" job is re-queued (or failed)
+
+    # Writing-answer drafts are buffered and flushed in batches this often.
+    autosave_flush_interval: float = 0.3
+
+    # Uploaded images, served under /static; created at startup.
+    upload_dir: str = "uploaded"
+
+    # Finished attempts older than this many months are moved to compressed
+    # monthly files by `python -m app.cli archive`.
+    archive_dir: str = "archive"
+    archive_after_months: int = 12
+
+    # Item analysis keeps answer arrays in memory and only fetches new rows;
+    # they are reloaded from scratch after this many seconds. Each worker
+    # keeps at most analytics_cache_mb of arrays (least recently used go
+    # first) and drops those unused for analytics_rebuild_seconds.
+    analytics_rebuild_seconds: int = 3600
+    analytics_cache_mb: int = 256
+
+    # Bulk user import hashes passwords in one process pool per worker,
+    # started on the first import that writes; 0 means one process per core.
+    import_hash_workers: int = 0
+
+    # Deleted assignments can be restored for this long before their records
+    # and answers are purged, purge_batch_size rows per statement.
+    assignment_restore_hours: int = 24
+    purge_batch_size: int = 5000
+
+    # Fold an attempt's mcq_answer rows into packed arrays on finish.
+    compact_mcq_answers: bool = False
+
+    # Writing answers within this share of the answer key's length in edits
+    # (Levenshtein) are graded correct; 0 accepts normalised exact matches only.
+    grading_tolerance: float = 0.0
+
+    # Clinics (core/tenancy.py): requests name theirs in tenant_header until
+    # they hold a token; workers re-read the clinic list this often.
+    tenant_header: str = "X-Clinic"
+    clinic_registry_ttl: float = 5.0
+
+    # Connection pool per worker process; the first db_pool_warm connections
+    # are opened at startup so the first requests do not pay for them.
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_warm: int = 5
+
+    # SQL accounting per request (middleware/queries.py): debug headers and
+    # N+1 warnings; strict turns exceeded route query budgets into 500s (tests).
+    query_debug: bool = False
+    query_budget_strict: bool = False
+    query_n1_threshold: int = 3
+
+    # Admission control (utils/admission.py): per-user token buckets per route
+    # class, a per-user concurrency cap and a bounded number of requests in
+    # flight per worker (0: db_pool_size + db_max_overflow), of which
+    # admission_reserved_practice are kept for patient practice routes.
+    admission_control: bool = True
+    admission_capacity: int = 0
+    admission_reserved_practice: int = 5
+    admission_user_concurrency: int = 4
+    admission_queue_timeout: float = 5.0
+
+    # Item response-time telemetry (utils/telemetry.py): events are buffered
+    # per worker (oldest overwritten when full) and COPYed to item_event in
+    # batches of telemetry_batch_size, at least every flush interval.
+    telemetry_buffer_size: int = 100_000
+    telemetry_batch_size: int = 5000
+    telemetry_flush_interval: float = 1.0
+
+    # Response cache (utils/cache.py): per-worker LRU in front of a shared
+    # backend (file: directory shared by the workers of a host; redis: URL of
+    # any Redis-compatible server; memory: single worker; none).
+    cache_backend: str = "file"
+    cache_url: str = "cache"
+    cache_ttl: float = 30.0
+    cache_local_ttl: float = 2.0
+    cache_local_size: int = 1024
+    cache_sweep_interval: float = 300.0  # seconds between removals of expired files (file backend)
+
+    # GET /doctor/caseload pages are cached this long; binds, assignments
+    # and reviews by the doctor invalidate them at once.
+    caseload_cache_ttl: float = 15.0
+
+    # Sampling profiler (utils/profiler.py, armed via /admin/profiler): where
+    # profiles go and how many / how old they may get before being pruned.
+    profile_dir: str = "profiles"
+    profile_keep: int = 200
+    profile_keep_days: int = 7
+
+    # Request tracing (utils/tracing.py). Errors and requests slower than
+    # trace_slow_ms are always kept, others sampled at about
+    # trace_sample_per_second; exported as JSON lines or OTLP/HTTP JSON.
+    tracing: bool = False
+    trace_exporter: str = "file"  # file | otlp
+    trace_file: str = "traces/traces.jsonl"
+    trace_file_max_bytes: int = 100 * 1024 * 1024
+    trace_otlp_endpoint: str = "http://localhost:4318"
+    trace_service_name: str = "ait-backend"
+    trace_sample_per_second: float = 5.0
+    trace_slow_ms: float = 500.0
+
+    # Response compression (middleware/compression.py); fast levels, it runs per request.
+    compression_min_size: int = 1024
+    compression_gzip_level: int = 5
+    compression_brotli_quality: int = 4
+
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
 settings = Settings() 
\ No newline at end of file
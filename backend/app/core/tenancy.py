@@ -0,0 +1,51 @@
+"""The clinic (tenant) a request, job or command runs for.
+
+Each clinic's users, assignments, records and answers live in their own
+Postgres schema (``clinic_<slug>``). The rows of the ``default`` clinic live
+in ``public``, so a single-clinic installation looks exactly as it always
+has. A clinic may also live in a database of its own (``database_url``).
+``app.database`` routes every session to the current tenant's database and
+sets ``search_path`` to its schema. Unqualified table names then only ever
+reach that clinic's tables.
+
+The current tenant is a context variable. It is set by
+``TenantMiddleware`` from the access token (``tid`` claim), by the worker
+from the job's ``tenant_id`` and by the CLI from ``--clinic``.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator
+
+
+@dataclass(frozen=True)
+class Tenant:
+    id: int
+    slug: str
+    schema: str
+    database_url: str | None = None  # None: the main database
+    status: str = "active"  # active | moving
+
+    @property
+    def key(self) -> str:
+        """Prefix for cache keys and other per-process state ('' for the default clinic)."""
+        return f"t{self.id}:" if self.id else ""
+
+
+DEFAULT = Tenant(0, "default", "public")
+
+_current: ContextVar[Tenant] = ContextVar("tenant", default=DEFAULT)
+
+
+def current() -> Tenant:
+    return _current.get()
+
+
+@contextmanager
+def use(tenant: Tenant) -> Iterator[Tenant]:
+    """Run the block for ``tenant``."""
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
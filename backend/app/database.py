@@ -1,20 +1,73 @@
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import event, select, text
 from sqlalchemy.exc import OperationalError
 import asyncio
 import logging
 
+from .core import tenancy
 from .core.config import settings
-from .models import Base
+from .models import Base, Clinic, Job
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    return create_async_engine(
+        url,
+        echo=False,
+        future=True,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_pre_ping=True,
+    )
+
+
+engine = _create_engine(settings.database_url)
+
+# clinics moved to a database of their own (core/tenancy.py), by URL
+_engines: dict[str, AsyncEngine] = {}
+
+
+def engine_for(tenant: tenancy.Tenant | None = None) -> AsyncEngine:
+    """Engine of ``tenant``'s database (default: the current tenant)."""
+    url = (tenant or tenancy.current()).database_url
+    if not url or url == settings.database_url:
+        return engine
+    if url not in _engines:
+        _engines[url] = _create_engine(url)
+    return _engines[url]
+
+
+async def dispose_engines() -> None:
+    for e in (engine, *_engines.values()):
+        await e.dispose()
+
+
+class TenantSession(AsyncSession):
+    """Session bound to the current clinic's database, on its schema."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        tenant = tenancy.current()
+        kwargs["bind"] = engine_for(tenant)
+        super().__init__(*args, **kwargs)
+        if tenant.schema != "public":
+            self.sync_session.info["search_path"] = tenant.schema
+
+
+@event.listens_for(Session, "after_begin")
+def _set_search_path(session, transaction, connection) -> None:
+    # LOCAL: ends with the transaction, pooled connections come back clean
+    schema = session.info.get("search_path")
+    if schema:
+        connection.exec_driver_sql(
+            f'SET LOCAL search_path TO "{schema}", public', execution_options={"tenant_setup": True}
+        )
 
-engine = create_async_engine(settings.database_url, echo=False, future=True)
 
 AsyncSessionLocal = sessionmaker(
     bind=engine,
-    class_=AsyncSession,
+    class_=TenantSession,
     expire_on_commit=False,
 )
 
@@ -22,6 +75,12 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
         yield session 
 
+
+def tenant_tables() -> list:
+    """Tables every clinic has in its own schema (in dependency order)."""
+    return [t for t in Base.metadata.sorted_tables if t.schema is None]
+
+
 # Helper to create tables in development environments (not for production migrations)
 async def init_models() -> None:
     """Create database tables based on SQLAlchemy models.
@@ -34,78 +93,355 @@ async def init_models() -> None:
     await _wait_for_db()
 
     async with engine.begin() as conn:
+        # Several workers start at once; run the DDL below one at a time.
+        await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('init_models'))"))
+
         # Create tables that don't exist yet
         await conn.run_sync(Base.metadata.create_all)
+        await _migrate(conn)
 
-        # -----------------------------------------------------------------
-        # Quick-fix migrations for dev environments ------------------------
-        # Add generic columns to assignment_items_base if missing so that
-        # the new typed-table schema aligns with an older database.
-        # In production use Alembic instead.
-        # -----------------------------------------------------------------
-        await conn.execute(
-            text(
-                """
-                ALTER TABLE assignment_items_base
-                ADD COLUMN IF NOT EXISTS prompt TEXT;
-                """
+    async with engine.connect() as conn:
+        clinics = (await conn.execute(select(Clinic.__table__))).all()
+    for clinic in clinics:
+        await init_schema(tenancy.Tenant(clinic.id, clinic.slug, clinic.schema_name, clinic.database_url))
+
+
+async def init_schema(tenant: tenancy.Tenant) -> None:
+    """Create or migrate ``tenant``'s schema (and its database's job queue)."""
+    async with engine_for(tenant).begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('init_models'))"))
+        await conn.run_sync(Base.metadata.create_all, tables=[Job.__table__])
+        await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{tenant.schema}"'))
+        await conn.execute(text(f'SET LOCAL search_path TO "{tenant.schema}", public'))
+        await conn.run_sync(
+            lambda c: Base.metadata.create_all(
+                c.execution_options(schema_translate_map={None: tenant.schema}), tables=tenant_tables()
             )
         )
-        await conn.execute(
-            text(
-                """
-                ALTER TABLE assignment_items_base
-                ADD COLUMN IF NOT EXISTS image_path TEXT;
-                """
-            )
+        await _migrate(conn)
+
+
+async def _migrate(conn) -> None:
+    """Dev migrations of the tables on ``conn``'s search_path."""
+    # -----------------------------------------------------------------
+    # Quick-fix migrations for dev environments ------------------------
+    # Add generic columns to assignment_items_base if missing so that
+    # the new typed-table schema aligns with an older database.
+    # In production use Alembic instead.
+    # -----------------------------------------------------------------
+    await conn.execute(
+        text(
+            """
+            ALTER TABLE assignment_items_base
+            ADD COLUMN IF NOT EXISTS prompt TEXT;
+            """
+        )
+    )
+    await conn.execute(
+        text(
+            """
+            ALTER TABLE assignment_items_base
+            ADD COLUMN IF NOT EXISTS image_path TEXT;
+            """
         )
+    )
 
-        # Allow multiple attempts per patient/assignment by dropping the unique
-        # constraint that previously enforced one record only.
-        await conn.execute(
-            text(
-                """
-                ALTER TABLE assignment_record
-                DROP CONSTRAINT IF EXISTS assignment_record_assignment_id_patient_id_key;
-                """
-            )
+    # Allow multiple attempts per patient/assignment by dropping the unique
+    # constraint that previously enforced one record only.
+    await conn.execute(
+        text(
+            """
+            ALTER TABLE assignment_record
+            DROP CONSTRAINT IF EXISTS assignment_record_assignment_id_patient_id_key;
+            """
         )
+    )
 
-        # Ensure a (non-unique) index exists for efficient look-ups.
-        await conn.execute(
-            text(
-                """
-                CREATE INDEX IF NOT EXISTS idx_assignment_record_assignment_patient
-                ON assignment_record (assignment_id, patient_id);
-                """
-            )
+    # Ensure a (non-unique) index exists for efficient look-ups.
+    await conn.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS idx_assignment_record_assignment_patient
+            ON assignment_record (assignment_id, patient_id);
+            """
         )
+    )
 
-        # Ensure writing_answer.item_id points to assignment_items_base with
-        # ON DELETE CASCADE so that answers are removed when an admin deletes
-        # or replaces items while editing an assignment.
-        await conn.execute(
-            text(
-                """
-                -- Remove legacy FK that points to writing_items and blocks
-                -- deletion of items that already have answers.
-                ALTER TABLE writing_answer
-                DROP CONSTRAINT IF EXISTS writing_answer_item_id_fkey;
-                """
-            )
+    await conn.execute(
+        text(
+            """
+            ALTER TABLE assignments
+            ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;
+            """
+        )
+    )
+    await conn.execute(
+        text(
+            """
+            ALTER TABLE assignment_record
+            ADD COLUMN IF NOT EXISTS mcq_item_ids INTEGER[],
+            ADD COLUMN IF NOT EXISTS mcq_choices SMALLINT[],
+            ADD COLUMN IF NOT EXISTS mcq_correct VARBIT;
+            """
         )
+    )
 
-        await conn.execute(
-            text(
-                """
-                ALTER TABLE writing_answer
-                ADD CONSTRAINT writing_answer_item_id_fkey
-                FOREIGN KEY (item_id)
-                REFERENCES assignment_items_base(id)
-                ON DELETE CASCADE;
-                """
-            )
+    # Delta sync (utils/sync.py): every insert/update of the synced tables
+    # takes the next value of the schema's sequence, item edits bump their
+    # assignment and unassignments leave a tombstone. The shared advisory
+    # lock (keyed on the schema) shows in-flight writers in pg_locks, so the
+    # sync endpoint can wait for them before it hands out a cursor. Nothing
+    # takes it exclusively.
+    for stmt in (
+        "ALTER TABLE assignments ADD COLUMN IF NOT EXISTS change_seq BIGINT",
+        "ALTER TABLE assignment_patient ADD COLUMN IF NOT EXISTS change_seq BIGINT",
+        "ALTER TABLE assignment_record ADD COLUMN IF NOT EXISTS change_seq BIGINT, ADD COLUMN IF NOT EXISTS client_ref VARCHAR(64)",
+        "ALTER TABLE writing_answer ADD COLUMN IF NOT EXISTS change_seq BIGINT",
+        "CREATE INDEX IF NOT EXISTS ix_assignments_change_seq ON assignments (change_seq)",
+        "CREATE INDEX IF NOT EXISTS idx_assignment_patient_patient_seq ON assignment_patient (patient_id, change_seq)",
+        "CREATE INDEX IF NOT EXISTS idx_assignment_record_patient_seq ON assignment_record (patient_id, change_seq)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uix_assignment_record_client_ref ON assignment_record (patient_id, client_ref) WHERE client_ref IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS ix_writing_answer_change_seq ON writing_answer (change_seq)",
+        "CREATE SEQUENCE IF NOT EXISTS change_seq",
+        """
+        CREATE OR REPLACE FUNCTION bump_change_seq() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_advisory_xact_lock_shared(hashtext(current_schema()), hashtext('change_seq'));
+            NEW.change_seq := nextval('change_seq');
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION bump_assignment_change_seq() RETURNS trigger AS $$
+        BEGIN
+            UPDATE assignments SET change_seq = NULL
+            WHERE id = CASE TG_OP WHEN 'DELETE' THEN OLD.assignment_id ELSE NEW.assignment_id END
+              AND deleted_at IS NULL;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tombstone_assignment_patient() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_advisory_xact_lock_shared(hashtext(current_schema()), hashtext('change_seq'));
+            INSERT INTO sync_tombstone (change_seq, patient_id, assignment_id)
+            VALUES (nextval('change_seq'), OLD.patient_id, OLD.assignment_id);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+        """,
+        *(
+            f"CREATE OR REPLACE TRIGGER {table}_change_seq BEFORE INSERT OR UPDATE ON {table} "
+            "FOR EACH ROW EXECUTE FUNCTION bump_change_seq()"
+            for table in ("assignments", "assignment_patient", "assignment_record", "writing_answer")
+        ),
+        "CREATE OR REPLACE TRIGGER assignment_items_base_change_seq AFTER INSERT OR UPDATE OR DELETE "
+        "ON assignment_items_base FOR EACH ROW EXECUTE FUNCTION bump_assignment_change_seq()",
+        "CREATE OR REPLACE TRIGGER assignment_patient_tombstone AFTER DELETE ON assignment_patient "
+        "FOR EACH ROW EXECUTE FUNCTION tombstone_assignment_patient()",
+    ):
+        await conn.execute(text(stmt))
+
+    # JSON -> JSONB so properties/choices are stored parsed and can be
+    # filtered (GIN, containment) in SQL. Only rewrites tables still on json.
+    await conn.execute(
+        text(
+            """
+            DO $$
+            BEGIN
+                IF (SELECT data_type FROM information_schema.columns
+                    WHERE table_schema = current_schema() AND table_name = 'assignments' AND column_name = 'properties') = 'json' THEN
+                    ALTER TABLE assignments ALTER COLUMN properties TYPE JSONB USING properties::jsonb;
+                END IF;
+                IF (SELECT data_type FROM information_schema.columns
+                    WHERE table_schema = current_schema() AND table_name = 'mcq_items' AND column_name = 'choices') = 'json' THEN
+                    ALTER TABLE mcq_items ALTER COLUMN choices TYPE JSONB USING choices::jsonb;
+                END IF;
+            END $$;
+            """
+        )
+    )
+    await conn.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS idx_assignments_properties
+            ON assignments USING gin (properties jsonb_path_ops);
+            """
+        )
+    )
+
+    # History queries load answers by record and archival scans records by
+    # start time; BRIN stays tiny on this append-only column.
+    await conn.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS idx_mcq_answer_record
+            ON mcq_answer (record_id);
+            """
+        )
+    )
+    await conn.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS idx_assignment_record_started_brin
+            ON assignment_record USING brin (started_at);
+            """
+        )
+    )
+
+    # Writing answers graded by the server (utils/grading.py); only the
+    # ones it cannot resolve stay pending, and the review queue, the
+    # caseload overview and backfills look those up by record.
+    await conn.execute(
+        text(
+            """
+            ALTER TABLE writing_answer
+            ADD COLUMN IF NOT EXISTS auto_graded BOOLEAN;
+            """
+        )
+    )
+    await conn.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS idx_writing_answer_pending
+            ON writing_answer (record_id) WHERE reviewed = false;
+            """
+        )
+    )
+
+    # The caseload overview and most doctor endpoints look patients up by
+    # doctor.
+    await conn.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS idx_users_doctor_id
+            ON users (doctor_id);
+            """
+        )
+    )
+
+    # Binding history lives in doctor_patient_bindings alone (utils/bindings.py):
+    # fold in whatever the never-written doctor_patient_history table holds.
+    # Pending reviews can be routed to a doctor other than the patient's.
+    await conn.execute(
+        text(
+            """
+            ALTER TABLE doctor_patient_bindings
+            ADD COLUMN IF NOT EXISTS actor_id INTEGER;
+            """
+        )
+    )
+    await conn.execute(
+        text(
+            """
+            DO $$
+            BEGIN
+                IF to_regclass(current_schema() || '.doctor_patient_history') IS NOT NULL THEN
+                    INSERT INTO doctor_patient_bindings (doctor_id, doctor_name, patient_id, patient_name, action_time, state)
+                    SELECT doctor_id, doctor_name, patient_id, patient_name, timestamp, left(state, 16)
+                    FROM doctor_patient_history;
+                    DROP TABLE doctor_patient_history;
+                END IF;
+            END $$;
+            """
+        )
+    )
+    for stmt in (
+        "CREATE INDEX IF NOT EXISTS idx_doctor_patient_bindings_patient_time ON doctor_patient_bindings (patient_id, action_time)",
+        "CREATE INDEX IF NOT EXISTS idx_doctor_patient_bindings_doctor_time ON doctor_patient_bindings (doctor_id, action_time)",
+        "ALTER TABLE writing_answer ADD COLUMN IF NOT EXISTS reviewer_id INTEGER REFERENCES users(id) ON DELETE SET NULL",
+        "ALTER TABLE writing_answer ADD COLUMN IF NOT EXISTS submitted BOOLEAN NOT NULL DEFAULT true",
+        "ALTER TABLE archived_record ADD COLUMN IF NOT EXISTS batch VARCHAR(32)",
+        "CREATE INDEX IF NOT EXISTS idx_writing_answer_reviewer_pending ON writing_answer (reviewer_id) "
+        "WHERE reviewed = false AND reviewer_id IS NOT NULL",
+    ):
+        await conn.execute(text(stmt))
+
+    # submit_writing and the autosave buffer upsert on (record_id, item_id);
+    # older databases may lack the unique index, keep the newest answer.
+    await conn.execute(
+        text(
+            """
+            DELETE FROM writing_answer a
+            USING writing_answer b
+            WHERE a.record_id = b.record_id AND a.item_id = b.item_id AND a.id < b.id;
+            """
         )
+    )
+    await conn.execute(
+        text(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS uix_writing_answer_record_item
+            ON writing_answer (record_id, item_id);
+            """
+        )
+    )
+
+    # Ensure writing_answer.item_id points to assignment_items_base with
+    # ON DELETE CASCADE so that answers are removed when an admin deletes
+    # or replaces items while editing an assignment.
+    await conn.execute(
+        text(
+            """
+            -- Remove legacy FK that points to writing_items and blocks
+            -- deletion of items that already have answers.
+            ALTER TABLE writing_answer
+            DROP CONSTRAINT IF EXISTS writing_answer_item_id_fkey;
+            """
+        )
+    )
+
+    await conn.execute(
+        text(
+            """
+            ALTER TABLE writing_answer
+            ADD CONSTRAINT writing_answer_item_id_fkey
+            FOREIGN KEY (item_id)
+            REFERENCES assignment_items_base(id)
+            ON DELETE CASCADE;
+            """
+        )
+    )
+
+    # Jobs run for the clinic that queued them (core/tenancy.py).
+    await conn.execute(
+        text(
+            """
+            ALTER TABLE public.jobs
+            ADD COLUMN IF NOT EXISTS tenant_id INTEGER NOT NULL DEFAULT 0;
+            """
+        )
+    )
+
+async def warm_pool(n: int) -> None:
+    """Open ``n`` pooled connections up front (bounded by the pool size)."""
+    n = min(n, settings.db_pool_size)
+    if n <= 0:
+        return
+    barrier = asyncio.Barrier(n)
+
+    async def _touch() -> None:
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+                await barrier.wait()  # hold it until all n are open
+        except BaseException:
+            await barrier.abort()
+            raise
+
+    results = await asyncio.gather(*(_touch() for _ in range(n)), return_exceptions=True)
+    failed = [r for r in results if isinstance(r, Exception) and not isinstance(r, asyncio.BrokenBarrierError)]
+    if failed:
+        logging.warning("Pool warm-up failed: %s", failed[0])
+
+
+async def ping_db(timeout: float = 2.0) -> bool:
+    try:
+        async with asyncio.timeout(timeout):
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        return False
 
 # ---------------------------------------------------------------------------
 # Helper: Wait for database readiness
@@ -1,15 +1,89 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
 from .api.auth import router as auth_router
 from .api.admin import router as admin_router
 from .api.doctor import router as doctor_router
 from .api.assignments import router as assignment_router
 from .api.patient import router as patient_router
-from .database import init_models
+from .api.jobs import router as jobs_router
+from .api.health import router as health_router
+from .api.profiler import router as profiler_router
+from .core.config import settings
+from .database import dispose_engines, init_models, warm_pool
+from .middleware import AdmissionMiddleware, CompressionMiddleware, PrecompressedStaticFiles, ProfilerMiddleware, QueryCountMiddleware, TenantMiddleware, TracingMiddleware
+from .utils import onboarding
+from .utils.autosave import autosave
+from .utils.cache import cache
+from .utils.telemetry import telemetry
+from .utils.tracing import tracer
+from .worker import WorkerPool
+
+log = logging.getLogger(__name__)
+
+
+async def _prepare(app: FastAPI) -> None:
+    # Runs in the background so the server accepts connections (and answers
+    # /health/live) while the database is still coming up.
+    while True:
+        try:
+            await init_models()
+            break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Database initialisation failed, retrying")
+            await asyncio.sleep(5)
+    await warm_pool(settings.db_pool_warm)
+    if settings.job_worker_in_app:
+        app.state.job_pool = WorkerPool()
+        await app.state.job_pool.start()
+    app.state.ready = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    os.makedirs(settings.upload_dir, exist_ok=True)
+    await autosave.start()
+    await telemetry.start()
+    await cache.start()
+    prepare = asyncio.create_task(_prepare(app))
+    try:
+        yield
+    finally:
+        # in-flight requests are drained by the server before this runs
+        app.state.ready = False
+        prepare.cancel()
+        try:
+            await prepare
+        except (asyncio.CancelledError, Exception):
+            pass
+        pool = getattr(app.state, "job_pool", None)
+        if pool is not None:
+            await pool.stop()
+        await autosave.stop()
+        await telemetry.stop()
+        await cache.stop()
+        await asyncio.to_thread(onboarding.shutdown_pool)
+        await asyncio.to_thread(tracer.exporter.close)
+        await dispose_engines()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+
+# innermost: routes, and nothing else, run with the request's clinic
+app.add_middleware(TenantMiddleware)
+
+# added early, so it runs inside CORS: 429s carry CORS headers and
+# preflights are answered without spending tokens
+if settings.admission_control:
+    app.add_middleware(AdmissionMiddleware)
 
 # Allow CORS for local development (adjust origins in production)
 app.add_middleware(
@@ -19,20 +93,35 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.compression_min_size,
+    gzip_level=settings.compression_gzip_level,
+    brotli_quality=settings.compression_brotli_quality,
+)
+if settings.query_debug or settings.query_budget_strict:
+    app.add_middleware(
+        QueryCountMiddleware,
+        n1_threshold=settings.query_n1_threshold,
+        strict=settings.query_budget_strict,
+    )
+if settings.tracing:
+    app.add_middleware(TracingMiddleware)
+# no-op until armed through /admin/profiler
+app.add_middleware(ProfilerMiddleware)
 
-# Serve uploaded images
-app.mount("/static", StaticFiles(directory="uploaded"), name="static")
-
-# Create tables automatically on startup (dev convenience)
-@app.on_event("startup")
-async def on_startup():
-    await init_models()
+# Serve uploaded images (and .br/.gz siblings written by `app.cli precompress`)
+# (the directory is created by the lifespan, not when this module is imported)
+app.mount("/static", PrecompressedStaticFiles(directory=settings.upload_dir, check_dir=False), name="static")
 
 app.include_router(auth_router)
 app.include_router(admin_router)
 app.include_router(doctor_router)
 app.include_router(assignment_router)
 app.include_router(patient_router)
+app.include_router(jobs_router)
+app.include_router(health_router)
+app.include_router(profiler_router)
 
 @app.get("/ping")
 async def ping():
@@ -0,0 +1,8 @@
+"""ASGI middleware and mounts used by :mod:`app.main`."""
+from .admission import AdmissionMiddleware  # noqa: F401
+from .compression import CompressionMiddleware  # noqa: F401
+from .profiling import ProfilerMiddleware  # noqa: F401
+from .queries import QueryCountMiddleware  # noqa: F401
+from .static import PrecompressedStaticFiles  # noqa: F401
+from .tenancy import TenantMiddleware  # noqa: F401
+from .tracing import TracingMiddleware  # noqa: F401
@@ -0,0 +1,42 @@
+"""Applies :mod:`app.utils.admission` to every HTTP request.
+
+The slot is held until the response has been sent, so streamed exports
+count against their caller and their lane for as long as they run.
+"""
+import json
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..utils.admission import Admission, Rejected, admission as default_admission, classify, identify
+
+
+class AdmissionMiddleware:
+    def __init__(self, app: ASGIApp, admission: Admission | None = None) -> None:
+        self.app = app
+        self.admission = admission or default_admission
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        rc = classify(scope["path"]) if scope["type"] == "http" else None
+        if rc is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        client = scope.get("client")
+        key = identify(authorization, client[0] if client else "unknown")
+        try:
+            await self.admission.enter(key, rc)
+        except Rejected as e:
+            body = json.dumps({"detail": f"Too many requests ({e.reason})"}).encode()
+            await send({"type": "http.response.start", "status": 429, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(e.retry_after).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.leave(key, rc)
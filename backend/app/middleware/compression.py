@@ -0,0 +1,131 @@
+"""Negotiated gzip/brotli compression of API responses.
+
+Only complete, single-message bodies above ``minimum_size`` are compressed.
+Streaming responses (exports), bodies that already carry a
+``Content-Encoding``, partial content and binary media types pass through
+untouched. Brotli is used when the ``brotli`` package is installed and the
+client accepts it; levels default to fast settings since this runs per
+request.
+"""
+import asyncio
+import gzip
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+COMPRESSIBLE = ("text/", "application/json", "application/x-ndjson", "application/javascript", "application/xml", "image/svg+xml")
+_THREAD_MIN_SIZE = 128 * 1024  # compress bigger bodies off the event loop
+
+
+def accepted_encodings(header: str) -> dict[str, float]:
+    """``Accept-Encoding`` as ``{coding: q}`` (lower-cased)."""
+    out: dict[str, float] = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        out[coding.strip().lower()] = q
+    return out
+
+
+def negotiate(header: str, available: tuple[str, ...] | None = None) -> str | None:
+    """Best of ``available`` (default: br if installed, then gzip) the client accepts."""
+    if available is None:
+        available = ("br", "gzip") if brotli is not None else ("gzip",)
+    accepted = accepted_encodings(header)
+    for coding in available:
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.partition(";")[0].strip().lower()
+    return media_type.startswith(COMPRESSIBLE) or media_type.endswith(("+json", "+xml"))
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 5, brotli_quality: int = 4) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        coding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+        await _Responder(self, coding, send).run(scope, receive)
+
+    def compress(self, body: bytes, coding: str) -> bytes:
+        if coding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+
+class _Responder:
+    def __init__(self, middleware: CompressionMiddleware, coding: str, send: Send) -> None:
+        self.mw = middleware
+        self.coding = coding
+        self.send = send
+        self.start: Message | None = None
+        self.passthrough = False
+
+    async def run(self, scope: Scope, receive: Receive) -> None:
+        await self.mw.app(scope, receive, self.on_send)
+
+    async def on_send(self, message: Message) -> None:
+        if self.passthrough:
+            await self.send(message)
+            return
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            if (
+                "content-encoding" in headers
+                or message["status"] in (204, 206, 304)
+                or not is_compressible(headers.get("content-type", ""))
+            ):
+                self.passthrough = True
+                await self.send(message)
+            else:
+                self.start = message  # held back until the body size is known
+            return
+        if message["type"] != "http.response.body":
+            self.passthrough = True
+            await self.send(self.start)
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        self.passthrough = True  # whatever happens below, later messages go straight out
+        if message.get("more_body", False) or len(body) < self.mw.minimum_size:
+            # streaming (exports) or too small to be worth it
+            await self.send(self.start)
+            await self.send(message)
+            return
+        if len(body) >= _THREAD_MIN_SIZE:
+            compressed = await asyncio.to_thread(self.mw.compress, body, self.coding)
+        else:
+            compressed = self.mw.compress(body, self.coding)
+        headers = MutableHeaders(raw=self.start["headers"])
+        headers.add_vary_header("Accept-Encoding")
+        headers["Content-Encoding"] = self.coding
+        headers["Content-Length"] = str(len(compressed))
+        await self.send(self.start)
+        await self.send({"type": "http.response.body", "body": compressed})
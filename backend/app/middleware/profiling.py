@@ -0,0 +1,33 @@
+"""Arms :mod:`app.utils.profiler` per request.
+
+Disarmed, a request costs one :meth:`Profiler.armed` call (a clock read, and
+a ``stat`` once a second). Armed, requests are selected by method and path
+before routing, so only the chosen ones pay for the sampler.
+"""
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..utils.profiler import Profiler, profiler as default_profiler
+
+
+class ProfilerMiddleware:
+    def __init__(self, app: ASGIApp, profiler: Profiler | None = None) -> None:
+        self.app = app
+        self.profiler = profiler or default_profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        config = self.profiler.armed() if scope["type"] == "http" else None
+        if config is None or not self.profiler.select(config, scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        meta = {"endpoint": None, "route": None, "method": scope["method"], "path": scope["path"], "status": None}
+
+        async def send_recording(message):
+            if message["type"] == "http.response.start":
+                meta["status"] = message["status"]
+                route = scope.get("route")  # set by the router by now
+                meta["endpoint"] = getattr(route, "name", None)
+                meta["route"] = getattr(route, "path", None)
+            await send(message)
+
+        await self.profiler.run(config, meta, lambda: self.app(scope, receive, send_recording))
@@ -0,0 +1,61 @@
+"""Debug-mode SQL accounting per request (see utils/queries.py).
+
+Adds ``X-Query-Count`` / ``X-Query-Time-Ms`` (and ``X-Query-Repeated`` for
+likely N+1 shapes) to every response and logs offenders. With
+``settings.query_budget_strict`` a route over its :func:`query_budget`
+answers 500 instead, so test suites fail loudly.
+"""
+import json
+import logging
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..utils.queries import budget_of, count_queries
+
+log = logging.getLogger(__name__)
+
+
+class QueryCountMiddleware:
+    def __init__(self, app: ASGIApp, n1_threshold: int = 3, strict: bool = False) -> None:
+        self.app = app
+        self.n1_threshold = n1_threshold
+        self.strict = strict
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        replaced = False
+
+        async def send_with_counts(message: Message) -> None:
+            nonlocal replaced
+            if replaced:
+                return  # body of a response we swapped for the budget error
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                name = getattr(route, "name", scope["path"])
+                budget = budget_of(getattr(route, "endpoint", None))
+                repeated = stats.repeated(self.n1_threshold)
+                if repeated:
+                    log.warning("Possible N+1 in %s %s: %s", scope["method"], name, stats.summary(self.n1_threshold))
+                if budget is not None and stats.count > budget:
+                    log.error("Query budget of %s exceeded (%d > %d): %s", name, stats.count, budget, stats.summary(self.n1_threshold))
+                    if self.strict:
+                        replaced = True
+                        body = json.dumps({"detail": f"Query budget exceeded: {name} ran {stats.count} > {budget} queries"}).encode()
+                        await send({"type": "http.response.start", "status": 500, "headers": [
+                            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        ]})
+                        await send({"type": "http.response.body", "body": body})
+                        return
+                headers = MutableHeaders(scope=message)
+                headers["X-Query-Count"] = str(stats.count)
+                headers["X-Query-Time-Ms"] = f"{stats.seconds * 1000:.1f}"
+                if repeated:
+                    headers["X-Query-Repeated"] = str(max(repeated.values()))
+            await send(message)
+
+        with count_queries() as stats:
+            await self.app(scope, receive, send_with_counts)
@@ -0,0 +1,88 @@
+"""``/static`` with pre-compressed siblings.
+
+:func:`precompress` (``python -m app.cli precompress``) writes ``name.br`` and
+``name.gz`` next to compressible files; :class:`PrecompressedStaticFiles`
+serves the best sibling the client accepts. Responses are plain
+``FileResponse`` objects, so Range requests, conditional requests and the
+ASGI ``pathsend`` zero-copy extension (where the server offers it) work for
+the compressed variants too.
+"""
+import gzip
+import os
+from mimetypes import guess_type
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from .compression import brotli, is_compressible, negotiate
+
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        media_type = guess_type(str(full_path))[0] or "application/octet-stream"
+        if not is_compressible(media_type):
+            return super().file_response(full_path, stat_result, scope, status_code)
+        request_headers = Headers(scope=scope)
+        available = tuple(c for c in SUFFIXES if _fresh(f"{full_path}{SUFFIXES[c]}", stat_result))
+        coding = negotiate(request_headers.get("accept-encoding", ""), available) if available else None
+        if coding is None:
+            response = super().file_response(full_path, stat_result, scope, status_code)
+            if available:
+                response.headers["vary"] = "Accept-Encoding"
+            return response
+        path = f"{full_path}{SUFFIXES[coding]}"
+        response = FileResponse(
+            path,
+            status_code=status_code,
+            stat_result=os.stat(path),
+            media_type=media_type,
+            headers={"content-encoding": coding, "vary": "Accept-Encoding"},
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def _fresh(path: str, original: os.stat_result) -> bool:
+    try:
+        return os.stat(path).st_mtime >= original.st_mtime
+    except OSError:
+        return False
+
+
+def precompress(directory: str, min_size: int = 1024, force: bool = False) -> dict[str, int]:
+    """Write ``.gz`` (and ``.br`` if brotli is installed) siblings; returns counts and bytes."""
+    stats = {"files": 0, "written": 0, "bytes_in": 0, "bytes_out": 0}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if name.endswith((".br", ".gz", ".upload")) or not is_compressible(guess_type(name)[0] or ""):
+                continue
+            st = os.stat(path)
+            if st.st_size < min_size:
+                continue
+            stats["files"] += 1
+            with open(path, "rb") as f:
+                data = f.read()
+            variants = {"gzip": lambda d: gzip.compress(d, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants["br"] = lambda d: brotli.compress(d, quality=11)
+            for coding, compress in variants.items():
+                target = path + SUFFIXES[coding]
+                if not force and _fresh(target, st):
+                    continue
+                out = compress(data)
+                if len(out) >= len(data) * 0.9:
+                    continue  # not worth a second representation
+                tmp = target + ".tmp"
+                with open(tmp, "wb") as f:
+                    f.write(out)
+                os.replace(tmp, target)
+                stats["written"] += 1
+                stats["bytes_in"] += len(data)
+                stats["bytes_out"] += len(out)
+    return stats
@@ -0,0 +1,65 @@
+"""Resolves the clinic of every request (see core/tenancy.py).
+
+Authenticated requests run for the clinic in their token's ``tid`` claim.
+Requests without a token (login, registration) name theirs in the
+``settings.tenant_header`` header by slug; without either, the default
+clinic. While a clinic is being moved to another database it answers reads
+but refuses writes with 503.
+"""
+import json
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..core import tenancy
+from ..core.config import settings
+from ..utils.clinics import ClinicRegistry, registry as default_registry
+from ..utils.security import decode_token
+
+_SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class TenantMiddleware:
+    def __init__(self, app: ASGIApp, registry: ClinicRegistry | None = None) -> None:
+        self.app = app
+        self.registry = registry or default_registry
+        self.header = settings.tenant_header.lower().encode("latin-1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        tenant, error = tenancy.DEFAULT, None
+        claims = None
+        if authorization[:7].lower() == "bearer ":
+            from jose import JWTError
+
+            try:
+                claims = decode_token(authorization[7:])
+            except JWTError:
+                pass  # the route answers 401
+        if claims is not None:
+            if claims.get("tid"):
+                tenant = await self.registry.get(claims["tid"])
+                if tenant is None:
+                    error = 401, "Unknown clinic"
+        elif self.header in headers:
+            tenant = await self.registry.by_slug(headers[self.header].decode("latin-1").strip().lower())
+            if tenant is None:
+                error = 404, "Unknown clinic"
+        if tenant is not None and tenant.status == "moving" and scope.get("method", "GET") not in _SAFE_METHODS:
+            error = 503, "Clinic is being moved, try again shortly"
+
+        if error is not None and scope["type"] == "http":
+            status, detail = error
+            body = json.dumps({"detail": detail}).encode()
+            response_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+            if status == 503:
+                response_headers.append((b"retry-after", b"30"))
+            await send({"type": "http.response.start", "status": status, "headers": response_headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+        with tenancy.use(tenant or tenancy.DEFAULT):
+            await self.app(scope, receive, send)
@@ -0,0 +1,63 @@
+"""Opens a :class:`~app.utils.tracing.Trace` per HTTP request.
+
+The request id comes from ``X-Request-ID`` (or is generated) and is echoed
+on the response; a W3C ``traceparent`` header makes the request part of the
+caller's trace. The root span is named after the route template, and the
+gap between the endpoint returning and the response starting is recorded
+as ``serialize``.
+"""
+import re
+import time
+import uuid
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..utils.tracing import Trace, Tracer, end_trace, start_trace, tracer as default_tracer
+
+_REQUEST_ID = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+_TRACEPARENT = re.compile(r"00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}")
+
+
+class TracingMiddleware:
+    def __init__(self, app: ASGIApp, tracer: Tracer | None = None) -> None:
+        self.app = app
+        self.tracer = tracer or default_tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")
+        if not _REQUEST_ID.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        parent = _TRACEPARENT.fullmatch(headers.get(b"traceparent", b"").decode("latin-1"))
+        trace = Trace(request_id, *(parent.groups() if parent else ()))
+        attrs = {"http.method": scope["method"], "http.target": scope["path"], "request_id": request_id}
+
+        async def send_traced(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                now = time.time_ns()
+                if trace.serialize_from is not None:
+                    trace.add("serialize", trace.serialize_from, now, None, {})
+                attrs["http.status_code"] = message["status"]
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        tokens = start_trace(trace)
+        start = time.time_ns()
+        try:
+            await self.app(scope, receive, send_traced)
+        except BaseException as exc:
+            attrs["error"] = type(exc).__name__
+            raise
+        finally:
+            end = time.time_ns()
+            end_trace(tokens)
+            route = scope.get("route")
+            path = getattr(route, "path", None)
+            if path:
+                attrs["http.route"] = path
+            self.tracer.finish(trace, f"{scope['method']} {path or scope['path']}", start, end, attrs)
@@ -4,9 +4,14 @@ Base = declarative_base()
 
 # Import models here so Alembic can detect them
 from .user import User  # noqa: E402,F401
-from .doctor_patient_history import DoctorPatientHistory  # noqa: E402,F401
 from .binding import DoctorPatientBinding  # noqa: E402,F401
 from .assignment import Assignment, AssignmentItem  # noqa: E402,F401
 from .assignment_details import AssignmentItemBase, MCQItem, WritingItem  # noqa: E402,F401
 from .assignment_patient import AssignmentPatient  # noqa: E402,F401
-from .assignment_record import AssignmentRecord, MCQAnswer, WritingAnswer  # noqa: E402,F401 
\ No newline at end of file
+from .assignment_record import AssignmentRecord, MCQAnswer, WritingAnswer  # noqa: E402,F401
+from .archived_record import ArchivedRecord  # noqa: E402,F401
+from .job import Job  # noqa: E402,F401
+from .sync_tombstone import SyncTombstone  # noqa: E402,F401
+from .item_event import ItemEvent  # noqa: E402,F401
+from .patient_recommendation import PatientRecommendation  # noqa: E402,F401
+from .clinic import Clinic  # noqa: E402,F401
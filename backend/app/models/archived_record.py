@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, func
+from ..models import Base
+
+class ArchivedRecord(Base):
+    """Summary of an attempt whose answers were moved to the monthly archive files."""
+
+    __tablename__ = "archived_record"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # original assignment_record.id
+    assignment_id = Column(Integer, ForeignKey("assignments.id", ondelete="CASCADE"))
+    patient_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    score = Column(Integer, nullable=True)
+    month = Column(String(7), nullable=False)  # YYYY-MM, names the archive file
+    batch = Column(String(32), nullable=True)  # archive lines of other batches are ignored (NULL: older archives)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (Index("idx_archived_record_assignment_patient", "assignment_id", "patient_id"),)
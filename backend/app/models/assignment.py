@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, JSON, Boolean, DateTime, func
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, JSON, Boolean, DateTime, Index, func, or_
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from ..models import Base
 
@@ -9,9 +10,13 @@ class Assignment(Base):
     topic = Column(Integer, nullable=False)  # 1-9
     title = Column(String(256), nullable=False)
     qtype = Column(String(16), nullable=False)  # multiple_choice, drag_drop, writing
-    properties = Column(JSON, nullable=True)    # num_choices, manual_review, etc.
+    properties = Column(JSONB, nullable=True)   # numChoices, manualReview (schemas.assignment.AssignmentProperties)
     created_by = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # soft delete: hidden immediately, purged by the assignment.purge job
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
+    # delta sync: bumped by trigger on any write here or to the items
+    change_seq = Column(BigInteger, nullable=True, index=True)
 
     # Relationship to legacy JSON items (kept for backward-compatibility)
     items = relationship(
@@ -29,6 +34,21 @@ class Assignment(Base):
         lazy="selectin",
     )
 
+    # jsonb_path_ops serves the @> containment filters of property_filters()
+    __table_args__ = (
+        Index("idx_assignments_properties", "properties", postgresql_using="gin", postgresql_ops={"properties": "jsonb_path_ops"}),
+    )
+
+def property_filters(manual_review: bool | None = None, num_choices: int | None = None) -> list:
+    """WHERE clauses for the assignment list endpoints' property filters."""
+    clauses = []
+    if manual_review is not None:
+        manual = Assignment.properties.contains({"manualReview": True})
+        clauses.append(manual if manual_review else or_(Assignment.properties.is_(None), ~manual))
+    if num_choices is not None:
+        clauses.append(Assignment.properties.contains({"numChoices": num_choices}))
+    return clauses
+
 class AssignmentItem(Base):
     __tablename__ = "assignment_items"
 
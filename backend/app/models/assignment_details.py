@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, JSON, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from ..models import Base
 
@@ -28,7 +29,7 @@ class MCQItem(Base):
     __tablename__ = "mcq_items"
 
     id = Column(Integer, ForeignKey("assignment_items_base.id", ondelete="CASCADE"), primary_key=True)
-    choices = Column(JSON, nullable=True)  # list[ {text,image} ]
+    choices = Column(JSONB, nullable=True)  # list[ {text,image} ]
     answer_key = Column(Integer, nullable=True)
 
     base = relationship("AssignmentItemBase", back_populates="mcq", uselist=False)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey, DateTime, UniqueConstraint, func
+from sqlalchemy import Column, Integer, BigInteger, ForeignKey, DateTime, UniqueConstraint, Index, func
 from sqlalchemy.orm import relationship
 from ..models import Base
 
@@ -9,8 +9,12 @@ class AssignmentPatient(Base):
     assignment_id = Column(Integer, ForeignKey("assignments.id", ondelete="CASCADE"))
     patient_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     assigned_at = Column(DateTime(timezone=True), server_default=func.now())
+    change_seq = Column(BigInteger, nullable=True)  # delta sync, set by trigger
 
-    __table_args__ = (UniqueConstraint("assignment_id", "patient_id", name="uix_assignment_patient"),)
+    __table_args__ = (
+        UniqueConstraint("assignment_id", "patient_id", name="uix_assignment_patient"),
+        Index("idx_assignment_patient_patient_seq", "patient_id", "change_seq"),
+    )
 
     # optional relationships
     assignment = relationship("Assignment")
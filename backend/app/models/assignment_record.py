@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, ForeignKey, DateTime, Boolean, String, func
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, Index, ForeignKey, DateTime, Boolean, String, UniqueConstraint, func, true
+from sqlalchemy.dialects.postgresql import ARRAY, BIT
 from sqlalchemy.orm import relationship
 from ..models import Base
 
@@ -11,6 +12,20 @@ class AssignmentRecord(Base):
     started_at = Column(DateTime(timezone=True), server_default=func.now())
     finished_at = Column(DateTime(timezone=True), nullable=True)
     score = Column(Integer, nullable=True)
+    # packed MCQ answers of a finished attempt, see utils/answers.py
+    mcq_item_ids = Column(ARRAY(Integer), nullable=True)
+    mcq_choices = Column(ARRAY(SmallInteger), nullable=True)
+    mcq_correct = Column(BIT(varying=True), nullable=True)
+    # set by the bump_change_seq trigger on every write (delta sync)
+    change_seq = Column(BigInteger, nullable=True)
+    # idempotency key of attempts uploaded from offline clients
+    client_ref = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        Index("idx_assignment_record_patient_seq", "patient_id", "change_seq"),
+        Index("uix_assignment_record_client_ref", "patient_id", "client_ref", unique=True,
+              postgresql_where=client_ref.is_not(None)),
+    )
 
     assignment = relationship("Assignment")
     patient = relationship("User")
@@ -35,7 +50,16 @@ class WritingAnswer(Base):
     record_id = Column(Integer, ForeignKey("assignment_record.id", ondelete="CASCADE"))
     item_id = Column(Integer, ForeignKey("assignment_items_base.id", ondelete="CASCADE"))
     answer_text = Column(String)
+    # False while the text is an autosaved draft; drafts never overwrite a submitted answer
+    submitted = Column(Boolean, nullable=False, default=True, server_default=true())
     reviewed = Column(Boolean, default=False)
     correct = Column(Boolean, nullable=True)
+    auto_graded = Column(Boolean, nullable=True)  # reviewed by utils/grading.py, not a doctor
+    # pending review routed to this doctor instead of the patient's (utils/bindings.py)
+    reviewer_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    change_seq = Column(BigInteger, nullable=True, index=True)
+
+    # one answer per item and attempt; target of the submit/autosave upserts
+    __table_args__ = (UniqueConstraint("record_id", "item_id", name="uix_writing_answer_record_item"),)
 
     record = relationship("AssignmentRecord", back_populates="writing_answers") 
\ No newline at end of file
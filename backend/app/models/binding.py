@@ -1,7 +1,11 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, func
 from ..models import Base
 
 class DoctorPatientBinding(Base):
+    """Doctor-patient binding history: one row per bind ('bounded') or unbind
+    ('unbounded'); a transfer writes both (utils/bindings.py). ``users.doctor_id``
+    holds the current binding."""
+
     __tablename__ = "doctor_patient_bindings"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -10,4 +14,10 @@ class DoctorPatientBinding(Base):
     patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     patient_name = Column(String(256), nullable=False)
     action_time = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
-    state = Column(String(16), nullable=False)  # 'bounded' or 'unbounded' 
\ No newline at end of file
+    state = Column(String(16), nullable=False)  # 'bounded' or 'unbounded'
+    actor_id = Column(Integer, nullable=True)  # who bound/unbound: the doctor or an admin
+
+    __table_args__ = (
+        Index("idx_doctor_patient_bindings_patient_time", "patient_id", "action_time"),
+        Index("idx_doctor_patient_bindings_doctor_time", "doctor_id", "action_time"),
+    )
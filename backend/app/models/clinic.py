@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, func
+from ..models import Base
+
+class Clinic(Base):
+    """A tenant (core/tenancy.py); its rows live in schema ``schema_name``.
+
+    Shared by all clinics, so pinned to ``public``. The ``default`` clinic
+    (tenant id 0, schema ``public``) has no row here.
+    """
+
+    __tablename__ = "clinics"
+    __table_args__ = {"schema": "public"}
+
+    id = Column(Integer, primary_key=True)
+    slug = Column(String(63), unique=True, nullable=False)
+    name = Column(String(255), nullable=False)
+    schema_name = Column(String(63), unique=True, nullable=False)
+    database_url = Column(Text, nullable=True)  # None: the main database
+    status = Column(String(16), nullable=False, default="active")  # active | moving
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, DateTime, Index
+from ..models import Base
+
+class ItemEvent(Base):
+    """A client-reported item view, answer or answer change (utils/telemetry.py).
+
+    Append-only and written with COPY in batches; ``ts`` is the client's
+    clock, so only differences between events of one client are meaningful.
+    """
+
+    __tablename__ = "item_event"
+
+    id = Column(BigInteger, primary_key=True)
+    patient_id = Column(Integer, nullable=False)
+    assignment_id = Column(Integer, nullable=False)  # no FKs: nothing may slow the COPY down
+    item_id = Column(Integer, nullable=False)
+    kind = Column(SmallInteger, nullable=False)  # see telemetry.KINDS
+    ts = Column(DateTime(timezone=True), nullable=False)
+    received_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (Index("idx_item_event_assignment_item", "assignment_id", "item_id"),)
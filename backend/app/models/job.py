@@ -0,0 +1,28 @@
+from sqlalchemy import Column, Integer, String, Text, JSON, DateTime, Index, func
+from ..models import Base
+
+class Job(Base):
+    """Durable unit of background work, claimed by workers with SKIP LOCKED.
+
+    One queue per database, shared by the clinics in it; ``tenant_id`` is
+    the clinic the job runs for (0: default).
+    """
+
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, nullable=False, default=0, server_default="0")
+    kind = Column(String(64), nullable=False)          # e.g. image.transcode
+    payload = Column(JSON, nullable=False, default=dict)
+    status = Column(String(16), nullable=False, default="queued")  # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    progress = Column(JSON, nullable=True)
+    result = Column(JSON, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (Index("idx_jobs_claim", "status", "kind", "run_after"), {"schema": "public"})
@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, Float, DateTime, ForeignKeyConstraint, Index
+from ..models import Base
+
+class PatientRecommendation(Base):
+    """Spaced-repetition state of one assignment for one patient (utils/recommendations.py).
+
+    Rows exist only for assigned pairs: unassigning (or purging) an
+    assignment removes them through the foreign key.
+    """
+
+    __tablename__ = "patient_recommendation"
+
+    patient_id = Column(Integer, primary_key=True)
+    assignment_id = Column(Integer, primary_key=True)
+    due_at = Column(DateTime(timezone=True), nullable=False)
+    interval_days = Column(Float, nullable=False, default=0.0)
+    ease = Column(Float, nullable=False, default=2.5)
+    repetitions = Column(Integer, nullable=False, default=0)  # successful reviews in a row
+    attempts = Column(Integer, nullable=False, default=0)
+    last_quality = Column(Integer, nullable=True)  # 0-5, from the latest graded attempt
+    last_finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["assignment_id", "patient_id"],
+            ["assignment_patient.assignment_id", "assignment_patient.patient_id"],
+            ondelete="CASCADE",
+        ),
+        Index("idx_patient_recommendation_due", "patient_id", "due_at"),
+    )
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, BigInteger, DateTime, Index, func
+from ..models import Base
+
+class SyncTombstone(Base):
+    """An unassignment, kept so delta sync can tell clients to drop the assignment."""
+
+    __tablename__ = "sync_tombstone"
+
+    id = Column(BigInteger, primary_key=True)
+    change_seq = Column(BigInteger, nullable=False)
+    patient_id = Column(Integer, nullable=False)
+    assignment_id = Column(Integer, nullable=False)  # no FK: the assignment may be purged
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (Index("idx_sync_tombstone_patient_seq", "patient_id", "change_seq"),)
@@ -0,0 +1,29 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+class MCQItemStats(BaseModel):
+    item_id: int
+    answers: int
+    correct_rate: Optional[float] = None
+    choice_counts: List[int]
+    discrimination: Optional[float] = None  # point-biserial, item vs rest of attempt
+
+class WritingItemStats(BaseModel):
+    item_id: int
+    answers: int
+    reviewed: int
+    correct_rate: Optional[float] = None
+
+class PatientTrend(BaseModel):
+    patient_id: int
+    attempts: int
+    slope_per_day: Optional[float] = None  # change of correct rate per day
+    last_rate: float
+
+class AssignmentAnalytics(BaseModel):
+    assignment_id: int
+    records: int
+    mcq_answers: int
+    mcq_items: List[MCQItemStats]
+    writing_items: List[WritingItemStats]
+    trends: List[PatientTrend]
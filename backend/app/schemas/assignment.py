@@ -1,5 +1,5 @@
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 
 class Choice(BaseModel):
     text: str | None = None
@@ -13,13 +13,31 @@ class ItemCreate(BaseModel):
     # either type here.
     answer_key: int | str | None = None
 
+class AssignmentProperties(BaseModel):
+    """Validated once on write; reads return the stored JSONB as-is."""
+    model_config = ConfigDict(extra="allow")
+
+    numChoices: Optional[int] = Field(None, ge=2, le=10)
+    manualReview: Optional[bool] = None
+
 class AssignmentCreate(BaseModel):
     topic: int
     title: str
     qtype: str  # multiple_choice, drag_drop, writing
-    properties: Optional[dict] = None
+    properties: Optional[AssignmentProperties] = None
     items: List[ItemCreate]
 
+class AssignmentClone(BaseModel):
+    """Overrides for a copy made by ``POST /assignments/{id}/clone``; unset fields are copied."""
+    title: Optional[str] = Field(None, max_length=256)  # default: "<title> (copy)"
+    topic: Optional[int] = None
+    properties: Optional[AssignmentProperties] = None  # merged over the source's
+    shuffle_choices: bool = False
+    seed: Optional[str] = Field(None, max_length=64)  # same seed, same choice order
+
+class AssignmentCloneBulk(BaseModel):
+    variants: List[AssignmentClone] = Field(..., min_length=1, max_length=100)
+
 class ItemRead(ItemCreate):
     id: int
 
@@ -39,4 +39,17 @@ class AssignmentReadV2(BaseModel):
     properties: Optional[dict]
 
     class Config:
-        orm_mode = True 
\ No newline at end of file
+        orm_mode = True
+
+    @classmethod
+    def from_assignment(cls, ass, **extra) -> "AssignmentReadV2":
+        """Build from an Assignment with ``items_detail`` (and their mcq/writing) loaded."""
+        items: List[ItemRead] = []
+        for base in ass.items_detail:
+            if base.mcq:
+                items.append(MCQItemRead(id=base.id, prompt=base.prompt, image_path=base.image_path,
+                                         choices=base.mcq.choices, answer_key=base.mcq.answer_key))
+            elif base.writing:
+                items.append(WritingItemRead(id=base.id, prompt=base.prompt, image_path=base.image_path,
+                                             answer_key=base.writing.answer_key, manual_review=base.writing.manual_review))
+        return cls(id=ass.id, topic=ass.topic, title=ass.title, qtype=ass.qtype, properties=ass.properties, items=items, **extra)
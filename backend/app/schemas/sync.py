@@ -0,0 +1,57 @@
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+from .assignment_v2 import AssignmentReadV2
+
+class SyncAssignment(AssignmentReadV2):
+    version: int = 0  # change_seq of the assignment content
+
+class SyncRecord(BaseModel):
+    id: int
+    assignment_id: int
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    score: Optional[int] = None
+
+class SyncWritingAnswer(BaseModel):
+    record_id: int
+    item_id: int
+    answer_text: str
+    reviewed: Optional[bool] = None
+    correct: Optional[bool] = None
+
+class SyncOut(BaseModel):
+    cursor: int  # pass back as ?since= on the next sync
+    full: bool   # since=0: the lists are complete, drop anything not in them
+    assignments: List[SyncAssignment]
+    removed_assignments: List[int]
+    records: List[SyncRecord]
+    writing_answers: List[SyncWritingAnswer]
+
+# --------------------- offline upload -----------------------
+class OfflineMCQAnswer(BaseModel):
+    item_id: int
+    choice_index: int
+    is_correct: bool
+
+class OfflineWritingAnswer(BaseModel):
+    item_id: int
+    answer_text: str
+
+class OfflineAttempt(BaseModel):
+    client_ref: str = Field(min_length=1, max_length=64)  # retries with the same ref are ignored
+    assignment_id: int
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    score: Optional[int] = None
+    mcq_answers: List[OfflineMCQAnswer] = []
+    writing_answers: List[OfflineWritingAnswer] = []
+
+class SyncUpload(BaseModel):
+    attempts: List[OfflineAttempt] = Field(max_length=200)
+
+class SyncUploadResult(BaseModel):
+    client_ref: str
+    record_id: Optional[int] = None
+    status: str  # created | duplicate | not_assigned
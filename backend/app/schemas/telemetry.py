@@ -0,0 +1,29 @@
+from datetime import datetime
+from typing import List, Literal, Optional
+from pydantic import AwareDatetime, BaseModel, Field
+
+# item_event columns are INTEGER; one value out of range would fail the
+# COPY of a whole batch of other patients' events
+DB_INT = Field(ge=1, le=2**31 - 1)
+
+class ItemEventIn(BaseModel):
+    item_id: int = DB_INT
+    kind: Literal["view", "answer", "change"]
+    ts: AwareDatetime  # client clock, with timezone
+
+class ItemEventsIn(BaseModel):
+    events: List[ItemEventIn] = Field(max_length=200)
+
+class ItemResponseTimes(BaseModel):
+    assignment_id: int
+    item_id: int
+    views: int
+    answers: int
+    changes: int
+    timed: int  # answers with a preceding view, within max_seconds
+    mean_ms: Optional[float] = None
+    p50_ms: Optional[float] = None
+    p75_ms: Optional[float] = None
+    p90_ms: Optional[float] = None
+    p95_ms: Optional[float] = None
+    max_ms: Optional[float] = None
@@ -0,0 +1,78 @@
+"""Background job handlers, executed by :mod:`app.worker`."""
+import asyncio
+import os
+import sys
+
+from sqlalchemy import text
+
+from .core.config import settings
+from .database import AsyncSessionLocal
+from .utils.images import process_upload, ImageValidationError
+from .worker import task, JobContext, PermanentJobError
+
+
+@task("image.transcode", concurrency=2)
+async def transcode_image(ctx: JobContext):
+    """Crop/resize an uploaded image to WebP and move it to its public path."""
+    src, dst = ctx.payload["src"], ctx.payload["dst"]
+
+    def _run() -> None:
+        with open(src, "rb") as f:
+            data = f.read()
+        try:
+            processed = process_upload(data)
+        except ImageValidationError as e:
+            os.remove(src)
+            raise PermanentJobError(str(e))
+        with open(dst, "wb") as f:
+            f.write(processed)
+        os.remove(src)
+
+    await asyncio.to_thread(_run)
+    return {"path": ctx.payload["path"]}
+
+
+# Child tables first, each in bounded batches with a commit in between so no
+# statement holds locks for long. Item-level FKs cascade to mcq_items,
+# writing_items and any answers left pointing at the items.
+_PURGE_STEPS = [
+    ("mcq_answer", "DELETE FROM mcq_answer WHERE id IN (SELECT a.id FROM mcq_answer a JOIN assignment_record r ON r.id = a.record_id WHERE r.assignment_id = :aid LIMIT :n)"),
+    ("writing_answer", "DELETE FROM writing_answer WHERE id IN (SELECT a.id FROM writing_answer a JOIN assignment_record r ON r.id = a.record_id WHERE r.assignment_id = :aid LIMIT :n)"),
+    ("assignment_record", "DELETE FROM assignment_record WHERE id IN (SELECT id FROM assignment_record WHERE assignment_id = :aid LIMIT :n)"),
+    ("archived_record", "DELETE FROM archived_record WHERE id IN (SELECT id FROM archived_record WHERE assignment_id = :aid LIMIT :n)"),
+    ("item_event", "DELETE FROM item_event WHERE id IN (SELECT id FROM item_event WHERE assignment_id = :aid LIMIT :n)"),
+    ("assignment_patient", "DELETE FROM assignment_patient WHERE id IN (SELECT id FROM assignment_patient WHERE assignment_id = :aid LIMIT :n)"),
+    ("assignment_items_base", "DELETE FROM assignment_items_base WHERE id IN (SELECT id FROM assignment_items_base WHERE assignment_id = :aid LIMIT :n)"),
+    ("assignment_items", "DELETE FROM assignment_items WHERE id IN (SELECT id FROM assignment_items WHERE assignment_id = :aid LIMIT :n)"),
+]
+
+
+# Taken before every batch: a restore (FOR UPDATE) waits for the batch in
+# flight, and the next batch sees the assignment restored and stops.
+_STILL_DELETED = "SELECT 1 FROM assignments WHERE id = :aid AND deleted_at IS NOT NULL FOR SHARE"
+
+
+@task("assignment.purge", concurrency=1)
+async def purge_assignment(ctx: JobContext):
+    """Remove a soft-deleted assignment and everything hanging off it."""
+    aid = ctx.payload["assignment_id"]
+    deleted: dict[str, int] = {}
+    async with AsyncSessionLocal() as session:
+        for table, sql in _PURGE_STEPS:
+            while True:
+                if await session.scalar(text(_STILL_DELETED), {"aid": aid}) is None:
+                    await session.rollback()
+                    return {"purged": False, "deleted": deleted}  # restored (or already gone) meanwhile
+                n = (await session.execute(text(sql), {"aid": aid, "n": settings.purge_batch_size})).rowcount
+                await session.commit()
+                deleted[table] = deleted.get(table, 0) + n
+                await ctx.progress(stage=table, deleted=deleted)
+                if n < settings.purge_batch_size:
+                    break
+        await session.execute(text("DELETE FROM assignments WHERE id = :aid AND deleted_at IS NOT NULL"), {"aid": aid})
+        await session.commit()
+    # only a process that ran item analysis has the module (and NumPy) loaded
+    analytics = sys.modules.get(f"{__package__}.utils.analytics")
+    if analytics is not None:
+        analytics.forget(aid)
+    return {"purged": True, "deleted": deleted}
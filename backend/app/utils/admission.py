@@ -0,0 +1,275 @@
+"""Admission control: per-user rate limits, concurrency caps and priority lanes.
+
+:class:`~app.middleware.admission.AdmissionMiddleware` runs before routing
+and before any database work. It identifies the caller by the ``sub``
+claim of the bearer token (signature checked, as ``require_role`` will do
+later) or, for anonymous requests, by client address, and classifies the
+request by path into a route class (:data:`ROUTE_CLASSES`).
+A request is then:
+
+1. charged to the caller's token bucket for that class (429 when empty);
+2. counted against the caller's concurrency cap (429 when at the cap);
+3. let through the :class:`PriorityGate`. At most ``capacity`` requests
+   (about the DB pool size) run at once; lower lanes may only use the
+   capacity not reserved for patient practice routes. Waiters are woken by
+   lane, then FIFO, and are shed after ``admission_queue_timeout``.
+
+All state is per worker process, so limits apply per worker. Rejections
+carry ``Retry-After``; :data:`admission` counts admitted, queued and shed
+requests per class and reason (``GET /admin/admission``).
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import re
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from ..core.config import settings
+from .security import decode_token
+
+
+@dataclass(frozen=True)
+class RouteClass:
+    name: str
+    lane: int  # 0 is served first
+    rate: float  # tokens per second per caller
+    burst: int
+
+    @property
+    def low(self) -> bool:
+        return self.lane >= LOW_LANE
+
+
+LOW_LANE = 2
+
+ROUTE_CLASSES = {
+    c.name: c
+    for c in (
+        RouteClass("practice", 0, 20.0, 60),  # autosave posts come in bursts while typing
+        RouteClass("auth", 1, 1.0, 10),  # per address: slows password guessing
+        RouteClass("default", 1, 10.0, 40),
+        RouteClass("admin", 2, 10.0, 40),
+        RouteClass("bulk", 3, 0.5, 5),
+        RouteClass("export", 3, 0.2, 3),
+    )
+}
+
+# first match wins; paths not listed are "default", EXEMPT ones skip admission
+_RULES = [
+    (re.compile(p), name)
+    for p, name in (
+        (r"/patient/", "practice"),
+        (r"/auth/", "auth"),
+        (r"/doctor/(patients/\d+/)?export", "export"),
+        (r"/(admin|doctor)/analytics/", "export"),
+        (r"/admin/users/import", "bulk"),
+        (r"/assignments/image", "bulk"),
+        (r"/(admin|assignments|jobs)(/|$)", "admin"),
+    )
+]
+EXEMPT = re.compile(r"/(health/|static/|ping$|docs|redoc|openapi\.json)")
+
+
+def classify(path: str) -> RouteClass | None:
+    """Route class of ``path``; None for paths exempt from admission."""
+    if EXEMPT.match(path):
+        return None
+    for pattern, name in _RULES:
+        if pattern.match(path):
+            return ROUTE_CLASSES[name]
+    return ROUTE_CLASSES["default"]
+
+
+def identify(authorization: str | None, client: str) -> str:
+    """Caller key: the token's subject, else the client address."""
+    if authorization and authorization[:7].lower() == "bearer ":
+        from jose import JWTError
+
+        try:
+            claims = decode_token(authorization[7:])
+            if claims.get("tid"):
+                return f"user:{claims['tid']}:{claims['sub']}"
+            return f"user:{claims['sub']}"
+        except (JWTError, KeyError):
+            pass  # the route answers 401 itself; limit it like anonymous traffic
+    return f"addr:{client}"
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBuckets:
+    """One bucket per ``(caller, route class)``, refilled lazily."""
+
+    def __init__(self, max_keys: int = 50_000) -> None:
+        self._buckets: dict[tuple[str, str], list[float]] = {}  # key -> [tokens, stamp]
+        self.max_keys = max_keys
+
+    def take(self, key: str, rc: RouteClass) -> None:
+        now = time.monotonic()
+        bucket = self._buckets.get((key, rc.name))
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self._buckets[(key, rc.name)] = [float(rc.burst), now]
+        tokens = min(rc.burst, bucket[0] + (now - bucket[1]) * rc.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            raise Rejected("rate", (1 - tokens) / rc.rate)
+        bucket[0] = tokens - 1
+
+    def _prune(self, now: float) -> None:
+        # buckets that have refilled completely carry no state worth keeping
+        full = [
+            k for k, (tokens, stamp) in self._buckets.items()
+            if tokens + (now - stamp) * ROUTE_CLASSES[k[1]].rate >= ROUTE_CLASSES[k[1]].burst
+        ]
+        for k in full:
+            del self._buckets[k]
+
+
+class PriorityGate:
+    """Bounded in-flight requests; capacity beyond ``capacity - reserved`` is for lane 0."""
+
+    def __init__(self, capacity: int, reserved: int) -> None:
+        self.capacity = capacity
+        self.reserved = min(reserved, capacity - 1)
+        self.running = 0
+        self.running_low = 0
+        self._waiters: list[tuple[int, int, asyncio.Future, RouteClass]] = []
+        self._order = itertools.count()
+
+    def _fits(self, rc: RouteClass) -> bool:
+        if self.running >= self.capacity:
+            return False
+        return not rc.low or self.running_low < self.capacity - self.reserved
+
+    def _take(self, rc: RouteClass) -> None:
+        self.running += 1
+        if rc.low:
+            self.running_low += 1
+
+    async def acquire(self, rc: RouteClass, timeout: float) -> float:
+        """Wait for a slot; returns seconds waited. Raises :class:`Rejected` on timeout."""
+        ahead = any(w[0] <= rc.lane and not w[2].done() for w in self._waiters)
+        if not ahead and self._fits(rc):
+            self._take(rc)
+            return 0.0
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (rc.lane, next(self._order), waiter, rc))
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(rc)  # granted just as the timeout fired
+            else:
+                waiter.cancel()
+            raise Rejected("queue", timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(rc)
+            else:
+                waiter.cancel()
+            raise
+        return time.monotonic() - started
+
+    def release(self, rc: RouteClass) -> None:
+        self.running -= 1
+        if rc.low:
+            self.running_low -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        # Waiters are served in (lane, arrival) order; a low-lane waiter that
+        # does not fit is skipped so a practice request behind it can run.
+        skipped = []
+        while self._waiters and self.running < self.capacity:
+            entry = heapq.heappop(self._waiters)
+            waiter, rc = entry[2], entry[3]
+            if waiter.done():
+                continue  # timed out or cancelled
+            if not self._fits(rc):
+                skipped.append(entry)
+                continue
+            self._take(rc)
+            waiter.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for w in self._waiters if not w[2].done())
+
+
+class Admission:
+    def __init__(self) -> None:
+        self.buckets = TokenBuckets()
+        capacity = settings.admission_capacity or settings.db_pool_size + settings.db_max_overflow
+        self.gate = PriorityGate(capacity, settings.admission_reserved_practice)
+        self.per_user = settings.admission_user_concurrency
+        self.queue_timeout = settings.admission_queue_timeout
+        self.in_flight: Counter = Counter()
+        self.admitted: Counter = Counter()
+        self.queued: Counter = Counter()
+        self.wait_seconds: Counter = Counter()
+        self.shed: dict[str, Counter] = defaultdict(Counter)  # class -> reason -> n
+
+    async def enter(self, key: str, rc: RouteClass) -> None:
+        """Admit or raise :class:`Rejected`; pair with :meth:`leave`."""
+        try:
+            self.buckets.take(key, rc)
+            if self.in_flight[key] >= self.per_user:
+                raise Rejected("concurrency", 1)
+            self.in_flight[key] += 1
+            try:
+                waited = await self.gate.acquire(rc, self.queue_timeout)
+            except BaseException:
+                self._leave_user(key)
+                raise
+        except Rejected as e:
+            self.shed[rc.name][e.reason] += 1
+            raise
+        self.admitted[rc.name] += 1
+        if waited:
+            self.queued[rc.name] += 1
+            self.wait_seconds[rc.name] += waited
+
+    def leave(self, key: str, rc: RouteClass) -> None:
+        self.gate.release(rc)
+        self._leave_user(key)
+
+    def _leave_user(self, key: str) -> None:
+        self.in_flight[key] -= 1
+        if self.in_flight[key] <= 0:
+            del self.in_flight[key]
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.gate.capacity,
+            "reserved_practice": self.gate.reserved,
+            "running": self.gate.running,
+            "running_low": self.gate.running_low,
+            "waiting": self.gate.queued,
+            "callers_in_flight": len(self.in_flight),
+            "classes": {
+                name: {
+                    "admitted": self.admitted[name],
+                    "queued": self.queued[name],
+                    "wait_ms": round(self.wait_seconds[name] * 1000, 1),
+                    "shed": dict(self.shed[name]),
+                }
+                for name in ROUTE_CLASSES
+            },
+        }
+
+
+admission = Admission()
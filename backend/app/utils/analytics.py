@@ -0,0 +1,248 @@
+"""Item analysis over answer data, vectorised with NumPy.
+
+Answers of an assignment are streamed through a server-side cursor into
+column arrays and kept per (clinic, assignment) in :data:`_cache`. Later calls only
+fetch answers with a higher id than the last one seen and recompute the
+statistics over the grown arrays. Packed answers (utils/answers.py) are only
+read by full reloads, which happen every
+``settings.analytics_rebuild_seconds`` so deletions (archival, assignment
+deletes) are eventually reflected.
+
+The cache is a per-worker LRU of at most ``settings.analytics_cache_mb``.
+Entries unused for ``analytics_rebuild_seconds`` are dropped, and the purge
+of a deleted assignment drops its entry (:func:`forget`).
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+from sqlalchemy import select, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core import tenancy
+from ..core.config import settings
+from ..models.assignment_record import AssignmentRecord, MCQAnswer, WritingAnswer
+from .answers import mcq_rows
+
+_BATCH = 50_000
+
+
+@dataclass
+class _AnswerArrays:
+    last_id: int = 0
+    loaded_at: float = 0.0
+    used_at: float = 0.0
+    answer_id: np.ndarray = field(default_factory=lambda: np.empty(0, np.int64))
+    record_id: np.ndarray = field(default_factory=lambda: np.empty(0, np.int64))
+    item_id: np.ndarray = field(default_factory=lambda: np.empty(0, np.int64))
+    choice: np.ndarray = field(default_factory=lambda: np.empty(0, np.int64))
+    correct: np.ndarray = field(default_factory=lambda: np.empty(0, bool))
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    stats: tuple | None = None  # (key, items, trends) of the last computation
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.answer_id, self.record_id, self.item_id, self.choice, self.correct))
+
+
+_cache: OrderedDict[tuple[int, int], _AnswerArrays] = OrderedDict()  # least recently used first
+
+
+def _trim(now: float) -> None:
+    """Drop idle entries, then the least recently used ones while over the size limit."""
+    limit = settings.analytics_cache_mb * 1024 * 1024
+    total = sum(d.nbytes() for d in _cache.values())
+    for key, data in list(_cache.items()):
+        if data.lock.locked():
+            continue  # being loaded or read; looked at again next time
+        if now - data.used_at > settings.analytics_rebuild_seconds or total > limit:
+            total -= data.nbytes()
+            del _cache[key]
+
+
+def forget(assignment_id: int) -> None:
+    """Drop the cached arrays of ``assignment_id`` in the current clinic."""
+    _cache.pop((tenancy.current().id, assignment_id), None)
+
+
+async def _load_mcq(session: AsyncSession, assignment_id: int, data: _AnswerArrays) -> int:
+    if len(data.answer_id):
+        # incremental: packed answers were already seen as rows before packing
+        stmt = (
+            select(MCQAnswer.id, MCQAnswer.record_id, MCQAnswer.item_id, MCQAnswer.choice_index, MCQAnswer.is_correct)
+            .join(AssignmentRecord, AssignmentRecord.id == MCQAnswer.record_id)
+            .filter(AssignmentRecord.assignment_id == assignment_id, MCQAnswer.id > data.last_id)
+        )
+    else:
+        stmt = mcq_rows(AssignmentRecord.assignment_id == assignment_id)
+    m = stmt.subquery()
+    stmt = select(m).order_by(m.c.id).execution_options(yield_per=_BATCH)
+    chunks = []
+    result = await session.stream(stmt)
+    async for rows in result.partitions():
+        ids, rec, item, choice, correct = zip(*rows)
+        chunks.append((
+            np.fromiter(ids, np.int64, len(rows)),
+            np.fromiter(rec, np.int64, len(rows)),
+            np.fromiter(item, np.int64, len(rows)),
+            np.fromiter((-1 if c is None else c for c in choice), np.int64, len(rows)),
+            np.fromiter((bool(c) for c in correct), bool, len(rows)),
+        ))
+    if not chunks:
+        return 0
+    cols = [np.concatenate([old, *parts]) for old, parts in zip(
+        (data.answer_id, data.record_id, data.item_id, data.choice, data.correct), zip(*chunks)
+    )]
+    data.answer_id, data.record_id, data.item_id, data.choice, data.correct = cols
+    data.last_id = max(data.last_id, int(data.answer_id[-1]))  # packed ids are negative
+    return sum(len(c[0]) for c in chunks)
+
+
+def _last_per_record_item(data: _AnswerArrays):
+    """Keep only the final answer a record gave per item (clicks are appended)."""
+    key = data.record_id * (int(data.item_id.max()) + 1) + data.item_id
+    order = np.argsort(data.answer_id)[::-1]
+    _, first = np.unique(key[order], return_index=True)
+    keep = np.sort(order[first])
+    return data.record_id[keep], data.item_id[keep], data.choice[keep], data.correct[keep]
+
+
+def _grouped_corr(g: np.ndarray, x: np.ndarray, y: np.ndarray, n_groups: int) -> np.ndarray:
+    n = np.bincount(g, minlength=n_groups).astype(float)
+    sx = np.bincount(g, x, n_groups)
+    sy = np.bincount(g, y, n_groups)
+    sxy = np.bincount(g, x * y, n_groups)
+    sxx = np.bincount(g, x * x, n_groups)
+    syy = np.bincount(g, y * y, n_groups)
+    num = n * sxy - sx * sy
+    den = np.sqrt((n * sxx - sx**2) * (n * syy - sy**2))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(den > 0, num / den, np.nan)
+
+
+def _grouped_slope(g: np.ndarray, t: np.ndarray, y: np.ndarray, n_groups: int) -> np.ndarray:
+    n = np.bincount(g, minlength=n_groups).astype(float)
+    st = np.bincount(g, t, n_groups)
+    sy = np.bincount(g, y, n_groups)
+    sty = np.bincount(g, t * y, n_groups)
+    stt = np.bincount(g, t * t, n_groups)
+    den = n * stt - st**2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(den > 0, (n * sty - st * sy) / den, np.nan)
+
+
+def _nan_to_none(a: np.ndarray) -> list[float | None]:
+    return [None if np.isnan(v) else round(float(v), 4) for v in a]
+
+
+def mcq_item_stats(data: _AnswerArrays) -> list[dict]:
+    """Correct rate, choice distribution and point-biserial discrimination per item."""
+    if not len(data.answer_id):
+        return []
+    rec, item, choice, correct = _last_per_record_item(data)
+    items, item_ix = np.unique(item, return_inverse=True)
+    _, rec_ix = np.unique(rec, return_inverse=True)
+    n_items = len(items)
+    x = correct.astype(float)
+
+    answers = np.bincount(item_ix, minlength=n_items)
+    rate = np.bincount(item_ix, x, n_items) / answers
+
+    n_choices = int(choice.max()) + 1 if choice.max() >= 0 else 0
+    valid = choice >= 0
+    dist = np.bincount(item_ix[valid] * n_choices + choice[valid], minlength=n_items * n_choices)
+    dist = dist.reshape(n_items, n_choices) if n_choices else np.zeros((n_items, 0), int)
+
+    # corrected item-total correlation: record total excluding the item itself
+    totals = np.bincount(rec_ix, x)
+    disc = _grouped_corr(item_ix, x, totals[rec_ix] - x, n_items)
+
+    return [
+        {"item_id": int(i), "answers": int(a), "correct_rate": r, "choice_counts": d.tolist(), "discrimination": p}
+        for i, a, r, d, p in zip(items, answers, _nan_to_none(rate), dist, _nan_to_none(disc))
+    ]
+
+
+def patient_trends(data: _AnswerArrays, records: list) -> list[dict]:
+    """Per-patient least-squares slope of attempt correct rate over time (per day)."""
+    if not len(data.answer_id) or not records:
+        return []
+    rec, _, _, correct = _last_per_record_item(data)
+    rec_ids, rec_ix = np.unique(rec, return_inverse=True)
+    rec_rate = np.bincount(rec_ix, correct.astype(float)) / np.bincount(rec_ix)
+
+    meta = {r.id: r for r in records}
+    known = np.fromiter((int(i) in meta for i in rec_ids), bool, len(rec_ids))
+    rec_ids, rec_rate = rec_ids[known], rec_rate[known]
+    if not len(rec_ids):
+        return []
+    patient = np.fromiter((meta[int(i)].patient_id for i in rec_ids), np.int64, len(rec_ids))
+    t = np.fromiter((meta[int(i)].started_at.timestamp() / 86400 for i in rec_ids), float, len(rec_ids))
+
+    patients, pat_ix = np.unique(patient, return_inverse=True)
+    t = t - t.min()  # keep the normal equations well conditioned
+    slope = _grouped_slope(pat_ix, t, rec_rate, len(patients))
+    attempts = np.bincount(pat_ix, minlength=len(patients))
+    # rate of the most recent attempt per patient
+    order = np.lexsort((t, pat_ix))
+    last = order[np.r_[np.flatnonzero(np.diff(pat_ix[order])), len(order) - 1]]
+
+    return [
+        {"patient_id": int(p), "attempts": int(a), "slope_per_day": s, "last_rate": round(float(l), 4)}
+        for p, a, s, l in zip(patients, attempts, _nan_to_none(slope), rec_rate[last])
+    ]
+
+
+async def writing_item_stats(session: AsyncSession, assignment_id: int) -> list[dict]:
+    # writing answers are updated in place (reviews), aggregate them in SQL
+    stmt = (
+        select(
+            WritingAnswer.item_id,
+            func.count(),
+            func.count().filter(WritingAnswer.reviewed.is_(True)),
+            func.avg(case((WritingAnswer.correct.is_(True), 1.0), else_=0.0)).filter(WritingAnswer.reviewed.is_(True)),
+        )
+        .join(AssignmentRecord, AssignmentRecord.id == WritingAnswer.record_id)
+        .filter(AssignmentRecord.assignment_id == assignment_id)
+        .group_by(WritingAnswer.item_id)
+        .order_by(WritingAnswer.item_id)
+    )
+    return [
+        {"item_id": i, "answers": n, "reviewed": r, "correct_rate": round(float(rate), 4) if rate is not None else None}
+        for i, n, r, rate in (await session.execute(stmt)).all()
+    ]
+
+
+async def assignment_analytics(session: AsyncSession, assignment_id: int, patient_ids: set[int] | None = None) -> dict:
+    """Item statistics for an assignment; trends limited to ``patient_ids`` if given."""
+    cache_key = (tenancy.current().id, assignment_id)
+    data = _cache.setdefault(cache_key, _AnswerArrays())
+    _cache.move_to_end(cache_key)
+    async with data.lock:
+        now = data.used_at = time.monotonic()
+        if now - data.loaded_at > settings.analytics_rebuild_seconds:
+            data = _cache[cache_key] = _AnswerArrays(lock=data.lock, loaded_at=now, used_at=now)
+        await _load_mcq(session, assignment_id, data)
+        records = (
+            await session.execute(
+                select(AssignmentRecord.id, AssignmentRecord.patient_id, AssignmentRecord.started_at)
+                .filter(AssignmentRecord.assignment_id == assignment_id)
+            )
+        ).all()
+        key = (data.last_id, len(data.answer_id), len(records))
+        if data.stats is None or data.stats[0] != key:
+            items, trends = await asyncio.to_thread(lambda: (mcq_item_stats(data), patient_trends(data, records)))
+            data.stats = (key, items, trends)
+        _, items, trends = data.stats
+    _trim(time.monotonic())
+    if patient_ids is not None:
+        trends = [t for t in trends if t["patient_id"] in patient_ids]
+    return {
+        "assignment_id": assignment_id,
+        "records": len(records),
+        "mcq_answers": int(len(data.answer_id)),
+        "mcq_items": items,
+        "writing_items": await writing_item_stats(session, assignment_id),
+        "trends": trends,
+    }
@@ -0,0 +1,149 @@
+"""Packed MCQ answers.
+
+With ``settings.compact_mcq_answers`` enabled, a finished attempt's
+``mcq_answer`` rows are folded into three arrays on ``assignment_record``:
+``mcq_item_ids`` (int[]), ``mcq_choices`` (smallint[]) and ``mcq_correct``
+(varbit, one bit per answer), in click order. The rows are deleted
+afterwards. Readers go through :func:`mcq_rows`, which yields packed and
+unpacked answers alike, or :func:`load_answers` for whole records.
+"""
+from collections import defaultdict
+from typing import Iterable
+
+from sqlalchemy import select, union_all, literal_column, true, func, text, cast, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from ..database import AsyncSessionLocal
+from ..models.assignment_record import AssignmentRecord, MCQAnswer, WritingAnswer
+
+# Packed answers have no row id; they get ids below every real one, ordered
+# by position so "last answer per item" logic still works within a record.
+PACKED_ID_OFFSET = 2**31
+
+# Appends to existing arrays, so re-packing a record that received more rows
+# after an earlier pack keeps the click order.
+_PACK = text("""
+WITH packed AS (
+    SELECT record_id,
+           array_agg(item_id ORDER BY id) AS items,
+           array_agg(choice_index::smallint ORDER BY id) AS choices,
+           string_agg(CASE WHEN is_correct THEN '1' ELSE '0' END, '' ORDER BY id)::varbit AS correct
+    FROM mcq_answer
+    WHERE record_id = ANY(:ids)
+    GROUP BY record_id
+), updated AS (
+    UPDATE assignment_record r
+    SET mcq_item_ids = coalesce(r.mcq_item_ids, '{}') || p.items,
+        mcq_choices = coalesce(r.mcq_choices, '{}') || p.choices,
+        mcq_correct = coalesce(r.mcq_correct, B'') || p.correct
+    FROM packed p
+    WHERE r.id = p.record_id
+    RETURNING r.id
+)
+DELETE FROM mcq_answer WHERE record_id IN (SELECT id FROM updated)
+""")
+
+
+async def pack_records(session: AsyncSession, record_ids: list[int]) -> int:
+    """Fold the mcq_answer rows of ``record_ids`` into their records; returns rows packed."""
+    if not record_ids:
+        return 0
+    return (await session.execute(_PACK, {"ids": record_ids})).rowcount
+
+
+async def pack_finished(batch_size: int = 1000) -> tuple[int, int]:
+    """Pack every finished record that still has mcq_answer rows; returns (records, rows)."""
+    records = rows = last = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            ids = list((await session.scalars(
+                select(AssignmentRecord.id)
+                .filter(
+                    AssignmentRecord.id > last,
+                    AssignmentRecord.finished_at.is_not(None),
+                    select(MCQAnswer.id).filter(MCQAnswer.record_id == AssignmentRecord.id).exists(),
+                )
+                .order_by(AssignmentRecord.id)
+                .limit(batch_size)
+            )).all())
+            if not ids:
+                return records, rows
+            rows += await pack_records(session, ids)
+            await session.commit()
+        records += len(ids)
+        last = ids[-1]
+
+
+def mcq_rows(*criteria) -> Select:
+    """``(id, record_id, item_id, choice_index, is_correct)`` for packed and unpacked answers.
+
+    ``criteria`` on :class:`AssignmentRecord` are applied to both branches.
+    """
+    R = AssignmentRecord
+    u = (
+        func.unnest(R.mcq_item_ids, R.mcq_choices)
+        .table_valued("item_id", "choice_index", with_ordinality="ord")
+        .render_derived()
+    )
+    packed = (
+        select(
+            (u.c.ord - PACKED_ID_OFFSET).label("id"),
+            R.id.label("record_id"),
+            u.c.item_id,
+            u.c.choice_index,
+            (func.substring(R.mcq_correct, cast(u.c.ord, Integer), 1) == literal_column("B'1'")).label("is_correct"),
+        )
+        .select_from(R)
+        .join(u, true())  # set-returning function in FROM: implicitly LATERAL
+        .filter(R.mcq_item_ids.is_not(None), *criteria)
+    )
+    rows = select(MCQAnswer.id, MCQAnswer.record_id, MCQAnswer.item_id, MCQAnswer.choice_index, MCQAnswer.is_correct)
+    if criteria:
+        rows = rows.join(R, R.id == MCQAnswer.record_id).filter(*criteria)
+    return union_all(rows, packed)
+
+
+def unpack(rec) -> list[dict]:
+    """Decode the packed arrays of a loaded record (ORM object or row)."""
+    if rec.mcq_item_ids is None:
+        return []
+    # bits iterate as ints (asyncpg) or "0"/"1" (SQLAlchemy's BitString)
+    bits = list(rec.mcq_correct or ())
+    return [
+        {"item_id": i, "choice_index": c, "is_correct": bool(int(b))}
+        for i, c, b in zip(rec.mcq_item_ids, rec.mcq_choices, bits)
+    ]
+
+
+async def load_answers(session: AsyncSession, records: Iterable) -> dict[int, dict[str, list]]:
+    """Answers of ``records`` keyed by record id, as plain dicts.
+
+    Packed answers are decoded from the records themselves; leftover rows are
+    fetched with two column selects, without hydrating ORM objects.
+    """
+    records = list(records)
+    out: dict[int, dict[str, list]] = defaultdict(lambda: {"mcq_answers": [], "writing_answers": []})
+    for r in records:
+        out[r.id]["mcq_answers"].extend(unpack(r))
+    ids = [r.id for r in records]
+    if not ids:
+        return out
+    mcq = await session.execute(
+        select(MCQAnswer.record_id, MCQAnswer.item_id, MCQAnswer.choice_index, MCQAnswer.is_correct)
+        .filter(MCQAnswer.record_id.in_(ids))
+        .order_by(MCQAnswer.id)
+    )
+    for rid, item_id, choice, correct in mcq:
+        out[rid]["mcq_answers"].append({"item_id": item_id, "choice_index": choice, "is_correct": correct})
+    writing = await session.execute(
+        select(WritingAnswer.record_id, WritingAnswer.item_id, WritingAnswer.answer_text,
+               WritingAnswer.reviewed, WritingAnswer.correct)
+        .filter(WritingAnswer.record_id.in_(ids))
+        .order_by(WritingAnswer.id)
+    )
+    for rid, item_id, text_, reviewed, correct in writing:
+        out[rid]["writing_answers"].append(
+            {"item_id": item_id, "answer_text": text_, "reviewed": reviewed, "correct": correct}
+        )
+    return out
@@ -0,0 +1,184 @@
+"""Monthly archival of finished attempts to compressed CSV files.
+
+Finished records started before the hot window are moved, together with
+their answers, to ``{settings.archive_dir}/{YYYY-MM}.csv.gz`` and replaced by
+a summary row in ``archived_record``. :func:`load_archived` reads the answers
+back on demand, so history endpoints can still show old attempts while the
+hot tables only hold the last ``settings.archive_after_months`` months.
+Clinics other than the default one archive to a subdirectory named after
+their schema.
+
+Every batch appends one gzip member whose lines carry a batch id, and the
+member is written before the batch's transaction commits. A batch
+interrupted in between (crash, failed commit) leaves a member that no
+``archived_record`` points to; its records stay in the hot tables and are
+archived again by the next run. Only lines of the batch recorded in
+``archived_record.batch`` are read back. Archives written before batch ids
+were introduced are read with duplicate answers removed.
+"""
+import asyncio
+import csv
+import gzip
+import io
+import os
+import uuid
+from collections import defaultdict
+from datetime import date
+
+from sqlalchemy import select, delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core import tenancy
+from ..core.config import settings
+from ..database import AsyncSessionLocal
+from ..models.archived_record import ArchivedRecord
+from ..models.assignment_record import AssignmentRecord, WritingAnswer
+from .answers import mcq_rows
+
+# "batch" was added last: files started before it have an 8-column header,
+# and csv.DictReader returns the extra column under the None key there
+FIELDS = ["kind", "record_id", "item_id", "choice_index", "is_correct", "answer_text", "reviewed", "correct", "batch"]
+
+
+def month_path(month: str) -> str:
+    tenant = tenancy.current()
+    directory = settings.archive_dir if tenant.id == 0 else os.path.join(settings.archive_dir, tenant.schema)
+    return os.path.join(directory, f"{month}.csv.gz")
+
+
+def default_cutoff(today: date | None = None) -> date:
+    """First day of the oldest month that stays in the hot tables."""
+    today = today or date.today()
+    months = today.year * 12 + today.month - 1 - settings.archive_after_months
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def _flag(v: bool | None) -> str:
+    return "" if v is None else str(int(v))
+
+
+def _unflag(v: str) -> bool | None:
+    return None if v == "" else v == "1"
+
+
+def _append(month: str, rows: list[dict]) -> None:
+    # Each call appends a gzip member; gzip.open reads concatenated members.
+    os.makedirs(os.path.dirname(month_path(month)), exist_ok=True)
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=FIELDS)
+    if not os.path.exists(month_path(month)):
+        writer.writeheader()
+    writer.writerows(rows)
+    with open(month_path(month), "ab") as f:
+        f.write(gzip.compress(buf.getvalue().encode("utf-8")))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+async def archive_before(cutoff: date, batch_size: int = 1000) -> dict[str, int]:
+    """Archive finished records started before ``cutoff``; returns records per month.
+
+    Files are written before the rows are deleted. An interrupted batch
+    leaves lines of a batch id no ``archived_record`` refers to, which
+    :func:`load_archived` skips.
+    """
+    counts: dict[str, int] = defaultdict(int)
+    while True:
+        async with AsyncSessionLocal() as session:
+            recs = (
+                await session.execute(
+                    select(AssignmentRecord.__table__)
+                    .filter(AssignmentRecord.started_at < cutoff, AssignmentRecord.finished_at.is_not(None))
+                    .order_by(AssignmentRecord.id)
+                    .limit(batch_size)
+                )
+            ).all()
+            if not recs:
+                break
+            ids = [r.id for r in recs]
+            batch = uuid.uuid4().hex
+            month_of = {r.id: r.started_at.strftime("%Y-%m") for r in recs}
+
+            rows: dict[str, list[dict]] = defaultdict(list)
+            answers = mcq_rows(AssignmentRecord.id.in_(ids)).subquery()
+            mcq = await session.execute(select(answers).order_by(answers.c.record_id, answers.c.id))
+            for a in mcq:
+                rows[month_of[a.record_id]].append(
+                    {"kind": "mcq", "record_id": a.record_id, "item_id": a.item_id,
+                     "choice_index": a.choice_index, "is_correct": _flag(a.is_correct), "batch": batch}
+                )
+            writing = await session.execute(select(WritingAnswer.__table__).filter(WritingAnswer.record_id.in_(ids)))
+            for a in writing:
+                rows[month_of[a.record_id]].append(
+                    {"kind": "writing", "record_id": a.record_id, "item_id": a.item_id,
+                     "answer_text": a.answer_text, "reviewed": _flag(a.reviewed), "correct": _flag(a.correct),
+                     "batch": batch}
+                )
+            for month, month_rows in rows.items():
+                await asyncio.to_thread(_append, month, month_rows)
+
+            await session.execute(
+                insert(ArchivedRecord),
+                [
+                    {"id": r.id, "assignment_id": r.assignment_id, "patient_id": r.patient_id,
+                     "started_at": r.started_at, "finished_at": r.finished_at, "score": r.score,
+                     "month": month_of[r.id], "batch": batch}
+                    for r in recs
+                ],
+            )
+            # answers go with their record (ON DELETE CASCADE)
+            await session.execute(delete(AssignmentRecord).where(AssignmentRecord.id.in_(ids)))
+            await session.commit()
+            for r in recs:
+                counts[month_of[r.id]] += 1
+    return dict(counts)
+
+
+def _read(month: str, batches: dict[int, str | None]) -> dict[int, dict[str, list]]:
+    """Answers of the records in ``batches`` (record id -> batch id, None for older archives)."""
+    out: dict[int, dict[str, list]] = {i: {"mcq_answers": [], "writing_answers": []} for i in batches}
+    path = month_path(month)
+    if not os.path.exists(path):
+        return out
+    seen: set[tuple[int, str, int]] = set()
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            rid = int(row["record_id"])
+            if rid not in batches:
+                continue
+            batch = batches[rid]
+            if batch is None:
+                # archived more than once by an interrupted run: keep the first copy
+                key = (rid, row["kind"], int(row["item_id"]))
+                if key in seen:
+                    continue
+                seen.add(key)
+            elif (row.get("batch") or (row.get(None) or [None])[0]) != batch:
+                continue
+            if row["kind"] == "mcq":
+                out[rid]["mcq_answers"].append(
+                    {"item_id": int(row["item_id"]), "choice_index": int(row["choice_index"]) if row["choice_index"] else None,
+                     "is_correct": _unflag(row["is_correct"])}
+                )
+            else:
+                out[rid]["writing_answers"].append(
+                    {"item_id": int(row["item_id"]), "answer_text": row["answer_text"],
+                     "reviewed": _unflag(row["reviewed"]), "correct": _unflag(row["correct"])}
+                )
+    return out
+
+
+async def load_archived(records: list[ArchivedRecord]) -> dict[int, dict[str, list]]:
+    """Answers of archived records keyed by record id (one file read per month)."""
+    by_month: dict[str, dict[int, str | None]] = defaultdict(dict)
+    for r in records:
+        by_month[r.month][r.id] = r.batch
+    out: dict[int, dict[str, list]] = {}
+    for month, batches in by_month.items():
+        out.update(await asyncio.to_thread(_read, month, batches))
+    return out
+
+
+async def archived_records(session: AsyncSession, **filters) -> list[ArchivedRecord]:
+    stmt = select(ArchivedRecord).filter_by(**filters).order_by(ArchivedRecord.started_at.desc())
+    return list((await session.execute(stmt)).scalars().all())
@@ -0,0 +1,169 @@
+"""Write-behind buffer for writing-answer drafts.
+
+Autosaved drafts (``POST /patient/records/{id}/writing?draft=true``) are
+coalesced in memory per ``(record_id, item_id)`` and written with one
+multi-row upsert every ``settings.autosave_flush_interval`` seconds. An
+explicit submit, ``finish_assignment`` and application shutdown flush
+immediately, so a draft is only ever at risk for one interval. Drafts and
+cached record ids are kept per clinic id and flushed to wherever the clinic
+lives at that time; drafts of a clinic being moved wait until it is back.
+
+The buffer is per process, so with several workers the submit or finish
+only flushes the drafts its own worker holds. The upsert therefore never
+lets a draft replace a submitted answer (``writing_answer.submitted``),
+and drafts of finished attempts are dropped. Their cached record ids are
+forgotten, so the next draft finds the new attempt.
+
+Drafts for items that are not writing items of the attempt's assignment,
+or for deleted assignments, are skipped by the upsert rather than failing
+it. A batch that still fails (an item deleted meanwhile) is logged and
+dropped for its clinic only, so one bad draft cannot block the others.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+
+from sqlalchemy import Integer, String, and_, column, false, or_, select, values
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.dialects.postgresql import insert
+
+from ..core import tenancy
+from ..core.config import settings
+from ..database import AsyncSessionLocal
+from ..models.assignment import Assignment
+from ..models.assignment_details import AssignmentItemBase, WritingItem
+from ..models.assignment_record import AssignmentRecord, WritingAnswer
+from .clinics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class AutosaveBuffer:
+    def __init__(self, interval: float | None = None) -> None:
+        self.interval = interval if interval is not None else settings.autosave_flush_interval
+        self._pending: dict[tuple[int, int, int], str] = {}  # (tenant id, record_id, item_id) -> text
+        # (tenant id, assignment_id, patient_id) -> record_id, saves a lookup per keystroke
+        self._records: dict[tuple[int, int, int], int] = {}
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    # ---- record cache ----------------------------------------------------
+    def record_for(self, assignment_id: int, patient_id: int) -> int | None:
+        return self._records.get((tenancy.current().id, assignment_id, patient_id))
+
+    def remember(self, assignment_id: int, patient_id: int, record_id: int) -> None:
+        self._records[(tenancy.current().id, assignment_id, patient_id)] = record_id
+
+    def forget(self, assignment_id: int, patient_id: int) -> None:
+        self._records.pop((tenancy.current().id, assignment_id, patient_id), None)
+
+    # ---- drafts ----------------------------------------------------------
+    def put(self, record_id: int, item_id: int, answer_text: str) -> None:
+        self._pending[(tenancy.current().id, record_id, item_id)] = answer_text
+
+    def discard(self, record_id: int, item_id: int) -> None:
+        self._pending.pop((tenancy.current().id, record_id, item_id), None)
+
+    async def flush(self, record_id: int | None = None) -> int:
+        """Write pending drafts (all, or only those of ``record_id`` in the current clinic)."""
+        async with self._lock:
+            if record_id is None:
+                batch, self._pending = self._pending, {}
+            else:
+                tenant_id = tenancy.current().id
+                keys = [k for k in self._pending if k[1] == record_id and k[0] == tenant_id]
+                batch = {k: self._pending.pop(k) for k in keys}
+            if not batch:
+                return 0
+            by_tenant = defaultdict(list)
+            for (tenant_id, r, i), t in batch.items():
+                by_tenant[tenant_id].append({"record_id": r, "item_id": i, "answer_text": t})
+            written = 0
+            try:
+                for tenant_id, rows in list(by_tenant.items()):
+                    # resolved now: the clinic may have moved since the drafts came in
+                    tenant = await registry.get(tenant_id)
+                    if tenant is None:
+                        logger.warning("Dropping %d draft(s) of unknown clinic %s", len(rows), tenant_id)
+                        del by_tenant[tenant_id]
+                        continue
+                    if tenant.status == "moving":
+                        continue  # kept until the clinic is back (put back below)
+                    try:
+                        with tenancy.use(tenant):
+                            async with AsyncSessionLocal() as session:
+                                await session.execute(_upsert(rows))
+                                finished = set((await session.scalars(
+                                    select(AssignmentRecord.id)
+                                    .join(Assignment, Assignment.id == AssignmentRecord.assignment_id)
+                                    .filter(
+                                        AssignmentRecord.id.in_({r["record_id"] for r in rows}),
+                                        or_(AssignmentRecord.finished_at.is_not(None), Assignment.deleted_at.is_not(None)),
+                                    )
+                                )).all())
+                                await session.commit()
+                    except (IntegrityError, DataError):
+                        logger.exception("Dropping %d draft(s) of clinic %s", len(rows), tenant_id)
+                        del by_tenant[tenant_id]
+                        continue
+                    if finished:
+                        self._records = {
+                            k: r for k, r in self._records.items() if not (k[0] == tenant_id and r in finished)
+                        }
+                    written += len(rows)
+                    del by_tenant[tenant_id]
+            finally:
+                # Put the unwritten drafts back unless newer text arrived meanwhile.
+                for tenant_id, rows in by_tenant.items():
+                    for row in rows:
+                        self._pending.setdefault((tenant_id, row["record_id"], row["item_id"]), row["answer_text"])
+            return written
+
+    # ---- lifecycle -------------------------------------------------------
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Autosave flush failed")
+
+
+def _upsert(rows: list[dict]):
+    """Insert drafts of unfinished attempts of live assignments; update answers that are still drafts.
+
+    Rows whose item is not a writing item of the attempt's assignment are left out.
+    """
+    drafts = values(
+        column("record_id", Integer), column("item_id", Integer), column("answer_text", String), name="drafts"
+    ).data([(r["record_id"], r["item_id"], r["answer_text"]) for r in rows])
+    stmt = insert(WritingAnswer).from_select(
+        ["record_id", "item_id", "answer_text", "submitted"],
+        select(drafts.c.record_id, drafts.c.item_id, drafts.c.answer_text, false())
+        .join(AssignmentRecord, AssignmentRecord.id == drafts.c.record_id)
+        .join(Assignment, Assignment.id == AssignmentRecord.assignment_id)
+        .join(AssignmentItemBase, and_(AssignmentItemBase.id == drafts.c.item_id,
+                                       AssignmentItemBase.assignment_id == AssignmentRecord.assignment_id))
+        .join(WritingItem, WritingItem.id == AssignmentItemBase.id)
+        .where(AssignmentRecord.finished_at.is_(None), Assignment.deleted_at.is_(None)),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[WritingAnswer.record_id, WritingAnswer.item_id],
+        set_={"answer_text": stmt.excluded.answer_text},
+        where=WritingAnswer.submitted.is_(False),
+    )
+
+
+autosave = AutosaveBuffer()
@@ -0,0 +1,81 @@
+"""Binding patients to doctors: bind, transfer and unbind, one or many at once.
+
+:func:`rebind` moves patients from one doctor (or from nobody) to another
+(or to nobody) with a single statement. The ``UPDATE … RETURNING`` is
+conditional on the current binding, so two doctors racing for one patient
+cannot both win. History rows for the same patients go into
+``doctor_patient_bindings`` in the same statement. A transfer writes an
+``unbounded`` row for the old doctor and a ``bounded`` row for the new one.
+
+Pending writing reviews follow ``users.doctor_id`` unless
+``writing_answer.reviewer_id`` routes them elsewhere. With ``reviewer_id``
+the moved patients' pending answers go to that doctor (for example the
+old one, to finish them) instead of the new one.
+"""
+from dataclasses import dataclass, field
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+_REBIND = """
+WITH moved AS (
+    UPDATE users p SET doctor_id = CAST(:to_id AS integer)
+    WHERE p.role = 3 AND {current} {patients}
+    RETURNING p.id, p.username
+), history AS (
+    INSERT INTO doctor_patient_bindings (doctor_id, doctor_name, patient_id, patient_name, state, actor_id)
+    SELECT h.doctor_id, h.doctor_name, m.id, m.username, h.state, :actor_id
+    FROM moved m
+    CROSS JOIN (VALUES
+        (CAST(:from_id AS integer), CAST(:from_name AS varchar), 'unbounded'),
+        (CAST(:to_id AS integer), CAST(:to_name AS varchar), 'bounded')
+    ) h (doctor_id, doctor_name, state)
+    WHERE h.doctor_id IS NOT NULL
+)
+SELECT id FROM moved ORDER BY id
+"""
+
+_ROUTE_REVIEWS = """
+UPDATE writing_answer w SET reviewer_id = :reviewer_id
+FROM assignment_record r
+WHERE r.id = w.record_id AND w.reviewed = false AND r.patient_id = ANY(:patient_ids)
+"""
+
+
+@dataclass
+class Rebound:
+    patient_ids: list[int] = field(default_factory=list)
+    reviews_routed: int = 0
+
+
+async def rebind(
+    session: AsyncSession,
+    *,
+    from_doctor: tuple[int, str] | None,
+    to_doctor: tuple[int, str] | None,
+    patient_ids: list[int] | None = None,
+    actor_id: int | None = None,
+    reviewer_id: int | None = None,
+) -> Rebound:
+    """Move patients of ``from_doctor`` (``None``: unbound ones) to ``to_doctor`` (``None``: unbind).
+
+    Doctors are ``(id, name)``. Only the listed ``patient_ids`` move, or all
+    of ``from_doctor``'s if ``None``. Patients not bound as expected are
+    skipped. The caller commits.
+    """
+    params = {
+        "from_id": from_doctor and from_doctor[0], "from_name": from_doctor and from_doctor[1],
+        "to_id": to_doctor and to_doctor[0], "to_name": to_doctor and to_doctor[1],
+        "actor_id": actor_id,
+    }
+    current = "p.doctor_id = :from_id" if from_doctor else "p.doctor_id IS NULL"
+    patients = ""
+    if patient_ids is not None:
+        patients = "AND p.id = ANY(:patient_ids)"
+        params["patient_ids"] = list(patient_ids)
+    moved = list((await session.scalars(text(_REBIND.format(current=current, patients=patients)), params)).all())
+    out = Rebound(patient_ids=moved)
+    if moved and reviewer_id is not None:
+        result = await session.execute(text(_ROUTE_REVIEWS), {"reviewer_id": reviewer_id, "patient_ids": moved})
+        out.reviews_routed = result.rowcount
+    return out
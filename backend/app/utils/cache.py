@@ -0,0 +1,414 @@
+"""Two-tier response cache with request coalescing and tag invalidation.
+
+::
+
+    return await cache.get_or_load(
+        f"doctor.assignments:{topic}", load, tags=["assignments"]
+    )
+
+Lookups go through:
+
+1. a per-worker LRU (``cache_local_size`` entries, ``cache_local_ttl``
+   seconds). It is kept short because other workers' invalidations reach
+   it only through expiry;
+2. the shared backend (``settings.cache_backend``). ``file`` keeps entries
+   under ``cache_url`` (a directory every worker on the host shares),
+   ``redis`` talks to any Redis-compatible server at ``cache_url``
+   (needs the optional ``redis`` package), and ``memory`` is per process,
+   for a single worker;
+3. the loader. Concurrent misses for one key share one load in a worker
+   (singleflight). Across workers, a short lock in the backend lets one
+   worker load while the others wait for its result.
+
+Entries record the version of each of their tags. :meth:`Cache.invalidate`
+gives a tag a new version, so every entry carrying it is stale at once on
+all workers, without scanning or deleting keys. Backend errors never fail
+a request: the loader runs uncached and the error is counted.
+
+Keys and tags belong to the current clinic (core/tenancy.py): the same key
+in two clinics names two entries, and invalidating a tag only affects the
+clinic that invalidates it.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Iterable
+
+from ..core import tenancy
+from ..core.config import settings
+
+try:  # optional: only needed for cache_backend=redis
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover
+    aioredis = None
+
+log = logging.getLogger(__name__)
+
+_LOCK_SECONDS = 5.0  # how long other workers wait for a loading worker
+_POLL = 0.025
+
+
+class MemoryBackend:
+    """Per-process store with the backend interface (single worker, tests)."""
+
+    def __init__(self) -> None:
+        self._data: dict[str, tuple[bytes, float | None]] = {}
+
+    def _get(self, key: str) -> bytes | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.time():
+            del self._data[key]
+            return None
+        return value
+
+    async def get_many(self, keys: list[str]) -> list[bytes | None]:
+        return [self._get(k) for k in keys]
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        if self._get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+class FileBackend:
+    """One file per key under ``directory``; safe for all workers on a host.
+
+    A file holds an 8-byte expiry (0: none) followed by the value. Writes go
+    through a temporary file and ``os.replace``, so readers never see a
+    partial value. File access runs in a thread, one call per operation, so
+    the event loop never waits on the disk. Expired files are removed when
+    read and by :meth:`sweep`, which :class:`Cache` runs every
+    ``settings.cache_sweep_interval`` seconds.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        expires = int.from_bytes(data[:8], "big")
+        if expires and expires <= time.time() * 1000:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        return data[8:]
+
+    async def get_many(self, keys: list[str]) -> list[bytes | None]:
+        return await asyncio.to_thread(lambda: [self._get(k) for k in keys])
+
+    def _write(self, key: str, value: bytes, ttl: float | None, exclusive: bool = False) -> bool:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = int(time.time() * 1000 + ttl * 1000 if ttl else 0).to_bytes(8, "big") + value
+        if exclusive:
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            except FileExistsError:
+                return False
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            return True
+        tmp = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return True
+
+    def _add(self, key: str, value: bytes, ttl: float) -> bool:
+        if self._write(key, value, ttl, exclusive=True):
+            return True
+        if self._get(key) is None:  # an expired lock: _get removed it
+            return self._write(key, value, ttl, exclusive=True)
+        return False
+
+    def _delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        await asyncio.to_thread(self._write, key, value, ttl)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return await asyncio.to_thread(self._add, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    def sweep(self, orphan_seconds: float = 3600.0) -> int:
+        """Remove expired entries, and temporary files a crashed writer left; returns the count."""
+        now = time.time()
+        removed = 0
+        try:
+            subdirs = [d.path for d in os.scandir(self.directory) if d.is_dir()]
+        except FileNotFoundError:
+            return 0
+        for subdir in subdirs:
+            for entry in os.scandir(subdir):
+                try:
+                    if "." in entry.name:  # "<digest>.<pid>.<random>": a write that never got renamed
+                        expired = entry.stat().st_mtime < now - orphan_seconds
+                    else:
+                        with open(entry.path, "rb") as f:
+                            expires = int.from_bytes(f.read(8), "big")
+                        expired = bool(expires) and expires <= now * 1000
+                    if expired:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass  # removed by a reader or another worker's sweep
+        return removed
+
+
+class RedisBackend:
+    def __init__(self, url: str) -> None:
+        if aioredis is None:
+            raise RuntimeError("cache_backend=redis needs the 'redis' package")
+        self.client = aioredis.from_url(url)
+
+    async def get_many(self, keys: list[str]) -> list[bytes | None]:
+        return await self.client.mget(keys)
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        await self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(await self.client.set(key, value, px=int(ttl * 1000), nx=True))
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(key)
+
+
+def make_backend(kind: str, url: str):
+    if kind == "none":
+        return None
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "file":
+        return FileBackend(url or "cache")
+    if kind == "redis":
+        return RedisBackend(url or "redis://localhost:6379/0")
+    raise ValueError(f"Unknown cache backend {kind!r}")
+
+
+class Cache:
+    def __init__(self, backend, ttl: float = 30.0, local_ttl: float = 2.0, local_size: int = 1024, prefix: str = "ait:") -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_size = local_size
+        self.prefix = prefix
+        self._local: OrderedDict[str, tuple[Any, float, tuple[str, ...]]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._generation = 0  # bumped by invalidate(); see _fill
+        self._sweeper: asyncio.Task | None = None
+        self.metrics: Counter = Counter()
+
+    # --- lifecycle ------------------------------------------------------------
+
+    async def start(self, sweep_interval: float | None = None) -> None:
+        """Sweep expired entries out of a backend that keeps them (the file backend)."""
+        interval = settings.cache_sweep_interval if sweep_interval is None else sweep_interval
+        if hasattr(self.backend, "sweep") and interval > 0:
+            self._sweeper = asyncio.create_task(self._sweep(interval))
+
+    async def stop(self) -> None:
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep(self, interval: float) -> None:
+        while True:
+            # spread the workers' sweeps over the interval
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+            try:
+                self.metrics["swept"] += await asyncio.to_thread(self.backend.sweep)
+            except Exception:
+                self.metrics["error"] += 1
+                log.exception("Cache sweep failed")
+
+    # --- local tier -----------------------------------------------------------
+
+    def _local_get(self, key: str):
+        item = self._local.get(key)
+        if item is None:
+            return None
+        if item[1] <= time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return item
+
+    def _local_put(self, key: str, value: Any, tags: tuple[str, ...]) -> None:
+        if self.local_size <= 0:
+            return
+        self._local[key] = (value, time.monotonic() + self.local_ttl, tags)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    # --- lookups --------------------------------------------------------------
+
+    async def get_or_load(
+        self, key: str, loader: Callable[[], Awaitable[Any]], tags: Iterable[str] = (), ttl: float | None = None
+    ) -> Any:
+        """Cached value of ``key``, loading (once per worker) on a miss.
+
+        ``loader`` must return JSON-serialisable data.
+        """
+        scope = tenancy.current().key
+        key, tags = scope + key, tuple(scope + t for t in tags)
+        local = self._local_get(key)
+        if local is not None:
+            self.metrics["hit_local"] += 1
+            return local[0]
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.metrics["coalesced"] += 1
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._fill(key, loader, tags, ttl or self.ttl)
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # retrieved: followers re-raise, nobody else needs to
+            raise
+        except BaseException:
+            future.cancel()  # the leading request was cancelled
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    async def _fill(self, key: str, loader, tags: tuple[str, ...], ttl: float) -> Any:
+        generation = self._generation
+        if self.backend is None:
+            self.metrics["miss"] += 1
+            value = await loader()
+            if generation == self._generation:
+                self._local_put(key, value, tags)
+            return value
+        entry_key = self.prefix + "v:" + key
+        lock_key = self.prefix + "lock:" + key
+        try:
+            versions, value, fresh = await self._lookup(entry_key, tags)
+            if fresh:
+                self.metrics["hit_shared"] += 1
+                self._local_put(key, value, tags)
+                return value
+            locked = await self.backend.add(lock_key, b"1", _LOCK_SECONDS)
+            if not locked:
+                # another worker is loading this key: wait for its result
+                deadline = time.monotonic() + _LOCK_SECONDS
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(_POLL)
+                    versions, value, fresh = await self._lookup(entry_key, tags)
+                    if fresh:
+                        self.metrics["hit_shared_wait"] += 1
+                        self._local_put(key, value, tags)
+                        return value
+        except Exception:
+            self.metrics["error"] += 1
+            log.exception("Cache backend read failed for %s", key)
+            return await loader()
+
+        self.metrics["miss"] += 1
+        try:
+            value = await loader()
+        finally:
+            if locked:
+                await self._quietly(self.backend.delete(lock_key))
+        # versions were read before loading: an invalidation while loading
+        # leaves this entry stale instead of caching old data as new
+        envelope = json.dumps({"v": value, "t": versions}, separators=(",", ":"), default=str).encode()
+        await self._quietly(self.backend.set(entry_key, envelope, ttl))
+        if generation == self._generation:  # not invalidated here while loading
+            self._local_put(key, value, tags)
+        return value
+
+    async def _lookup(self, entry_key: str, tags: tuple[str, ...]) -> tuple[dict, Any, bool]:
+        raw, *current = await self.backend.get_many([entry_key, *(self.prefix + "tag:" + t for t in tags)])
+        versions = {t: (v.decode() if v else "0") for t, v in zip(tags, current)}
+        if raw is None:
+            return versions, None, False
+        entry = json.loads(raw)
+        return versions, entry["v"], entry["t"] == versions
+
+    async def _quietly(self, op: Awaitable) -> None:
+        try:
+            await op
+        except Exception:
+            self.metrics["error"] += 1
+            log.exception("Cache backend write failed")
+
+    # --- invalidation -----------------------------------------------------------
+
+    async def invalidate(self, *tags: str) -> None:
+        """Make every entry carrying one of ``tags`` stale, on all workers."""
+        if not tags:
+            return
+        scope = tenancy.current().key
+        tags = tuple(scope + t for t in tags)
+        self.metrics["invalidate"] += len(tags)
+        self._generation += 1
+        dropped = set(tags)
+        for key in [k for k, item in self._local.items() if dropped.intersection(item[2])]:
+            del self._local[key]
+        if self.backend is None:
+            return
+        version = uuid.uuid4().hex[:12].encode()
+        for tag in tags:
+            await self._quietly(self.backend.set(self.prefix + "tag:" + tag, version))
+
+    def stats(self) -> dict:
+        lookups = sum(self.metrics[k] for k in ("hit_local", "hit_shared", "hit_shared_wait", "coalesced", "miss"))
+        hits = lookups - self.metrics["miss"]
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "local_entries": len(self._local),
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            **self.metrics,
+        }
+
+
+cache = Cache(
+    make_backend(settings.cache_backend, settings.cache_url),
+    ttl=settings.cache_ttl,
+    local_ttl=settings.cache_local_ttl,
+    local_size=settings.cache_local_size,
+)
@@ -0,0 +1,91 @@
+"""A doctor's caseload overview in one query.
+
+One row per bound patient with assigned and completed assignment counts,
+last activity, the latest score per topic and the number of writing answers
+awaiting the doctor's review. Each figure comes from a LATERAL subquery over the
+patient's own rows (all reached through patient_id indexes), so the cost
+grows with the caseload, not with the whole tables. Sorting and paging
+happen in SQL as well; the page and the total come back as one JSON row.
+Attempts moved to the archive still count as completed and as activity.
+"""
+from sqlalchemy import Integer, column, text
+from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# sort key -> SQL expression; the only text ever put into ORDER BY
+SORT_COLUMNS = {
+    "patient_id": "u.id",
+    "username": "u.username",
+    "first_name": "u.first_name",
+    "last_name": "u.last_name",
+    "assigned": "coalesce(a.assigned, 0)",
+    "completed": "coalesce(r.completed, 0)",
+    "last_activity": "r.last_activity",
+    "pending_reviews": "coalesce(p.pending_reviews, 0)",
+}
+
+_CASELOAD = """
+WITH page AS (
+    SELECT u.id AS patient_id, u.username, u.first_name, u.last_name,
+           coalesce(a.assigned, 0) AS assigned,
+           coalesce(r.completed, 0) AS completed,
+           r.last_activity,
+           coalesce(s.latest_scores, '{{}}'::jsonb) AS latest_scores,
+           coalesce(p.pending_reviews, 0) AS pending_reviews,
+           row_number() OVER (ORDER BY {order} {direction} NULLS LAST, u.id) AS rn
+    FROM users u
+    LEFT JOIN LATERAL (
+        SELECT count(*) AS assigned
+        FROM assignment_patient ap
+        JOIN assignments x ON x.id = ap.assignment_id AND x.deleted_at IS NULL
+        WHERE ap.patient_id = u.id
+    ) a ON true
+    LEFT JOIN LATERAL (
+        SELECT count(DISTINCT t.assignment_id) FILTER (WHERE t.finished_at IS NOT NULL) AS completed,
+               max(coalesce(t.finished_at, t.started_at)) AS last_activity
+        FROM (
+            SELECT assignment_id, started_at, finished_at FROM assignment_record WHERE patient_id = u.id
+            UNION ALL
+            SELECT assignment_id, started_at, finished_at FROM archived_record WHERE patient_id = u.id
+        ) t
+    ) r ON true
+    LEFT JOIN LATERAL (
+        SELECT jsonb_object_agg(latest.topic, latest.score) AS latest_scores
+        FROM (
+            SELECT DISTINCT ON (x.topic) x.topic, t.score
+            FROM (
+                SELECT assignment_id, finished_at, score FROM assignment_record
+                WHERE patient_id = u.id AND finished_at IS NOT NULL AND score IS NOT NULL
+                UNION ALL
+                SELECT assignment_id, finished_at, score FROM archived_record
+                WHERE patient_id = u.id AND finished_at IS NOT NULL AND score IS NOT NULL
+            ) t
+            JOIN assignments x ON x.id = t.assignment_id
+            ORDER BY x.topic, t.finished_at DESC
+        ) latest
+    ) s ON true
+    LEFT JOIN LATERAL (
+        SELECT count(*) AS pending_reviews
+        FROM assignment_record ar
+        JOIN writing_answer w ON w.record_id = ar.id AND w.reviewed = false
+                             AND (w.reviewer_id IS NULL OR w.reviewer_id = :doctor_id)
+        JOIN assignments x ON x.id = ar.assignment_id AND x.deleted_at IS NULL
+        WHERE ar.patient_id = u.id
+    ) p ON true
+    WHERE u.doctor_id = :doctor_id AND u.role = 3
+    ORDER BY {order} {direction} NULLS LAST, u.id
+    LIMIT :limit OFFSET :offset
+)
+SELECT (SELECT count(*) FROM users WHERE doctor_id = :doctor_id AND role = 3) AS total,
+       (SELECT coalesce(json_agg(to_jsonb(page) - 'rn' ORDER BY rn), '[]') FROM page) AS patients
+"""
+
+
+async def caseload(
+    session: AsyncSession, doctor_id: int, sort: str = "username", desc: bool = False, limit: int = 50, offset: int = 0
+) -> dict:
+    """One page of ``doctor_id``'s caseload: ``{"total", "patients"}`` (JSON-ready)."""
+    sql = _CASELOAD.format(order=SORT_COLUMNS[sort], direction="DESC" if desc else "ASC")
+    stmt = text(sql).columns(column("total", Integer), column("patients", JSON))
+    row = (await session.execute(stmt, {"doctor_id": doctor_id, "limit": limit, "offset": offset})).one()
+    return {"total": row.total, "patients": row.patients}
@@ -0,0 +1,278 @@
+"""Clinic registry: ``public.clinics`` as :class:`~app.core.tenancy.Tenant` objects.
+
+Read on every authenticated request, so it is kept per worker and reloaded
+from the main database every ``clinic_registry_ttl`` seconds. A clinic
+being moved (``python -m app.cli move-clinic``) or its new ``database_url``
+reaches all workers within that time.
+
+:func:`move` copies a clinic to another database: writes are refused while
+it runs, every table is streamed over with binary COPY and the clinic is
+pointed at the new database. Before copying it waits for the clinic's
+running jobs and for CLI commands working on it (:func:`hold`), and workers
+stop claiming its jobs.
+"""
+import asyncio
+import dataclasses
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from sqlalchemy import select, text, update
+
+from ..core import tenancy
+from ..core.config import settings
+from ..database import engine, engine_for, init_schema, tenant_tables
+from ..models.clinic import Clinic
+
+SLUG = re.compile(r"^[a-z][a-z0-9_]{0,40}$")
+
+
+class ClinicMoving(Exception):
+    """The clinic is being moved to another database."""
+
+
+class ClinicRegistry:
+    def __init__(self, ttl: float | None = None) -> None:
+        self.ttl = ttl if ttl is not None else settings.clinic_registry_ttl
+        self._by_id: dict[int, tenancy.Tenant] = {0: tenancy.DEFAULT}
+        self._by_slug: dict[str, tenancy.Tenant] = {"default": tenancy.DEFAULT}
+        self._loaded_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def _refresh(self, force: bool = False) -> None:
+        if not force and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        async with self._lock:
+            if not force and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            # the registry itself is never tenant-scoped: plain engine, public schema
+            # (not counted against query budgets, like the session's SET search_path)
+            async with engine.connect() as conn:
+                rows = (await conn.execute(
+                    select(Clinic.__table__), execution_options={"tenant_setup": True}
+                )).all()
+            tenants = [tenancy.DEFAULT] + [
+                tenancy.Tenant(c.id, c.slug, c.schema_name, c.database_url, c.status) for c in rows
+            ]
+            self._by_id = {t.id: t for t in tenants}
+            self._by_slug = {t.slug: t for t in tenants}
+            self._loaded_at = time.monotonic()
+
+    async def get(self, tenant_id: int) -> tenancy.Tenant | None:
+        await self._refresh()
+        return self._by_id.get(tenant_id)
+
+    async def by_slug(self, slug: str) -> tenancy.Tenant | None:
+        await self._refresh()
+        return self._by_slug.get(slug)
+
+    async def all(self) -> list[tenancy.Tenant]:
+        await self._refresh()
+        return list(self._by_id.values())
+
+    async def databases(self) -> list[tenancy.Tenant]:
+        """One tenant per distinct database, to reach each database's job queue."""
+        seen: dict[str | None, tenancy.Tenant] = {}
+        for t in await self.all():
+            seen.setdefault(t.database_url, t)
+        return list(seen.values())
+
+    async def moving(self) -> list[int]:
+        """Ids of the clinics being moved; workers leave their jobs queued."""
+        return [t.id for t in await self.all() if t.status == "moving"]
+
+    def invalidate(self) -> None:
+        self._loaded_at = float("-inf")
+
+
+registry = ClinicRegistry()
+
+
+async def create(slug: str, name: str, database_url: str | None = None) -> tenancy.Tenant:
+    """Register a clinic and create its schema."""
+    if not SLUG.match(slug) or slug == "default":
+        raise ValueError(f"Invalid clinic slug {slug!r} (lowercase letters, digits and _)")
+    async with engine.begin() as conn:
+        clinic_id = (await conn.execute(
+            Clinic.__table__.insert()
+            .values(slug=slug, name=name, schema_name=f"clinic_{slug}", database_url=database_url, status="active")
+            .returning(Clinic.id)
+        )).scalar_one()
+    tenant = tenancy.Tenant(clinic_id, slug, f"clinic_{slug}", database_url)
+    await init_schema(tenant)
+    registry.invalidate()
+    return tenant
+
+
+async def set_status(slug: str, status: str) -> None:
+    await _update(slug, status=status)
+
+
+async def relocate(slug: str, database_url: str | None) -> None:
+    """Point the clinic at ``database_url`` and let it take writes again."""
+    await _update(slug, database_url=database_url, status="active")
+
+
+async def _update(slug: str, **values) -> None:
+    async with engine.begin() as conn:
+        await conn.execute(update(Clinic).where(Clinic.slug == slug).values(**values))
+    registry.invalidate()
+
+
+def _lock_key(slug: str) -> str:
+    return f"clinic:{slug}"
+
+
+@asynccontextmanager
+async def hold(tenant: tenancy.Tenant) -> AsyncIterator[tenancy.Tenant]:
+    """Keep ``tenant`` from being moved while the block runs (CLI commands).
+
+    Raises :class:`ClinicMoving` if it is being moved already.
+    """
+    if tenant.id == 0:
+        yield tenant
+        return
+    async with engine_for(tenant).connect() as conn:
+        held = await conn.scalar(text("SELECT pg_try_advisory_lock_shared(hashtext(:key))"), {"key": _lock_key(tenant.slug)})
+        await conn.commit()
+        try:
+            # a move marks the clinic before waiting for holders, so one that
+            # started before we got the lock is seen here
+            registry.invalidate()
+            current = await registry.get(tenant.id)
+            if not held or current is None or current.status == "moving" or current.database_url != tenant.database_url:
+                raise ClinicMoving(f"Clinic {tenant.slug!r} is being moved; try again once it is done")
+            yield current
+        finally:
+            if held:
+                await conn.execute(text("SELECT pg_advisory_unlock_shared(hashtext(:key))"), {"key": _lock_key(tenant.slug)})
+                await conn.commit()
+
+
+async def _settle(conn, source: tenancy.Tenant, timeout: float) -> None:
+    """Wait until no job of ``source`` runs and no :func:`hold` is active.
+
+    Takes the clinic's lock on ``conn`` (a session lock, held until the
+    connection is closed).
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        running = await conn.scalar(
+            text("SELECT count(*) FROM public.jobs WHERE tenant_id = :tid AND status = 'running'"), {"tid": source.id}
+        )
+        locked = not running and await conn.scalar(
+            text("SELECT pg_try_advisory_lock(hashtext(:key))"), {"key": _lock_key(source.slug)}
+        )
+        await conn.commit()
+        if locked:
+            return
+        if time.monotonic() > deadline:
+            what = f"{running} job(s)" if running else "a command holding the clinic"
+            raise RuntimeError(f"Clinic {source.slug!r} is still busy ({what}) after {timeout:.0f}s")
+        await asyncio.sleep(1.0)
+
+
+async def _pipe(src, dst, table, source_schema: str, target_schema: str) -> int:
+    """Stream ``table`` from ``src`` to ``dst`` (asyncpg connections) with binary COPY."""
+    columns = [c.name for c in table.columns]
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=16)
+
+    async def produce() -> None:
+        try:
+            await src.copy_from_table(table.name, schema_name=source_schema, columns=columns,
+                                      format="binary", output=chunks.put)
+        finally:
+            await chunks.put(None)
+
+    async def source():
+        while (chunk := await chunks.get()) is not None:
+            yield chunk
+
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(produce())
+        copied = tg.create_task(dst.copy_to_table(table.name, schema_name=target_schema, columns=columns,
+                                                  format="binary", source=source()))
+    return int(copied.result().split()[-1])
+
+
+async def move(slug: str, database_url: str, drain_seconds: float = 10.0, settle_seconds: float = 900.0) -> dict[str, int]:
+    """Copy clinic ``slug`` to ``database_url`` and switch it over.
+
+    The clinic refuses writes from the moment it is marked ``moving`` until
+    it is switched; ``drain_seconds`` after that (plus the registry TTL)
+    give in-flight requests time to finish. Running jobs and CLI commands
+    then get up to ``settle_seconds``. The source schema is left in place.
+    Returns rows copied per table.
+    """
+    registry.invalidate()
+    source = await registry.by_slug(slug)
+    if source is None or source.id == 0:
+        raise ValueError(f"Unknown clinic {slug!r} (the default clinic cannot be moved)")
+    target = dataclasses.replace(source, database_url=database_url, status="active")
+    if engine_for(target) is engine_for(source):
+        raise ValueError(f"Clinic {slug!r} is already in that database")
+
+    await set_status(slug, "moving")
+    try:
+        await asyncio.sleep(registry.ttl + drain_seconds)
+        await init_schema(target)
+        async with (
+            engine_for(source).connect() as lock_conn,
+            engine_for(source).connect() as src_conn,
+            engine_for(target).connect() as dst_conn,
+        ):
+            await _settle(lock_conn, source, settle_seconds)
+            try:
+                counts = await _copy(source, target, src_conn, dst_conn)
+            finally:
+                await lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), {"key": _lock_key(slug)})
+                await lock_conn.commit()
+    except BaseException:
+        await set_status(slug, "active")
+        raise
+    await relocate(slug, database_url)
+    return counts
+
+
+async def _copy(source: tenancy.Tenant, target: tenancy.Tenant, src_conn, dst_conn) -> dict[str, int]:
+    counts: dict[str, int] = {}
+    schema = f'"{source.schema}"'
+    await src_conn.execution_options(isolation_level="REPEATABLE READ")
+    async with src_conn.begin(), dst_conn.begin():
+        src = (await src_conn.get_raw_connection()).driver_connection
+        dst = (await dst_conn.get_raw_connection()).driver_connection
+        # the first statement on src: the snapshot everything below is copied from
+        last_value, is_called = (await src_conn.execute(
+            text(f"SELECT last_value, is_called FROM {schema}.change_seq")
+        )).one()
+        tables = tenant_tables()
+        # a retried move starts over; triggers would renumber change_seq
+        await dst_conn.execute(text(f"TRUNCATE {', '.join(f'{schema}.{t.name}' for t in tables)}"))
+        for t in tables:
+            await dst_conn.execute(text(f"ALTER TABLE {schema}.{t.name} DISABLE TRIGGER USER"))
+        for t in tables:
+            counts[t.name] = await _pipe(src, dst, t, source.schema, target.schema)
+        for t in tables:
+            await dst_conn.execute(text(f"ALTER TABLE {schema}.{t.name} ENABLE TRIGGER USER"))
+            column = t.autoincrement_column
+            if column is not None:
+                await dst_conn.execute(text(
+                    f"SELECT setval(s, (SELECT coalesce(max({column.name}), 0) + 1 FROM {schema}.{t.name}), false) "
+                    f"FROM pg_get_serial_sequence('{schema}.{t.name}', '{column.name}') s WHERE s IS NOT NULL"
+                ))
+        await dst_conn.execute(
+            text(f"SELECT setval('{schema}.change_seq', :v, :called)"), {"v": last_value, "called": is_called}
+        )
+        # queued jobs follow the clinic to its new database's queue
+        jobs = (await src_conn.execute(text(
+            "DELETE FROM public.jobs WHERE tenant_id = :tid AND status = 'queued' "
+            "RETURNING tenant_id, kind, payload::text AS payload, attempts, max_attempts, run_after, created_at"
+        ), {"tid": source.id})).mappings().all()
+        if jobs:
+            await dst_conn.execute(text(
+                "INSERT INTO public.jobs (tenant_id, kind, payload, status, attempts, max_attempts, run_after, created_at) "
+                "VALUES (:tenant_id, :kind, CAST(:payload AS json), 'queued', :attempts, :max_attempts, :run_after, :created_at)"
+            ), [dict(j) for j in jobs])
+        counts["jobs"] = len(jobs)
+    return counts
@@ -0,0 +1,116 @@
+"""Copying assignments inside Postgres.
+
+:func:`clone_assignment` makes any number of variants of one assignment in
+two statements, however many items it has. The first inserts the
+assignment rows. The second copies the typed items (base, MCQ and writing
+rows) and the legacy JSON items with ``INSERT … SELECT``. Item ids are
+drawn from the sequence first, so each new MCQ or writing row can point
+at its new base row. Image paths are copied as they are; the files are
+shared.
+
+Per variant, a title, topic and properties can be set. ``shuffle_choices``
+reorders each MCQ item's choices and moves ``answer_key`` with its choice.
+The order comes from ``md5(seed, item, choice)``, so the same seed always
+gives the same order.
+"""
+import json
+import uuid
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..schemas.assignment import AssignmentClone
+
+_ASSIGNMENTS = """
+WITH src AS (
+    SELECT topic, title, qtype, properties FROM assignments WHERE id = :source_id AND deleted_at IS NULL
+), v AS MATERIALIZED (
+    SELECT v.n, nextval(pg_get_serial_sequence('assignments', 'id')) AS id,
+           coalesce(v.topic, src.topic) AS topic,
+           coalesce(v.title, src.title || ' (copy)') AS title,
+           src.qtype,
+           CASE WHEN v.properties IS NULL THEN src.properties
+                ELSE coalesce(src.properties, '{}'::jsonb) || v.properties END AS properties
+    FROM src CROSS JOIN jsonb_to_recordset(CAST(:variants AS jsonb)) AS v (n int, title text, topic int, properties jsonb)
+), ins AS (
+    INSERT INTO assignments (id, topic, title, qtype, properties, created_by)
+    SELECT id, topic, title, qtype, properties, :created_by FROM v
+)
+SELECT id FROM v ORDER BY n
+"""
+
+_ITEMS = """
+WITH v AS (
+    SELECT * FROM jsonb_to_recordset(CAST(:variants AS jsonb)) AS v (id int, shuffle boolean, seed text, manual_review boolean)
+), m AS MATERIALIZED (
+    SELECT v.id AS assignment_id, v.shuffle, v.seed, v.manual_review,
+           b.id AS old_id, b.order_index, b.prompt, b.image_path,
+           nextval(pg_get_serial_sequence('assignment_items_base', 'id')) AS id
+    FROM v CROSS JOIN (SELECT * FROM assignment_items_base WHERE assignment_id = :source_id ORDER BY id) b
+), base AS (
+    INSERT INTO assignment_items_base (id, assignment_id, order_index, prompt, image_path)
+    SELECT id, assignment_id, order_index, prompt, image_path FROM m
+), mcq AS (
+    INSERT INTO mcq_items (id, choices, answer_key)
+    SELECT m.id,
+           CASE WHEN m.shuffle THEN coalesce(x.choices, q.choices) ELSE q.choices END,
+           CASE WHEN m.shuffle THEN x.answer_key ELSE q.answer_key END
+    FROM m
+    JOIN mcq_items q ON q.id = m.old_id
+    CROSS JOIN LATERAL (
+        SELECT jsonb_agg(s.value ORDER BY s.pos) AS choices,
+               (array_agg(s.pos - 1) FILTER (WHERE s.ord = q.answer_key + 1))[1] AS answer_key
+        FROM (
+            SELECT e.value, e.ord,
+                   row_number() OVER (ORDER BY md5(m.seed || ':' || m.old_id || ':' || e.ord), e.ord) AS pos
+            FROM jsonb_array_elements(CASE WHEN jsonb_typeof(q.choices) = 'array' THEN q.choices END)
+                 WITH ORDINALITY AS e (value, ord)
+        ) s
+    ) x
+), writing AS (
+    INSERT INTO writing_items (id, answer_key, manual_review)
+    SELECT m.id, w.answer_key, coalesce(m.manual_review, w.manual_review)
+    FROM m JOIN writing_items w ON w.id = m.old_id
+), legacy AS (
+    INSERT INTO assignment_items (assignment_id, prompt, image_path, choices, answer_key, "order")
+    SELECT v.id, i.prompt, i.image_path, i.choices, i.answer_key, i."order"
+    FROM v CROSS JOIN assignment_items i
+    WHERE i.assignment_id = :source_id
+)
+SELECT count(*) FROM m
+"""
+
+
+async def clone_assignment(
+    session: AsyncSession, source_id: int, variants: list[AssignmentClone], created_by: int | None = None
+) -> list[int]:
+    """Ids of the copies of ``source_id``, one per variant (none if it does not exist).
+
+    The caller commits.
+    """
+    specs = [
+        {
+            "n": n,
+            "title": v.title,
+            "topic": v.topic,
+            "properties": v.properties.model_dump(exclude_none=True) if v.properties else None,
+        }
+        for n, v in enumerate(variants)
+    ]
+    ids = list((await session.scalars(
+        text(_ASSIGNMENTS),
+        {"source_id": source_id, "variants": json.dumps(specs), "created_by": created_by},
+    )).all())
+    if not ids:
+        return []
+    items = [
+        {
+            "id": new_id,
+            "shuffle": v.shuffle_choices,
+            "seed": v.seed or uuid.uuid4().hex,
+            "manual_review": v.properties.manualReview if v.properties else None,
+        }
+        for new_id, v in zip(ids, variants)
+    ]
+    await session.execute(text(_ITEMS), {"source_id": source_id, "variants": json.dumps(items)})
+    return ids
@@ -0,0 +1,116 @@
+"""Streaming CSV/NDJSON export of patient attempts and answers.
+
+Rows come from a server-side cursor (``yield_per``) and are encoded batch by
+batch, so memory use does not depend on the size of the history.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator
+
+from sqlalchemy import select, literal, null, union_all, exists, Integer, Boolean, String
+from sqlalchemy.sql import Select
+
+from ..database import AsyncSessionLocal
+from ..models.user import User
+from ..models.assignment import Assignment
+from ..models.assignment_record import AssignmentRecord, MCQAnswer, WritingAnswer
+from .answers import mcq_rows
+
+COLUMNS = [
+    "patient_id", "patient_username", "record_id", "assignment_id", "assignment_title",
+    "started_at", "finished_at", "score", "answer_type", "item_id", "choice_index",
+    "is_correct", "answer_text", "reviewed", "correct",
+]
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+_BATCH = 1000
+
+
+def export_statement(
+    patients: Select,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    assignment_id: int | None = None,
+) -> Select:
+    """One row per answer (plus one per attempt without answers) of ``patients``."""
+    R = AssignmentRecord
+    head = (R.patient_id, User.username, R.id.label("record_id"), R.assignment_id, Assignment.title, R.started_at, R.finished_at, R.score)
+
+    criteria = [R.patient_id.in_(patients)]
+    if since:
+        criteria.append(R.started_at >= since)
+    if until:
+        criteria.append(R.started_at < until)
+    if assignment_id:
+        criteria.append(R.assignment_id == assignment_id)
+
+    def attempts(kind, item_id, *cols):
+        return (
+            select(*head, literal(kind), item_id.label("item_id"), *cols)
+            .join(User, User.id == R.patient_id)
+            .join(Assignment, Assignment.id == R.assignment_id)
+            .filter(*criteria)
+        )
+
+    answers = mcq_rows(*criteria).subquery()  # rows and packed arrays alike
+    mcq = attempts(
+        "mcq", answers.c.item_id, answers.c.choice_index, answers.c.is_correct,
+        null().cast(String), null().cast(Boolean), null().cast(Boolean),
+    ).join(answers, answers.c.record_id == R.id)
+    writing = attempts(
+        "writing", WritingAnswer.item_id, null().cast(Integer), null().cast(Boolean),
+        WritingAnswer.answer_text, WritingAnswer.reviewed, WritingAnswer.correct,
+    ).join(WritingAnswer, WritingAnswer.record_id == R.id)
+    empty = attempts(
+        "none", null().cast(Integer), null().cast(Integer), null().cast(Boolean),
+        null().cast(String), null().cast(Boolean), null().cast(Boolean),
+    ).filter(
+        R.mcq_item_ids.is_(None),
+        ~exists().where(MCQAnswer.record_id == R.id),
+        ~exists().where(WritingAnswer.record_id == R.id),
+    )
+
+    u = union_all(mcq, writing, empty).subquery()
+    return select(u).order_by(u.c.record_id, u.c.item_id)
+
+
+async def _rows(stmt: Select) -> AsyncIterator[list]:
+    # A dedicated session: the request-scoped one is closed before the body streams.
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(stmt.execution_options(yield_per=_BATCH))
+        async for partition in result.partitions():
+            yield partition
+
+
+def _value(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+
+async def encode(stmt: Select, fmt: str) -> AsyncIterator[bytes]:
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(COLUMNS)
+        async for rows in _rows(stmt):
+            writer.writerows([_value(v) for v in row] for row in rows)
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue().encode("utf-8")
+    else:
+        async for rows in _rows(stmt):
+            yield "".join(
+                json.dumps(dict(zip(COLUMNS, map(_value, row))), ensure_ascii=False) + "\n" for row in rows
+            ).encode("utf-8")
+
+
+async def gzipped(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    async for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
@@ -0,0 +1,158 @@
+"""Server-side grading of writing answers.
+
+Answers and answer keys are compared after :func:`normalize`:
+
+* NFKC folds full-width ASCII and half-width katakana;
+* katakana are folded to hiragana;
+* text is casefolded;
+* runs of whitespace collapse to one space.
+
+So ``"Ｈｅｌｌｏ  world"`` matches ``"hello world"`` and ``"ﾈｺ"`` matches
+``"ねこ"``. An answer key may list alternatives separated by ``|`` or
+newlines (``"ねこ|猫"``). Each key is compiled once into a set of
+normalised forms. With ``settings.grading_tolerance`` above 0, answers
+within that share of a key's length in edits (Levenshtein) also pass.
+
+:func:`grade_records` grades the pending answers of finished attempts in
+one pass. It runs at finish, for late submissions, for offline uploads and
+in ``python -m app.cli grade``, which backfills existing answers. An answer
+that matches is accepted. An answer that does not match is marked wrong,
+unless its item has ``manual_review`` set or has no key; those stay in the
+doctor's review queue. Accepted answers add 1 to the attempt's score, as
+``mark_review`` does. A resubmitted answer goes back to pending (and gives
+its point back if it had been accepted) and is graded again.
+"""
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+from sqlalchemy import select, update, bindparam, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..database import AsyncSessionLocal
+from ..models.assignment_details import WritingItem
+from ..models.assignment_record import AssignmentRecord, WritingAnswer
+from . import recommendations
+
+_SPACE = re.compile(r"\s+")
+_ALTERNATIVES = re.compile(r"[|\n]")
+_KATAKANA = {c: c - 0x60 for c in range(0x30A1, 0x30F7)}  # ァ..ヶ -> ぁ..ゖ
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).translate(_KATAKANA).casefold()
+    return _SPACE.sub(" ", text).strip()
+
+
+@lru_cache(maxsize=4096)
+def compile_key(answer_key: str) -> frozenset[str]:
+    """Normalised accepted answers of an item's ``answer_key``."""
+    return frozenset(filter(None, (normalize(k) for k in _ALTERNATIVES.split(answer_key))))
+
+
+def within(a: str, b: str, limit: int) -> bool:
+    """Levenshtein distance of ``a`` and ``b`` is at most ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def matches(answer: str, accepted: frozenset[str], tolerance: float | None = None) -> bool:
+    tolerance = settings.grading_tolerance if tolerance is None else tolerance
+    text = normalize(answer)
+    if text in accepted:
+        return True
+    if tolerance <= 0:
+        return False
+    return any(within(text, key, int(len(key) * tolerance)) for key in accepted)
+
+
+async def grade_records(session: AsyncSession, record_ids: list[int]) -> Counter:
+    """Grade pending writing answers of the finished ``record_ids``; the caller commits.
+
+    Returns counts of ``correct``, ``wrong`` and ``manual`` (left for review).
+    """
+    counts: Counter = Counter()
+    if not record_ids:
+        return counts
+    rows = (await session.execute(
+        select(WritingAnswer.id, WritingAnswer.record_id, WritingAnswer.answer_text,
+               WritingItem.answer_key, WritingItem.manual_review)
+        .join(WritingItem, WritingItem.id == WritingAnswer.item_id)
+        .join(AssignmentRecord, AssignmentRecord.id == WritingAnswer.record_id)
+        .filter(WritingAnswer.record_id.in_(record_ids), WritingAnswer.reviewed.is_(False),
+                AssignmentRecord.finished_at.is_not(None))
+    )).all()
+    correct, wrong = [], []
+    for answer_id, record_id, text, answer_key, manual_review in rows:
+        accepted = compile_key(answer_key) if answer_key else frozenset()
+        if accepted and matches(text or "", accepted):
+            correct.append((answer_id, text or ""))
+        elif accepted and not manual_review:
+            wrong.append((answer_id, text or ""))
+        else:
+            counts["manual"] += 1
+    # Only answers still pending, with the text graded here, are updated: a
+    # concurrent grading of the same record (finish racing a late submit)
+    # blocks on the row locks, then finds them reviewed and skips them, so no
+    # point is added twice; a resubmitted text is left to its own grading.
+    points: Counter = Counter()
+    for ids, is_correct in ((correct, True), (wrong, False)):
+        if not ids:
+            continue
+        graded = (await session.scalars(
+            update(WritingAnswer)
+            .where(tuple_(WritingAnswer.id, func.coalesce(WritingAnswer.answer_text, "")).in_(ids),
+                   WritingAnswer.reviewed.is_(False))
+            .values(reviewed=True, correct=is_correct, auto_graded=True)
+            .returning(WritingAnswer.record_id)
+        )).all()
+        counts["correct" if is_correct else "wrong"] += len(graded)
+        if is_correct:
+            points.update(graded)
+    if points:
+        R = AssignmentRecord.__table__
+        await session.execute(
+            update(R).where(R.c.id == bindparam("rid")).values(score=func.coalesce(R.c.score, 0) + bindparam("points")),
+            [{"rid": rid, "points": n} for rid, n in points.items()],
+        )
+    return counts
+
+
+async def backfill(batch_size: int = 1000) -> Counter:
+    """Grade every finished attempt that still has pending answers."""
+    counts: Counter = Counter()
+    last = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(AssignmentRecord.id, AssignmentRecord.patient_id, AssignmentRecord.assignment_id)
+                .filter(
+                    AssignmentRecord.id > last,
+                    AssignmentRecord.finished_at.is_not(None),
+                    select(WritingAnswer.id)
+                    .filter(WritingAnswer.record_id == AssignmentRecord.id, WritingAnswer.reviewed.is_(False))
+                    .exists(),
+                )
+                .order_by(AssignmentRecord.id)
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                return counts
+            counts += await grade_records(session, [r.id for r in rows])
+            # scores changed: keep the due queues in step
+            for patient_id in {r.patient_id for r in rows}:
+                await recommendations.refresh(session, [patient_id], {r.assignment_id for r in rows if r.patient_id == patient_id})
+            await session.commit()
+        counts["records"] += len(rows)
+        last = rows[-1].id
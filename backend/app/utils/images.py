@@ -1,5 +1,6 @@
 from io import BytesIO
-from PIL import Image
+
+from .tracing import traced
 
 MAX_SIZE = 200 * 1024  # 200 KB
 MAX_DIM = 1080
@@ -8,10 +9,13 @@ ALLOWED_FORMATS = {"PNG", "JPEG", "WEBP"}
 class ImageValidationError(Exception):
     pass
 
+@traced("image.process_upload")
 def process_upload(data: bytes) -> bytes:
     if len(data) > MAX_SIZE:
         raise ImageValidationError("File too large (max 200KB)")
 
+    from PIL import Image  # only upload requests and image jobs need Pillow
+
     try:
         img = Image.open(BytesIO(data))
     except Exception:
@@ -0,0 +1,186 @@
+"""Bulk user import from CSV.
+
+Expected header (only ``username``, ``email`` and ``password`` are required)::
+
+    username,email,password,first_name,last_name,date_of_birth,address,role,doctor
+
+``doctor`` is the username of an existing doctor; the new user is bound to
+them in the same pass. Rows are processed in chunks: one set-based duplicate
+query, bcrypt hashing fanned out over a process pool, and one multi-row
+insert per chunk. Invalid rows are reported and skipped, never fatal.
+
+Reading and validating a chunk runs in a thread, so a large file does not
+hold up the event loop. The pool is shared by all imports of the process and
+only started once there is something to hash (never for a dry run); it is
+sized by ``settings.import_hash_workers`` and shut down with the app.
+"""
+import asyncio
+import csv
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, TextIO
+
+from pydantic import ValidationError
+from sqlalchemy import select, or_
+from sqlalchemy.dialects.postgresql import insert
+
+from ..core.config import settings
+from ..database import AsyncSessionLocal
+from ..models.binding import DoctorPatientBinding
+from ..models.user import User
+from ..schemas.user import UserCreate
+from .security import hash_password
+
+CHUNK = 1000
+FIELDS = ["first_name", "last_name", "date_of_birth", "address"]
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def hash_pool(workers: int | None = None) -> ProcessPoolExecutor:
+    """The process's hashing pool; ``workers`` only counts when it is created."""
+    global _pool
+    if _pool is None:
+        # spawn: never fork the running event loop / connection pool
+        _pool = ProcessPoolExecutor(
+            workers or settings.import_hash_workers or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def _rows(f: TextIO) -> Iterable[tuple[int, dict]]:
+    reader = csv.DictReader(f)
+    for row in reader:
+        yield reader.line_num, {k.strip(): (v or "").strip() for k, v in row.items() if k}
+
+
+def _chunks(rows: Iterable, size: int):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _next_valid(chunks, seen_usernames: set[str], seen_emails: set[str], errors: list) -> list | None:
+    """Read and validate the next chunk (runs in a thread); None at the end of the file."""
+    chunk = next(chunks, None)
+    if chunk is None:
+        return None
+    valid: list[tuple[int, UserCreate, str]] = []
+    for line, row in chunk:
+        try:
+            user = UserCreate(
+                username=row.get("username", ""),
+                email=row.get("email", ""),
+                password=row.get("password", ""),
+                role=int(row.get("role") or 3),
+                **{k: row[k] for k in FIELDS if row.get(k)},
+            )
+        except ValidationError as e:
+            err = e.errors()[0]
+            msg = f"{'.'.join(map(str, err['loc']))}: {err['msg']}"
+            errors.append({"line": line, "username": row.get("username"), "error": msg})
+            continue
+        except ValueError:
+            errors.append({"line": line, "username": row.get("username"), "error": "role: invalid number"})
+            continue
+        if user.username in seen_usernames or user.email in seen_emails:
+            errors.append({"line": line, "username": user.username, "error": "Duplicate in file"})
+            continue
+        seen_usernames.add(user.username)
+        seen_emails.add(user.email)
+        valid.append((line, user, row.get("doctor", "")))
+    return valid
+
+
+async def import_users(f: TextIO, dry_run: bool = False, workers: int | None = None) -> dict:
+    """Import users from the CSV stream ``f``; returns counts and per-row errors."""
+    created, errors = 0, []
+    seen_usernames: set[str] = set()
+    seen_emails: set[str] = set()
+    loop = asyncio.get_running_loop()
+    chunks = _chunks(_rows(f), CHUNK)
+    while True:
+        valid = await asyncio.to_thread(_next_valid, chunks, seen_usernames, seen_emails, errors)
+        if valid is None:
+            break
+
+        async with AsyncSessionLocal() as session:
+            names = [u.username for _, u, _ in valid]
+            emails = [u.email for _, u, _ in valid]
+            taken = (
+                await session.execute(
+                    select(User.username, User.email).filter(or_(User.username.in_(names), User.email.in_(emails)))
+                )
+            ).all()
+            taken_names = {t.username for t in taken}
+            taken_emails = {t.email for t in taken}
+            doctor_names = {d for _, _, d in valid if d}
+            doctors = {
+                d.username: d.id
+                for d in (
+                    await session.execute(
+                        select(User.username, User.id).filter(User.username.in_(doctor_names), User.role == 2)
+                    )
+                ).all()
+            } if doctor_names else {}
+
+            todo = []
+            for line, user, doctor in valid:
+                if user.username in taken_names:
+                    errors.append({"line": line, "username": user.username, "error": "Username already taken"})
+                elif user.email in taken_emails:
+                    errors.append({"line": line, "username": user.username, "error": "Email already registered"})
+                elif doctor and doctor not in doctors:
+                    errors.append({"line": line, "username": user.username, "error": f"Unknown doctor {doctor}"})
+                else:
+                    todo.append((line, user, doctors.get(doctor)))
+        if dry_run:
+            created += len(todo)
+            continue
+        if not todo:
+            continue
+
+        # hash outside the session so no connection idles meanwhile
+        pool = hash_pool(workers)
+        hashes = await asyncio.gather(
+            *(loop.run_in_executor(pool, hash_password, u.password) for _, u, _ in todo)
+        )
+        async with AsyncSessionLocal() as session:
+            values = [
+                {**u.model_dump(exclude={"password"}), "hashed_password": h, "doctor_id": doctor_id}
+                for (_, u, doctor_id), h in zip(todo, hashes)
+            ]
+            # a concurrent registration may still win the race; skip those rows
+            stmt = insert(User).values(values).on_conflict_do_nothing().returning(User.id, User.username, User.doctor_id)
+            inserted = (await session.execute(stmt)).all()
+            inserted_names = {r.username for r in inserted}
+            for line, u, _ in todo:
+                if u.username not in inserted_names:
+                    errors.append({"line": line, "username": u.username, "error": "Already exists"})
+            doctor_name = {v: k for k, v in doctors.items()}
+            bindings = [
+                {"doctor_id": r.doctor_id, "doctor_name": doctor_name[r.doctor_id],
+                 "patient_id": r.id, "patient_name": r.username, "state": "bounded"}
+                for r in inserted if r.doctor_id is not None
+            ]
+            if bindings:
+                await session.execute(insert(DoctorPatientBinding).values(bindings))
+            await session.commit()
+            created += len(inserted)
+
+    errors.sort(key=lambda e: e["line"])
+    return {"created": created, "failed": len(errors), "dry_run": dry_run, "errors": errors}
@@ -0,0 +1,316 @@
+"""On-demand sampling profiler for live requests.
+
+An admin arms it (``/admin/profiler``) for one route, given as its path
+template (``/patient/assignments/v2/{assignment_id}``, as listed in /docs),
+or for a percentage of all requests. While a selected request runs, a
+thread samples the request's task every ``interval_ms``:
+
+* wall samples follow the task's await chain, so time spent waiting on the
+  database or another task shows up under the awaiting frame;
+* CPU samples are taken only while the task is executing on the event loop
+  thread and are weighted by that thread's CPU time (microseconds).
+
+The statements the request emitted are recorded with :func:`count_queries`.
+Each profile is written to ``settings.profile_dir`` as ``<name>.wall.folded``,
+``<name>.cpu.folded`` (``frame;frame;frame count`` lines, as read by
+flamegraph.pl, speedscope and inferno) and ``<name>.json`` (request, timings,
+SQL). Old profiles are pruned after each write.
+
+Arming writes ``armed.json`` next to the profiles; every worker process
+re-reads it at most once a second, so a disarmed profiler costs a clock read
+per request. ``count`` is per worker.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from ..core.config import settings
+from .queries import count_queries
+
+log = logging.getLogger(__name__)
+
+ARM_FILE = "armed.json"
+_CHECK_EVERY = 1.0  # seconds between armed.json stats
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def route_pattern(template: str) -> re.Pattern:
+    """Regex for a path template; ``{name}`` matches one segment, ``{name:path}`` the rest."""
+    parts = re.split(r"(\{[^}]*\})", template.rstrip("/") or "/")
+    regex = "".join(
+        (".+" if p.endswith(":path}") else "[^/]+") if p.startswith("{") else re.escape(p)
+        for p in parts
+    )
+    return re.compile(regex + "/?")
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    # first line rather than current line: one flame per function
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _await_chain(task: asyncio.Task) -> list:
+    """Frames of the task's coroutine and everything it awaits, outermost first."""
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames
+
+
+def _thread_stack(frame) -> list:
+    stack = []
+    while frame is not None:
+        stack.append(frame)
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class Sampler(threading.Thread):
+    """Samples one task from a side thread until :meth:`stop`."""
+
+    def __init__(self, task: asyncio.Task, interval: float) -> None:
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.task = task
+        self.interval = interval
+        self.loop_thread = threading.get_ident()  # created on the loop thread
+        self.wall: Counter = Counter()
+        self.cpu: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        try:
+            clock = time.pthread_getcpuclockid(self.loop_thread)
+            last_cpu = time.clock_gettime(clock)
+        except (AttributeError, OSError):
+            clock = None  # no per-thread CPU clocks here: wall samples only
+        while not self._stop_event.wait(self.interval):
+            if self.task.done():
+                break
+            chain = _await_chain(self.task)
+            if not chain:
+                continue
+            thread = _thread_stack(sys._current_frames().get(self.loop_thread))
+            inner = chain[-1]
+            running = next((i for i, f in enumerate(thread) if f is inner), None)
+            stack = chain + thread[running + 1:] if running is not None else chain
+            key = ";".join(_label(f) for f in stack)
+            self.wall[key] += 1
+            self.samples += 1
+            if clock is not None:
+                now = time.clock_gettime(clock)
+                if running is not None:
+                    self.cpu[key] += max(1, int((now - last_cpu) * 1e6))
+                last_cpu = now
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class Profiler:
+    """Arming state (shared through ``armed.json``) and profile storage."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.config: dict | None = None
+        self.taken = 0
+        self._checked = float("-inf")
+        self._mtime: float | None = None
+        self._busy = False
+        self._pattern: re.Pattern | None = None
+
+    @property
+    def arm_path(self) -> str:
+        return os.path.join(self.directory, ARM_FILE)
+
+    # --- arming -----------------------------------------------------------
+
+    def arm(self, route: str | None, method: str | None, percent: float, count: int, minutes: float, interval_ms: float) -> dict:
+        config = {
+            "route": route,
+            "method": method.upper() if method else None,
+            "percent": percent,
+            "count": count,
+            "interval_ms": interval_ms,
+            "until": time.time() + minutes * 60,
+            "armed_at": time.time(),
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self.arm_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(config, f)
+        os.replace(tmp, self.arm_path)
+        self._checked = float("-inf")
+        return config
+
+    def disarm(self) -> None:
+        try:
+            os.remove(self.arm_path)
+        except FileNotFoundError:
+            pass
+        self._checked = float("-inf")
+
+    def _reload(self) -> None:
+        try:
+            mtime = os.stat(self.arm_path).st_mtime
+        except OSError:
+            self.config, self._mtime = None, None
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.arm_path) as f:
+                self.config = json.load(f)
+            self._pattern = route_pattern(self.config["route"]) if self.config["route"] else None
+        except (OSError, ValueError, KeyError):
+            self.config = None
+        self._mtime = mtime
+        self.taken = 0  # re-armed
+
+    def armed(self) -> dict | None:
+        """Current arming, re-read from disk at most once a second."""
+        now = time.monotonic()
+        if now - self._checked >= _CHECK_EVERY:
+            self._checked = now
+            self._reload()
+        config = self.config
+        if config is None:
+            return None
+        if time.time() >= config["until"] or self.taken >= config["count"]:
+            return None
+        return config
+
+    def select(self, config: dict, method: str, path: str) -> bool:
+        """Whether to profile this request; reserves a profile slot."""
+        if self._busy:
+            return False  # one profile at a time per worker bounds the overhead
+        if config["method"] is not None and method != config["method"]:
+            return False
+        if self._pattern is not None and not self._pattern.fullmatch(path):
+            return False
+        if random.random() * 100 >= config["percent"]:
+            return False
+        self._busy = True
+        self.taken += 1
+        return True
+
+    def release(self) -> None:
+        self._busy = False
+
+    def status(self) -> dict:
+        self._checked = float("-inf")
+        config = self.armed()
+        return {
+            "armed": config is not None,
+            "config": self.config,
+            "taken_here": self.taken,
+            "pid": os.getpid(),
+        }
+
+    # --- storage ----------------------------------------------------------
+
+    def save(self, meta: dict, sampler: Sampler, statements: list) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        name = _SAFE_NAME.sub("_", f"{stamp}-{os.getpid()}-{meta['endpoint'] or 'unmatched'}")
+        for kind, counter in (("wall", sampler.wall), ("cpu", sampler.cpu)):
+            with open(os.path.join(self.directory, f"{name}.{kind}.folded"), "w") as f:
+                f.writelines(f"{stack} {n}\n" for stack, n in counter.items())
+        meta = {
+            **meta,
+            "name": name,
+            "samples": sampler.samples,
+            "queries": len(statements),
+            "query_ms": round(sum(s for _, s in statements) * 1000, 1),
+            "sql": [{"ms": round(s * 1000, 2), "statement": " ".join(q.split())} for q, s in statements],
+        }
+        with open(os.path.join(self.directory, f"{name}.json"), "w") as f:
+            json.dump(meta, f, indent=1)
+        self.prune()
+        return name
+
+    def _profiles(self) -> list[str]:
+        try:
+            files = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(f[:-5] for f in files if f.endswith(".json") and f != ARM_FILE)
+
+    def prune(self) -> int:
+        """Drop profiles beyond ``profile_keep`` or older than ``profile_keep_days``."""
+        names = self._profiles()
+        cutoff = time.time() - settings.profile_keep_days * 86400
+        drop = names[:max(0, len(names) - settings.profile_keep)]
+        for name in names[len(drop):]:
+            try:
+                if os.stat(os.path.join(self.directory, f"{name}.json")).st_mtime < cutoff:
+                    drop.append(name)
+            except FileNotFoundError:
+                pass
+        for name in drop:
+            for suffix in (".json", ".wall.folded", ".cpu.folded"):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except FileNotFoundError:
+                    pass
+        return len(drop)
+
+    def list(self) -> list[dict]:
+        out = []
+        for name in reversed(self._profiles()):
+            try:
+                with open(os.path.join(self.directory, f"{name}.json")) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            meta.pop("sql", None)
+            out.append(meta)
+        return out
+
+    def path(self, name: str, kind: str) -> str | None:
+        """File of profile ``name``; ``kind`` is wall, cpu or json."""
+        if _SAFE_NAME.search(name) or name not in self._profiles():
+            return None
+        suffix = ".json" if kind == "json" else f".{kind}.folded"
+        return os.path.join(self.directory, name + suffix)
+
+    # --- running ----------------------------------------------------------
+
+    async def run(self, config: dict, meta: dict, call) -> None:
+        """Await ``call()`` (the rest of the ASGI app) under a sampler."""
+        sampler = Sampler(asyncio.current_task(), config["interval_ms"] / 1000)
+        started = time.perf_counter()
+        try:
+            with count_queries(record=True) as stats:
+                sampler.start()
+                try:
+                    await call()
+                finally:
+                    sampler.stop()
+        finally:
+            meta["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            meta["interval_ms"] = config["interval_ms"]
+            try:
+                await asyncio.to_thread(self.save, meta, sampler, stats.statements)
+            except OSError:
+                log.exception("Could not write profile")
+            self.release()
+
+
+profiler = Profiler(settings.profile_dir)
@@ -0,0 +1,122 @@
+"""Per-request SQL statement counting, N+1 detection and query budgets.
+
+Engine events add every statement executed while a :class:`QueryStats` is
+active (a context variable; SQLAlchemy carries it into the greenlet that
+runs the sync driver code) to that object. :class:`~app.middleware.queries.QueryCountMiddleware`
+opens one per request in debug mode; tests and scripts use
+:func:`count_queries` / :func:`assert_max_queries` directly::
+
+    with assert_max_queries(3):
+        await client.get(f"/patient/assignments/v2/{aid}", headers=P)
+
+Routes declare their budget with :func:`query_budget`.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# nested collectors (a test around a request with debug mode on) all see each statement
+_active: ContextVar[tuple["QueryStats", ...]] = ContextVar("query_stats", default=())
+
+# "$1, $2, $3" (expanded IN lists) and literals vary between otherwise identical statements
+_PARAMS = re.compile(r"\$\d+(?:::\w+)?(?:\s*,\s*\$\d+(?:::\w+)?)*")
+_NUMBERS = re.compile(r"\b\d+\b")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def shape(statement: str) -> str:
+    """Statement text with parameter lists and numbers collapsed."""
+    return _NUMBERS.sub("N", _PARAMS.sub("?", " ".join(statement.split())))
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    seconds: float = 0.0
+    shapes: Counter = field(default_factory=Counter)
+    statements: list | None = None  # (sql, seconds) when recording
+
+    def repeated(self, threshold: int = 3) -> dict[str, int]:
+        """Statement shapes executed at least ``threshold`` times (likely N+1)."""
+        return {s: n for s, n in self.shapes.items() if n >= threshold}
+
+    def summary(self, threshold: int = 3, width: int = 120) -> str:
+        lines = [f"{self.count} queries, {self.seconds * 1000:.1f} ms"]
+        lines += [f"  {n}x {s[:width]}" for s, n in self.repeated(threshold).items()]
+        return "\n".join(lines)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before(conn, cursor, statement, parameters, context, executemany):
+    if _active.get():
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after(conn, cursor, statement, parameters, context, executemany):
+    active = _active.get()
+    if not active:
+        return
+    starts = conn.info.get("query_start")
+    elapsed = time.perf_counter() - starts.pop() if starts else 0.0
+    if context is not None and context.execution_options.get("tenant_setup"):
+        return  # the session's SET LOCAL search_path (database.py), not the route's
+    key = shape(statement)
+    for stats in active:
+        stats.count += 1
+        stats.seconds += elapsed
+        stats.shapes[key] += 1
+        if stats.statements is not None:
+            stats.statements.append((statement, elapsed))
+
+
+@event.listens_for(Engine, "handle_error")
+def _error(ctx):
+    # a failed statement never reaches after_cursor_execute
+    starts = ctx.connection.info.get("query_start") if ctx.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+@contextmanager
+def count_queries(record: bool = False):
+    """Collect the statements executed in this context (and tasks it spawns).
+
+    ``record`` also keeps each statement's text and duration.
+    """
+    stats = QueryStats(statements=[] if record else None)
+    token = _active.set((*_active.get(), stats))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def assert_max_queries(n: int):
+    with count_queries() as stats:
+        yield stats
+    if stats.count > n:
+        raise QueryBudgetExceeded(f"expected at most {n} queries, got {stats.summary()}")
+
+
+def query_budget(n: int):
+    """Declare the maximum number of statements a route may execute."""
+    def decorate(endpoint):
+        endpoint.__query_budget__ = n
+        return endpoint
+    return decorate
+
+
+def budget_of(endpoint) -> int | None:
+    return getattr(endpoint, "__query_budget__", None)
@@ -0,0 +1,161 @@
+"""Next-exercise recommendations: an SM-2 style due queue per patient.
+
+Every assigned ``(patient, assignment)`` pair has a row in
+``patient_recommendation``. Its state comes from replaying the pair's
+finished, scored attempts (live and archived) in order through :func:`sm2`.
+The quality of an attempt is its score as a share of the assignment's
+items, on SM-2's 0-5 scale:
+
+* a quality of 3 or more counts as a success. The interval grows from 1 day
+  to 6 days, and then by the ease factor each time;
+* a lower quality starts the item over at 1 day;
+* the ease factor moves with quality, but never drops below 1.3.
+
+An assignment that has never been attempted is due from the moment it was
+assigned. ``GET /patient/next`` reads the queue in ``due_at`` order. That is
+one index range scan on ``(patient_id, due_at)``.
+
+:func:`refresh` recomputes pairs from scratch. The replay is deterministic,
+so this is the incremental update as well. finish_assignment, mark_review,
+doctor assignments and offline sync uploads call it for the pairs they
+touch. ``python -m app.cli recommend`` recomputes every patient after an
+algorithm change.
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from sqlalchemy import select, func, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import AsyncSessionLocal
+from ..models.archived_record import ArchivedRecord
+from ..models.assignment_details import AssignmentItemBase
+from ..models.assignment_patient import AssignmentPatient
+from ..models.assignment_record import AssignmentRecord
+from ..models.patient_recommendation import PatientRecommendation
+
+MIN_EASE = 1.3
+PASS_QUALITY = 3
+_UPSERT_ROWS = 2000  # 9 parameters a row, under the 32767 limit of the protocol
+
+
+@dataclass
+class _State:
+    due_at: datetime
+    interval_days: float = 0.0
+    ease: float = 2.5
+    repetitions: int = 0
+    attempts: int = 0
+    last_quality: int | None = None
+    last_finished_at: datetime | None = None
+
+
+def quality(score: int, items: int) -> int:
+    """SM-2 quality (0-5) of an attempt scoring ``score`` out of ``items``."""
+    if items <= 0:
+        return PASS_QUALITY
+    return round(5 * min(max(score, 0) / items, 1.0))
+
+
+def sm2(state: _State, q: int, finished_at: datetime) -> None:
+    """Apply one graded attempt to ``state`` (SM-2)."""
+    if q >= PASS_QUALITY:
+        if state.repetitions == 0:
+            state.interval_days = 1.0
+        elif state.repetitions == 1:
+            state.interval_days = 6.0
+        else:
+            state.interval_days = round(state.interval_days * state.ease, 2)
+        state.repetitions += 1
+    else:
+        state.repetitions = 0
+        state.interval_days = 1.0
+    state.ease = max(MIN_EASE, state.ease + 0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))
+    state.attempts += 1
+    state.last_quality = q
+    state.last_finished_at = finished_at
+    state.due_at = finished_at + timedelta(days=state.interval_days)
+
+
+async def refresh(session: AsyncSession, patient_ids: Iterable[int], assignment_ids: Iterable[int] | None = None) -> int:
+    """Recompute the rows of ``patient_ids`` (only ``assignment_ids``, if given).
+
+    Runs in the caller's transaction; the caller commits. Returns the number
+    of rows written.
+    """
+    patient_ids = list(set(patient_ids))
+    if not patient_ids:
+        return 0
+    pair_filter = [AssignmentPatient.patient_id.in_(patient_ids)]
+    if assignment_ids is not None:
+        assignment_ids = list(set(assignment_ids))
+        if not assignment_ids:
+            return 0
+        pair_filter.append(AssignmentPatient.assignment_id.in_(assignment_ids))
+
+    items = (
+        select(func.count())
+        .where(AssignmentItemBase.assignment_id == AssignmentPatient.assignment_id)
+        .scalar_subquery()
+    )
+    pairs = (await session.execute(
+        select(AssignmentPatient.patient_id, AssignmentPatient.assignment_id, AssignmentPatient.assigned_at, items)
+        .filter(*pair_filter)
+    )).all()
+    if not pairs:
+        return 0
+
+    def attempts(model):
+        criteria = [model.patient_id.in_(patient_ids), model.finished_at.is_not(None), model.score.is_not(None)]
+        if assignment_ids is not None:
+            criteria.append(model.assignment_id.in_(assignment_ids))
+        return select(model.patient_id, model.assignment_id, model.finished_at, model.score).filter(*criteria)
+
+    graded = union_all(attempts(AssignmentRecord), attempts(ArchivedRecord)).subquery()
+    history = defaultdict(list)
+    for patient_id, assignment_id, finished_at, score in await session.execute(
+        select(graded).order_by(graded.c.finished_at)
+    ):
+        history[(patient_id, assignment_id)].append((finished_at, score))
+
+    rows = []
+    for patient_id, assignment_id, assigned_at, n_items in pairs:
+        state = _State(due_at=assigned_at or datetime.now().astimezone())
+        for finished_at, score in history.get((patient_id, assignment_id), ()):
+            sm2(state, quality(score, n_items), finished_at)
+        rows.append({"patient_id": patient_id, "assignment_id": assignment_id, **vars(state)})
+
+    for i in range(0, len(rows), _UPSERT_ROWS):
+        stmt = insert(PatientRecommendation).values(rows[i:i + _UPSERT_ROWS])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PatientRecommendation.patient_id, PatientRecommendation.assignment_id],
+            set_={k: stmt.excluded[k] for k in rows[0] if k not in ("patient_id", "assignment_id")},
+        )
+        await session.execute(stmt)
+    return len(rows)
+
+
+async def recompute_all(batch_size: int = 500) -> tuple[int, int]:
+    """Recompute every patient's queue, ``batch_size`` patients per transaction.
+
+    Returns ``(patients, rows)``.
+    """
+    patients = rows = last = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            ids = list((await session.scalars(
+                select(AssignmentPatient.patient_id)
+                .filter(AssignmentPatient.patient_id > last)
+                .group_by(AssignmentPatient.patient_id)
+                .order_by(AssignmentPatient.patient_id)
+                .limit(batch_size)
+            )).all())
+            if not ids:
+                return patients, rows
+            rows += await refresh(session, ids)
+            await session.commit()
+        patients += len(ids)
+        last = ids[-1]
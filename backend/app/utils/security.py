@@ -1,59 +1,98 @@
-from passlib.context import CryptContext
+import time
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Annotated, Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
 
 from ..core.config import settings
 from ..database import get_session
 from ..models.user import User
+from .tracing import span, traced
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# passlib and jose are imported on first use rather than when the app is
+# loaded: every worker imports this module, few requests hash or sign.
+@lru_cache(maxsize=1)
+def pwd_context():
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
 
 def hash_password(password: str) -> str:
     """Hash a plain password using bcrypt."""
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
 
 
 def verify_password(password: str, hashed: str) -> bool:
     """Verify a password against its hash."""
-    return pwd_context.verify(password, hashed)
+    return pwd_context().verify(password, hashed)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 ALGORITHM = "HS256"
 
 
-def create_access_token(subject: str, role: int) -> str:
-    """Generate a JWT that contains the username (sub) and the user's role."""
+def create_access_token(subject: str, role: int, tenant_id: int = 0) -> str:
+    """Generate a JWT with the username (sub), the user's role and clinic (tid)."""
+    from jose import jwt
+
     expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
     to_encode = {"sub": subject, "role": role, "exp": expire}
+    if tenant_id:
+        to_encode["tid"] = tenant_id
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+_verified: dict[str, dict] = {}
+
+
+def decode_token(token: str) -> dict:
+    """Verified claims of ``token``; raises ``jose.JWTError``.
+
+    Admission, tenant resolution and get_current_user all read the token of
+    every request, so verified claims are kept until the token expires.
+    """
+    claims = _verified.get(token)
+    if claims is not None and claims["exp"] > time.time():
+        return claims
+    from jose import jwt
+
+    claims = jwt.decode(token, settings.secret_key, algorithms=[ALGORITHM])
+    if len(_verified) >= 4096:
+        _verified.clear()
+    if "exp" in claims:
+        _verified[token] = claims
+    return claims
+
+
+@traced("auth.get_current_user")
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
     session: Annotated[AsyncSession, Depends(get_session)],
 ) -> User:
+    from jose import JWTError
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[ALGORITHM])
+        with span("auth.jwt_decode"):
+            payload = decode_token(token)
         username: str | None = payload.get("sub")
         if username is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
 
-    result = await session.execute(select(User).filter(User.username == username))
+    with span("auth.user_lookup"):
+        result = await session.execute(select(User).filter(User.username == username))
     user = result.scalar_one_or_none()
     if user is None:
         raise credentials_exception
@@ -0,0 +1,199 @@
+"""Delta sync for (offline-capable) patient clients.
+
+Inserts and updates of assignments (and their items), assignment_patient,
+assignment_record and writing_answer stamp the row with the next value of the
+global ``change_seq`` sequence; deleting an assignment_patient row leaves a
+:class:`SyncTombstone` (triggers in database.py). A client keeps the
+``cursor`` of its last sync and only receives rows stamped after it.
+"""
+import asyncio
+import time
+
+from sqlalchemy import select, and_, or_, true, text, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, noload
+
+from ..core.config import settings
+from ..models.assignment import Assignment
+from ..models.assignment_details import AssignmentItemBase
+from ..models.assignment_patient import AssignmentPatient
+from ..models.assignment_record import AssignmentRecord, MCQAnswer, WritingAnswer
+from ..models.sync_tombstone import SyncTombstone
+from ..schemas.sync import OfflineAttempt, SyncAssignment
+from . import grading, recommendations
+from .answers import pack_records
+
+_LAST = text("SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM change_seq")
+
+# Writers hold this shared advisory lock, keyed on their schema, from taking
+# a change_seq value until they commit (bump_change_seq in database.py).
+_WRITERS = """
+SELECT coalesce(array_agg(virtualtransaction), '{{}}') FROM pg_locks
+WHERE locktype = 'advisory' AND objsubid = 2 AND granted AND pid <> pg_backend_pid()
+  AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+  AND classid::bigint = (hashtext(current_schema())::bigint & 4294967295)
+  AND objid::bigint = (hashtext('change_seq')::bigint & 4294967295)
+  {only}
+"""
+_IN_FLIGHT = text(_WRITERS.format(only=""))
+_STILL_IN_FLIGHT = text(_WRITERS.format(only="AND virtualtransaction = ANY(:writers)"))
+
+
+async def horizon(session: AsyncSession, floor: int = 0, wait: float = 5.0) -> int:
+    """Highest change_seq whose writer has committed.
+
+    Reads the sequence first and then the writers holding the shared lock.
+    A writer that took a value at or below the one read already held the
+    lock, so it is either committed or among those listed. The function
+    waits for the listed writers only. It never queues for the lock, so new
+    writers are not held up. If they are still running after ``wait``
+    seconds, it returns ``floor`` (the client's cursor: no progress this
+    time). Commits ``session``.
+    """
+    value = int(await session.scalar(_LAST))
+    writers = list(await session.scalar(_IN_FLIGHT))
+    delay = 0.002
+    deadline = time.monotonic() + wait
+    while writers:
+        if time.monotonic() > deadline:
+            value = floor
+            break
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.1)
+        writers = list(await session.scalar(_STILL_IN_FLIGHT, {"writers": writers}))
+    await session.commit()
+    return value
+
+
+async def changes(session: AsyncSession, patient_id: int, since: int, upto: int) -> dict:
+    """Everything that changed for ``patient_id`` in ``(since, upto]``; all of it if ``since`` is 0."""
+    def window(col):
+        return and_(col > since, col <= upto) if since else true()
+
+    AP = AssignmentPatient
+    linked = and_(AP.assignment_id == Assignment.id, AP.patient_id == patient_id)
+    assignments = (
+        await session.execute(
+            select(Assignment)
+            .join(AP, linked)
+            .options(
+                noload(Assignment.items),
+                selectinload(Assignment.items_detail).joinedload(AssignmentItemBase.mcq),
+                selectinload(Assignment.items_detail).joinedload(AssignmentItemBase.writing),
+            )
+            .filter(Assignment.deleted_at.is_(None), or_(window(Assignment.change_seq), window(AP.change_seq)))
+            .order_by(Assignment.id)
+        )
+    ).scalars().all()
+
+    removed: set[int] = set()
+    if since:
+        removed.update(
+            await session.scalars(
+                select(SyncTombstone.assignment_id)
+                .filter(SyncTombstone.patient_id == patient_id, window(SyncTombstone.change_seq))
+            )
+        )
+        removed.update(
+            await session.scalars(
+                select(Assignment.id).join(AP, linked)
+                .filter(Assignment.deleted_at.is_not(None), window(Assignment.change_seq))
+            )
+        )
+        removed -= {a.id for a in assignments}  # re-assigned (or restored) since
+
+    R = AssignmentRecord
+    records = (
+        await session.execute(
+            select(R.id, R.assignment_id, R.started_at, R.finished_at, R.score)
+            .filter(R.patient_id == patient_id, window(R.change_seq))
+            .order_by(R.id)
+        )
+    ).mappings().all()
+    writing = (
+        await session.execute(
+            select(WritingAnswer.record_id, WritingAnswer.item_id, WritingAnswer.answer_text,
+                   WritingAnswer.reviewed, WritingAnswer.correct)
+            .join(R, R.id == WritingAnswer.record_id)
+            .filter(R.patient_id == patient_id, window(WritingAnswer.change_seq))
+            .order_by(WritingAnswer.id)
+        )
+    ).mappings().all()
+
+    return {
+        "cursor": max(upto, since),
+        "full": not since,
+        "assignments": [SyncAssignment.from_assignment(a, version=a.change_seq or 0) for a in assignments],
+        "removed_assignments": sorted(removed),
+        "records": records,
+        "writing_answers": writing,
+    }
+
+
+async def upload(session: AsyncSession, patient_id: int, attempts: list[OfflineAttempt]) -> list[dict]:
+    """Store attempts made offline; the caller commits.
+
+    Each attempt becomes its own record. ``client_ref`` is unique per patient,
+    so a batch re-sent after a lost response is not stored twice.
+    """
+    assigned = set(
+        await session.scalars(
+            select(AssignmentPatient.assignment_id)
+            .join(Assignment, Assignment.id == AssignmentPatient.assignment_id)
+            .filter(
+                AssignmentPatient.patient_id == patient_id,
+                AssignmentPatient.assignment_id.in_({a.assignment_id for a in attempts}),
+                Assignment.deleted_at.is_(None),
+            )
+            .with_for_update(of=Assignment, read=True)  # a delete or purge waits for the upload
+        )
+    )
+    results, finished, finished_assignments = [], [], set()
+    for a in attempts:
+        if a.assignment_id not in assigned:
+            results.append({"client_ref": a.client_ref, "status": "not_assigned"})
+            continue
+        record_id = await session.scalar(
+            insert(AssignmentRecord)
+            .values(
+                assignment_id=a.assignment_id,
+                patient_id=patient_id,
+                client_ref=a.client_ref,
+                started_at=a.started_at or func.now(),
+                finished_at=a.finished_at,
+                score=a.score,
+            )
+            .on_conflict_do_nothing(
+                index_elements=[AssignmentRecord.patient_id, AssignmentRecord.client_ref],
+                index_where=AssignmentRecord.client_ref.is_not(None),
+            )
+            .returning(AssignmentRecord.id)
+        )
+        if record_id is None:
+            record_id = await session.scalar(
+                select(AssignmentRecord.id).filter_by(patient_id=patient_id, client_ref=a.client_ref)
+            )
+            results.append({"client_ref": a.client_ref, "record_id": record_id, "status": "duplicate"})
+            continue
+        if a.mcq_answers:
+            await session.execute(
+                insert(MCQAnswer), [{"record_id": record_id, **m.model_dump()} for m in a.mcq_answers]
+            )
+        # last text per item wins, as with repeated submits
+        texts = {w.item_id: w.answer_text for w in a.writing_answers}
+        if texts:
+            await session.execute(
+                insert(WritingAnswer).values(
+                    [{"record_id": record_id, "item_id": i, "answer_text": t} for i, t in texts.items()]
+                )
+            )
+        if a.finished_at is not None:
+            finished.append(record_id)
+            finished_assignments.add(a.assignment_id)
+        results.append({"client_ref": a.client_ref, "record_id": record_id, "status": "created"})
+    await grading.grade_records(session, finished)
+    if settings.compact_mcq_answers:
+        await pack_records(session, finished)
+    await recommendations.refresh(session, [patient_id], finished_assignments)
+    return results
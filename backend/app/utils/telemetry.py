@@ -0,0 +1,209 @@
+"""Item response-time telemetry: ring buffer plus batched COPY writer.
+
+Clients report when an item was shown (``view``), first answered
+(``answer``) and when the answer was changed (``change``), either attached
+to an answer submission or on their own (``POST /patient/records/{id}/events``).
+:meth:`Telemetry.put` only appends to an in-memory ring buffer, so the
+submission endpoints do no extra database work. A background task drains
+the buffer every ``telemetry_flush_interval`` seconds (sooner once
+``telemetry_batch_size`` events are waiting) and writes each batch to the
+append-only ``item_event`` table with one COPY.
+
+Telemetry is lossy by design: when the buffer is full the oldest events are
+overwritten, and a batch whose COPY fails is dropped; both are counted
+(``GET /admin/telemetry``). Buffers are per worker; shutdown flushes.
+Events carry their clinic's id and are COPYed into that clinic's schema,
+wherever it lives at flush time; events of a clinic being moved wait.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timezone
+from typing import Iterable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core import tenancy
+from ..core.config import settings
+from ..database import engine_for
+from .clinics import registry
+
+logger = logging.getLogger(__name__)
+
+KINDS = {"view": 0, "answer": 1, "change": 2}
+_COLUMNS = ["patient_id", "assignment_id", "item_id", "kind", "ts", "received_at"]
+
+
+class Telemetry:
+    def __init__(self, capacity: int | None = None, batch_size: int | None = None, interval: float | None = None) -> None:
+        self.capacity = capacity or settings.telemetry_buffer_size
+        self.batch_size = batch_size or settings.telemetry_batch_size
+        self.interval = interval if interval is not None else settings.telemetry_flush_interval
+        self._buffer: deque[tuple] = deque(maxlen=self.capacity)
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.metrics: Counter = Counter()
+
+    def put(self, patient_id: int, assignment_id: int, events: Iterable) -> None:
+        """Queue ``events`` (objects with ``item_id``, ``kind``, ``ts``); never blocks."""
+        received = datetime.now(timezone.utc)
+        tenant_id = tenancy.current().id
+        buffer = self._buffer
+        for e in events:
+            if len(buffer) == self.capacity:
+                self.metrics["dropped_overflow"] += 1  # the append evicts the oldest event
+            buffer.append((tenant_id, patient_id, assignment_id, e.item_id, KINDS[e.kind], e.ts, received))
+            self.metrics["accepted"] += 1
+        if len(buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Write everything buffered so far, in batches; returns rows written."""
+        written = 0
+        held: list[tuple] = []  # events of clinics being moved, buffered again afterwards
+        async with self._lock:
+            try:
+                while self._buffer:
+                    written += await self._write_batch(held)
+            finally:
+                self._buffer.extend(held)
+        return written
+
+    async def _write_batch(self, held: list[tuple]) -> int:
+        n = min(len(self._buffer), self.batch_size)
+        by_tenant = defaultdict(list)
+        for tenant_id, *record in (self._buffer.popleft() for _ in range(n)):
+            by_tenant[tenant_id].append(record)
+        started = time.perf_counter()
+        written = 0
+        try:
+            for tenant_id, batch in list(by_tenant.items()):
+                # resolved now: the clinic may have moved since the events came in
+                tenant = await registry.get(tenant_id)
+                if tenant is None:
+                    self.metrics["dropped_unknown"] += len(batch)
+                elif tenant.status == "moving":
+                    held.extend((tenant_id, *record) for record in batch)
+                else:
+                    async with engine_for(tenant).connect() as conn:
+                        raw = await conn.get_raw_connection()
+                        await raw.driver_connection.copy_records_to_table(
+                            "item_event", records=batch, columns=_COLUMNS, schema_name=tenant.schema
+                        )
+                    written += len(batch)
+                del by_tenant[tenant_id]
+        except Exception:
+            self.metrics["dropped_failed"] += sum(map(len, by_tenant.values()))
+            raise
+        if written:
+            self.metrics["written"] += written
+            self.metrics["batches"] += 1
+            self.metrics["copy_ms"] += round((time.perf_counter() - started) * 1000, 3)
+        return written
+
+    # ---- lifecycle -------------------------------------------------------
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Telemetry flush failed at shutdown")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Telemetry flush failed")
+
+    def stats(self) -> dict:
+        return {"capacity": self.capacity, "pending": len(self._buffer), **self.metrics}
+
+
+telemetry = Telemetry()
+
+
+# ---- queries ---------------------------------------------------------------
+
+# Response time of an item: from its latest view to the first answer after
+# it, per patient. Answers without a preceding view, or slower than
+# max_seconds (the patient walked away), are counted but not timed.
+_RESPONSE_TIMES = """
+WITH ev AS (
+    SELECT assignment_id, item_id, kind, ts,
+           max(ts) FILTER (WHERE kind = 0) OVER (
+               PARTITION BY patient_id, assignment_id, item_id ORDER BY ts, id
+           ) AS viewed_at
+    FROM item_event
+    WHERE assignment_id = ANY(:assignment_ids) {where}
+), timed AS (
+    SELECT assignment_id, item_id, kind,
+           CASE WHEN kind = 1 AND ts - viewed_at <= make_interval(secs => :max_seconds)
+                THEN extract(epoch FROM ts - viewed_at) * 1000 END AS ms
+    FROM ev
+)
+SELECT assignment_id, item_id,
+       count(*) FILTER (WHERE kind = 0) AS views,
+       count(*) FILTER (WHERE kind = 1) AS answers,
+       count(*) FILTER (WHERE kind = 2) AS changes,
+       count(ms) AS timed,
+       avg(ms) AS mean_ms,
+       percentile_cont(ARRAY[0.5, 0.75, 0.9, 0.95]) WITHIN GROUP (ORDER BY ms) AS pct,
+       max(ms) AS max_ms
+FROM timed
+GROUP BY assignment_id, item_id
+ORDER BY assignment_id, item_id
+"""
+
+
+async def response_times(
+    session: AsyncSession,
+    assignment_ids: list[int],
+    doctor_id: int | None = None,
+    since: datetime | None = None,
+    max_seconds: float = 1800,
+) -> list[dict]:
+    """Per-item response-time distribution over ``assignment_ids``, in one query.
+
+    With ``doctor_id`` only that doctor's patients are included.
+    """
+    where, params = "", {"assignment_ids": assignment_ids, "max_seconds": max_seconds}
+    if doctor_id is not None:
+        where += " AND patient_id IN (SELECT id FROM users WHERE doctor_id = :doctor_id)"
+        params["doctor_id"] = doctor_id
+    if since is not None:
+        where += " AND ts >= :since"
+        params["since"] = since
+    rows = (await session.execute(text(_RESPONSE_TIMES.format(where=where)), params)).all()
+    out = []
+    for r in rows:
+        p50, p75, p90, p95 = r.pct if r.timed else (None,) * 4
+        out.append({
+            "assignment_id": r.assignment_id,
+            "item_id": r.item_id,
+            "views": r.views,
+            "answers": r.answers,
+            "changes": r.changes,
+            "timed": r.timed,
+            **{k: None if v is None else round(float(v), 1) for k, v in (
+                ("mean_ms", r.mean_ms), ("p50_ms", p50), ("p75_ms", p75),
+                ("p90_ms", p90), ("p95_ms", p95), ("max_ms", r.max_ms),
+            )},
+        })
+    return out
@@ -0,0 +1,444 @@
+"""Request tracing: spans for auth, SQL, endpoint, serialization and file work.
+
+:class:`~app.middleware.tracing.TracingMiddleware` opens a :class:`Trace` per
+request (``settings.tracing``); code inside marks interesting work with
+:func:`span` (or :func:`traced`)::
+
+    with span("file.write", bytes=len(data)):
+        f.write(data)
+
+Every SQL statement becomes a span through engine events, routes declared
+with :class:`TracedRoute` get an ``endpoint`` span, and the time between the
+endpoint returning and the response starting is recorded as ``serialize``.
+Outside a trace (tracing off, background jobs, CLI) :func:`span` returns a
+shared no-op context manager after one context-variable read.
+
+Traces are sampled at the end of the request (tail sampling): errors and
+requests slower than ``settings.trace_slow_ms`` are always kept, the rest
+by :class:`AdaptiveSampler` at about ``trace_sample_per_second``. Kept traces
+are exported from a background thread, as JSON lines (``trace_exporter=file``)
+or OTLP/HTTP JSON to ``trace_otlp_endpoint`` (``otlp``); when the exporter
+falls behind, traces are dropped and counted rather than queued without
+bound.
+"""
+import functools
+import inspect
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextvars import ContextVar
+from typing import Any, Callable
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..core.config import settings
+from .queries import shape
+
+log = logging.getLogger(__name__)
+
+MAX_SPANS = 2000  # per trace; a runaway loop of statements must not eat the heap
+_STATEMENT_WIDTH = 500
+
+_trace: ContextVar["Trace | None"] = ContextVar("trace", default=None)
+_parent: ContextVar[int | None] = ContextVar("trace_parent", default=None)
+
+
+# Span ids only need to be unique within a trace: a counter from a random
+# start is unique per process and far cheaper than drawing random bits. Ids
+# stay ints (and SQL stays unshaped) until the exporter thread formats them.
+_span_ids = itertools.count(random.getrandbits(62) | 1)
+
+
+class Trace:
+    """Spans of one request, as ``(span_id, parent_id, name, start_ns, end_ns, attrs)``.
+
+    Finished spans are appended from any thread.
+    """
+
+    __slots__ = ("trace_id", "request_id", "root_id", "remote_parent", "spans", "dropped", "serialize_from")
+
+    def __init__(self, request_id: str, trace_id: str | None = None, remote_parent: str | None = None) -> None:
+        self.trace_id = int(trace_id, 16) if trace_id else random.getrandbits(128)
+        self.request_id = request_id
+        self.root_id = next(_span_ids)
+        self.remote_parent = int(remote_parent, 16) if remote_parent else None
+        self.spans: list[tuple] = []
+        self.dropped = 0
+        self.serialize_from: int | None = None
+
+    def add(self, name: str, start_ns: int, end_ns: int, parent: int | None, attrs: dict, span_id: int | None = None) -> None:
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append((span_id or next(_span_ids), parent or self.root_id, name, start_ns, end_ns, attrs))
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "span_id", "parent", "start", "token")
+
+    def __init__(self, trace: Trace, name: str, attrs: dict) -> None:
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> "_Span":
+        self.span_id = next(_span_ids)
+        self.parent = _parent.get()
+        self.token = _parent.set(self.span_id)
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        end = time.time_ns()
+        _parent.reset(self.token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.trace.add(self.name, self.start, end, self.parent, self.attrs, self.span_id)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str, **attrs: Any) -> "_Span | _NoSpan":
+    """A child span of the current one, or a no-op outside a trace."""
+    trace = _trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, attrs)
+
+
+def traced(name: str | None = None) -> Callable:
+    """Decorator form of :func:`span` for sync and async functions."""
+    def decorate(func):
+        label = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(label):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def current_request_id() -> str | None:
+    trace = _trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def start_trace(trace: Trace):
+    """Make ``trace`` current; returns tokens for :func:`end_trace`."""
+    return _trace.set(trace), _parent.set(trace.root_id)
+
+
+def end_trace(tokens) -> None:
+    trace_token, parent_token = tokens
+    _parent.reset(parent_token)
+    _trace.reset(trace_token)
+
+
+# --- routes ------------------------------------------------------------------
+
+class TracedRoute(APIRoute):
+    """APIRoute whose endpoint call is an ``endpoint`` span.
+
+    The wrapper keeps the endpoint's signature (``functools.wraps``), so
+    dependencies, response models and route names are unchanged.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs: Any) -> None:
+        super().__init__(path, _traced_endpoint(endpoint), **kwargs)
+
+
+def _traced_endpoint(endpoint: Callable) -> Callable:
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            trace = _trace.get()
+            if trace is None:
+                return await endpoint(*args, **kwargs)
+            with _Span(trace, "endpoint", {"function": endpoint.__name__}):
+                result = await endpoint(*args, **kwargs)
+            trace.serialize_from = time.time_ns()
+            return result
+        return wrapper
+
+    @functools.wraps(endpoint)
+    def sync_wrapper(*args, **kwargs):
+        trace = _trace.get()
+        if trace is None:
+            return endpoint(*args, **kwargs)
+        with _Span(trace, "endpoint", {"function": endpoint.__name__}):
+            result = endpoint(*args, **kwargs)
+        trace.serialize_from = time.time_ns()
+        return result
+    return sync_wrapper
+
+
+# --- SQL ---------------------------------------------------------------------
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before(conn, cursor, statement, parameters, context, executemany):
+    if _trace.get() is not None:
+        conn.info.setdefault("trace_start", []).append(time.time_ns())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+    starts = conn.info.get("trace_start")
+    if trace is None or not starts:
+        return
+    attrs = {"db.statement": statement}
+    if cursor.rowcount is not None and cursor.rowcount >= 0:
+        attrs["db.rows"] = cursor.rowcount
+    trace.add("sql", starts.pop(), time.time_ns(), _parent.get(), attrs)
+
+
+@event.listens_for(Engine, "handle_error")
+def _error(ctx):
+    trace = _trace.get()
+    starts = ctx.connection.info.get("trace_start") if ctx.connection is not None else None
+    if trace is None or not starts:
+        return
+    attrs = {"db.statement": ctx.statement or "", "error": type(ctx.original_exception).__name__}
+    trace.add("sql", starts.pop(), time.time_ns(), _parent.get(), attrs)
+
+
+# --- sampling ------------------------------------------------------------------
+
+class AdaptiveSampler:
+    """Keeps about ``per_second`` ordinary traces per second.
+
+    The keep probability for each one-second window is derived from the
+    request rate of the previous one, so quiet periods keep everything and
+    bursts do not flood the exporter.
+    """
+
+    def __init__(self, per_second: float) -> None:
+        self.per_second = per_second
+        self.probability = 1.0
+        self._window = int(time.monotonic())
+        self._seen = 0
+
+    def sample(self) -> bool:
+        now = int(time.monotonic())
+        if now != self._window:
+            rate = self._seen / (now - self._window)
+            self.probability = min(1.0, self.per_second / rate) if rate else 1.0
+            self._window, self._seen = now, 0
+        self._seen += 1
+        return random.random() < self.probability
+
+
+# --- export --------------------------------------------------------------------
+
+def to_json(record: dict) -> dict:
+    """A kept trace as exported: hex ids, shaped SQL, one dict per span."""
+    spans = []
+    for span_id, parent, name, start, end, attrs in record["spans"]:
+        if "db.statement" in attrs:
+            attrs = {**attrs, "db.statement": shape(attrs["db.statement"])[:_STATEMENT_WIDTH]}
+        spans.append({
+            "span_id": f"{span_id:016x}",
+            "parent_id": f"{parent:016x}" if parent is not None else None,
+            "name": name,
+            "start_ns": start,
+            "end_ns": end,
+            "attrs": attrs,
+        })
+    return {
+        **record,
+        "trace_id": f"{record['trace_id']:032x}",
+        "root_id": f"{record['root_id']:016x}",
+        "spans": spans,
+    }
+
+
+def to_otlp(records: list[dict], service_name: str) -> dict:
+    """OTLP/HTTP JSON body (``ExportTraceServiceRequest``) for traces from :func:`to_json`."""
+    def value(v):
+        if isinstance(v, bool):
+            return {"boolValue": v}
+        if isinstance(v, int):
+            return {"intValue": str(v)}
+        if isinstance(v, float):
+            return {"doubleValue": v}
+        return {"stringValue": str(v)}
+
+    spans = []
+    for rec in records:
+        for s in rec["spans"]:
+            spans.append({
+                "traceId": rec["trace_id"],
+                "spanId": s["span_id"],
+                "parentSpanId": s["parent_id"] or "",
+                "name": s["name"],
+                "kind": 2 if s["span_id"] == rec["root_id"] else 1,  # SERVER for the root, else INTERNAL
+                "startTimeUnixNano": str(s["start_ns"]),
+                "endTimeUnixNano": str(s["end_ns"]),
+                "attributes": [{"key": k, "value": value(v)} for k, v in s["attrs"].items()],
+                "status": {"code": 2} if "error" in s["attrs"] else {},
+            })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "app.utils.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class Exporter:
+    """Ships kept traces from a daemon thread in batches."""
+
+    def __init__(self, kind: str, path: str, endpoint: str, max_bytes: int, queue_size: int = 1000) -> None:
+        self.kind = kind
+        self.path = path
+        self.endpoint = endpoint.rstrip("/") + "/v1/traces"
+        self.max_bytes = max_bytes
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, record: dict) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Export what is queued and stop the thread."""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            batch = [item] if item is not None else []
+            while item is not None and len(batch) < 100:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    batch.append(item)
+            if batch:
+                try:
+                    self._write(batch)
+                    self.exported += len(batch)
+                except Exception:
+                    self.failed += len(batch)
+                    log.exception("Trace export failed (%d trace(s) lost)", len(batch))
+            if item is None:
+                return
+
+    def _write(self, batch: list[dict]) -> None:
+        batch = [to_json(r) for r in batch]
+        if self.kind == "otlp":
+            body = json.dumps(to_otlp(batch, settings.trace_service_name)).encode()
+            req = urllib.request.Request(self.endpoint, data=body, headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(req, timeout=5) as resp:
+                resp.read()
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            if os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")  # keep one previous file
+        except FileNotFoundError:
+            pass
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, separators=(",", ":")) + "\n" for r in batch)
+
+
+class Tracer:
+    """Sampling decision and export for finished request traces."""
+
+    def __init__(self) -> None:
+        self.sampler = AdaptiveSampler(settings.trace_sample_per_second)
+        self.exporter = Exporter(
+            settings.trace_exporter, settings.trace_file, settings.trace_otlp_endpoint, settings.trace_file_max_bytes
+        )
+        self.slow_ns = int(settings.trace_slow_ms * 1_000_000)
+        self.traces = 0
+        self.kept = 0
+
+    def finish(self, trace: Trace, name: str, start_ns: int, end_ns: int, attrs: dict) -> bool:
+        """Add the root span and export the trace if it is kept."""
+        self.traces += 1
+        status = attrs.get("http.status_code") or 500
+        if "error" in attrs or status >= 500:
+            reason = "error"
+        elif end_ns - start_ns >= self.slow_ns:
+            reason = "slow"
+        elif self.sampler.sample():
+            reason = "sampled"
+        else:
+            return False
+        self.kept += 1
+        root = (trace.root_id, trace.remote_parent, name, start_ns, end_ns, attrs)
+        self.exporter.submit({
+            "trace_id": trace.trace_id,
+            "root_id": trace.root_id,
+            "request_id": trace.request_id,
+            "name": name,
+            "duration_ms": round((end_ns - start_ns) / 1e6, 3),
+            "status": status,
+            "kept": reason,
+            "dropped_spans": trace.dropped,
+            "spans": [root, *trace.spans],
+        })
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "traces": self.traces,
+            "kept": self.kept,
+            "sample_probability": round(self.sampler.probability, 4),
+            "exported": self.exporter.exported,
+            "dropped": self.exporter.dropped,
+            "failed": self.exporter.failed,
+        }
+
+
+tracer = Tracer()
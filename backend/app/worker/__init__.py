@@ -0,0 +1,248 @@
+"""Durable background jobs stored in the ``jobs`` table.
+
+Handlers are registered with :func:`task` (see ``app/tasks.py``) and executed
+by :class:`WorkerPool`, either inside the API process (started from
+``main.py``) or standalone::
+
+    python -m app.worker
+
+Jobs are claimed with ``FOR UPDATE SKIP LOCKED`` so any number of pools can
+poll the same table without handing the same job out twice. A job whose
+``started_at`` is older than ``settings.job_stale_after`` is taken to
+belong to a dead worker and is handed out again, or failed once its
+attempts are used up. :meth:`JobContext.progress` refreshes ``started_at``,
+so long jobs should report progress more often than that.
+
+Per-kind ``concurrency`` limits apply per pool, that is per process. With
+the in-app pool under gunicorn, every web worker runs its own pool, so a
+limit of 1 allows one job of that kind per worker process. Set
+``JOB_WORKER_IN_APP=false`` and run a single ``python -m app.worker`` where a
+global limit matters. Each database
+has one queue (``public.jobs``) for the clinics it holds; a job records its
+clinic and runs for it (core/tenancy.py). Pools poll every database.
+"""
+import asyncio
+import logging
+import signal
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import func, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core import tenancy
+from ..core.config import settings
+from ..database import AsyncSessionLocal, engine_for
+from ..models.job import Job
+from ..utils.clinics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job cannot possibly help."""
+
+
+@dataclass
+class TaskSpec:
+    fn: Callable[["JobContext"], Awaitable[Any]]
+    concurrency: int = 1
+    max_attempts: int = 3
+    backoff: float = 5.0  # seconds before the first retry, doubled per attempt
+
+
+TASKS: dict[str, TaskSpec] = {}
+
+
+def task(kind: str, *, concurrency: int = 1, max_attempts: int = 3, backoff: float = 5.0):
+    """Register ``fn`` as the handler for jobs of ``kind``."""
+
+    def decorator(fn):
+        TASKS[kind] = TaskSpec(fn, concurrency, max_attempts, backoff)
+        return fn
+
+    return decorator
+
+
+@dataclass
+class JobContext:
+    id: int
+    kind: str
+    payload: dict
+    attempt: int
+
+    async def progress(self, **data: Any) -> None:
+        """Persist a progress snapshot so the status endpoint can report it.
+
+        Also the job's heartbeat: ``started_at`` moves forward, so the job is
+        not mistaken for a dead worker's and run a second time.
+        """
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(Job).where(Job.id == self.id).values(progress=data, started_at=func.now()))
+            await session.commit()
+
+
+async def enqueue(session: AsyncSession, kind: str, payload: dict | None = None, *, delay: float = 0.0) -> Job:
+    """Add a job to ``session``; workers see it once the caller commits."""
+    spec = TASKS.get(kind)
+    if spec is None:
+        raise KeyError(f"Unknown job kind: {kind}")
+    job = Job(kind=kind, payload=payload or {}, max_attempts=spec.max_attempts, tenant_id=tenancy.current().id)
+    if delay:
+        job.run_after = datetime.now(timezone.utc) + timedelta(seconds=delay)
+    session.add(job)
+    await session.flush()
+    return job
+
+
+_CLAIM = text(
+    """
+    UPDATE public.jobs
+    SET status = 'running', attempts = attempts + 1, started_at = now()
+    WHERE id = (
+        SELECT id FROM public.jobs
+        WHERE status = 'queued' AND run_after <= now() AND kind = ANY(:kinds)
+          AND tenant_id <> ALL(:moving)  -- clinics being moved (utils/clinics.py)
+        ORDER BY run_after, id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING id, tenant_id, kind, payload, attempts, max_attempts
+    """
+)
+
+# Jobs left "running" by a worker that died are handed out again, unless
+# their attempts are used up: a job that kills its worker must not loop.
+_REQUEUE_STALE = text(
+    """
+    UPDATE public.jobs
+    SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+        run_after = now(),
+        finished_at = CASE WHEN attempts >= max_attempts THEN now() END,
+        last_error = CASE WHEN attempts >= max_attempts
+                          THEN 'worker stopped responding (attempt ' || attempts || ')' ELSE last_error END
+    WHERE status = 'running' AND started_at < now() - make_interval(secs => :stale)
+    """
+)
+
+
+class WorkerPool:
+    """Poll the jobs table and run handlers within per-kind concurrency limits."""
+
+    def __init__(self, kinds: list[str] | None = None, poll_interval: float | None = None) -> None:
+        self.poll_interval = poll_interval if poll_interval is not None else settings.job_poll_interval
+        self._sems = {k: asyncio.Semaphore(TASKS[k].concurrency) for k in (kinds or TASKS)}
+        self._running: set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+        self._loop_task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Stop claiming new jobs and give in-flight ones ``timeout`` seconds."""
+        self._stopping.set()
+        if self._loop_task:
+            await self._loop_task
+        if self._running:
+            await asyncio.wait(self._running, timeout=timeout)
+
+    async def _run(self) -> None:
+        last_reap = 0.0
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            try:
+                if loop.time() - last_reap > settings.job_stale_after / 2:
+                    await self._requeue_stale()
+                    last_reap = loop.time()
+                free = [k for k, sem in self._sems.items() if not sem.locked()]
+                claimed = await self._claim(free) if free else None
+            except Exception:
+                logger.exception("Job poll failed")
+                claimed = None
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            row, database = claimed
+            sem = self._sems[row.kind]
+            await sem.acquire()
+            t = asyncio.create_task(self._execute(row, database))
+            self._running.add(t)
+            t.add_done_callback(lambda t, sem=sem: (self._running.discard(t), sem.release()))
+
+    async def _claim(self, kinds: list[str]):
+        moving = await registry.moving()
+        for database in await registry.databases():
+            with tenancy.use(database):
+                async with AsyncSessionLocal() as session:
+                    row = (await session.execute(_CLAIM, {"kinds": kinds, "moving": moving})).first()
+                    await session.commit()
+            if row is not None:
+                return row, database
+        return None
+
+    async def _requeue_stale(self) -> None:
+        for database in await registry.databases():
+            with tenancy.use(database):
+                async with AsyncSessionLocal() as session:
+                    await session.execute(_REQUEUE_STALE, {"stale": settings.job_stale_after})
+                    await session.commit()
+
+    async def _execute(self, row, database: tenancy.Tenant) -> None:
+        tenant = await registry.get(row.tenant_id)
+        if tenant is None or engine_for(tenant) is not engine_for(database):
+            logger.error("Job %s belongs to clinic %s, which is not in this database", row.id, row.tenant_id)
+            values = {"status": "failed", "last_error": "unknown clinic", "finished_at": datetime.now(timezone.utc)}
+        elif tenant.status == "moving":
+            # its tables are being copied; the move hands it to the new database's queue
+            values = {"status": "queued", "attempts": row.attempts - 1,
+                      "run_after": datetime.now(timezone.utc) + timedelta(seconds=30)}
+        else:
+            with tenancy.use(tenant):
+                await self._run_job(row)
+            return
+        with tenancy.use(database):
+            async with AsyncSessionLocal() as session:
+                await session.execute(update(Job).where(Job.id == row.id).values(**values))
+                await session.commit()
+
+    async def _run_job(self, row) -> None:
+        spec = TASKS[row.kind]
+        ctx = JobContext(id=row.id, kind=row.kind, payload=row.payload or {}, attempt=row.attempts)
+        try:
+            result = await spec.fn(ctx)
+        except Exception as exc:
+            retry = not isinstance(exc, PermanentJobError) and row.attempts < row.max_attempts
+            logger.warning("Job %s (%s) attempt %s failed: %r", row.id, row.kind, row.attempts, exc)
+            values: dict[str, Any] = {"last_error": repr(exc)}
+            if retry:
+                delay = spec.backoff * 2 ** (row.attempts - 1)
+                values.update(status="queued", run_after=datetime.now(timezone.utc) + timedelta(seconds=delay))
+            else:
+                values.update(status="failed", finished_at=datetime.now(timezone.utc))
+        else:
+            values = {"status": "done", "result": result, "finished_at": datetime.now(timezone.utc)}
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(Job).where(Job.id == row.id).values(**values))
+            await session.commit()
+
+
+async def serve() -> None:
+    """Run a standalone pool until SIGINT/SIGTERM (``python -m app.worker``)."""
+    pool = WorkerPool()
+    await pool.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    logger.info("Worker started for %s", ", ".join(sorted(TASKS)))
+    await stop.wait()
+    await pool.stop()
+
+
+# Register handlers (tasks.py imports `task` from this module)
+from .. import tasks  # noqa: E402,F401
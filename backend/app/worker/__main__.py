@@ -0,0 +1,7 @@
+import asyncio
+import logging
+
+from . import serve
+
+logging.basicConfig(level=logging.INFO)
+asyncio.run(serve())
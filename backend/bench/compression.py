@@ -0,0 +1,53 @@
+"""Bandwidth of API responses per content coding.
+
+Run against a live server (log in first to get a token):
+
+    python bench/compression.py --base-url http://localhost:8000 --token $TOKEN \
+        /admin/users /assignments/ /patient/records
+
+For each path it fetches the response with ``Accept-Encoding: identity``,
+``gzip`` and ``br`` and prints wire bytes, saving and median latency. Uses
+only the standard library so the numbers are raw bytes on the wire.
+"""
+import argparse
+import statistics
+import time
+import urllib.request
+
+CODINGS = ("identity", "gzip", "br")
+
+
+def fetch(url: str, token: str | None, coding: str) -> tuple[int, str, float]:
+    req = urllib.request.Request(url, headers={"Accept-Encoding": coding})
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(req) as resp:
+        body = resp.read()
+        used = resp.headers.get("Content-Encoding", "identity")
+    return len(body), used, time.perf_counter() - t0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'path':40} {'coding':9} {'bytes':>10} {'saved':>7} {'p50 ms':>8}")
+    for path in args.paths:
+        url = args.base_url.rstrip("/") + path
+        baseline = None
+        for coding in CODINGS:
+            runs = [fetch(url, args.token, coding) for _ in range(args.repeat)]
+            size, used = runs[-1][0], runs[-1][1]
+            baseline = baseline or size
+            saved = 1 - size / baseline if baseline else 0.0
+            p50 = statistics.median(r[2] for r in runs) * 1000
+            print(f"{path:40} {used:9} {size:>10} {saved:>6.1%} {p50:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Cold import time of the app, as every worker pays it on start.
+
+    python bench/importtime.py [--runs 7] [--top 15] [--module app.main] [--record]
+
+Runs ``python -X importtime -c "import <module>"`` in fresh interpreters and
+reports the median total and the slowest modules by cumulative time. With
+``--record`` the result is appended to ``bench/importtime.jsonl`` (one line
+per run: date, commit, median, top modules) so regressions show up when the
+file is compared over time; the last recorded median is printed for
+reference. Run from ``backend/``.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(HERE)
+HISTORY = os.path.join(HERE, "importtime.jsonl")
+
+
+def sample(module: str) -> dict[str, tuple[int, int]]:
+    """module -> (self us, cumulative us) for one cold import."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND, capture_output=True, text=True,
+    )
+    if proc.returncode:
+        sys.exit(proc.stderr)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def commit() -> str | None:
+    proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True, text=True)
+    return proc.stdout.strip() or None
+
+
+def last_recorded() -> dict | None:
+    try:
+        with open(HISTORY, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--record", action="store_true", help=f"append the result to {os.path.relpath(HISTORY)}")
+    args = parser.parse_args()
+
+    sample(args.module)  # first run fills __pycache__
+    runs = [sample(args.module) for _ in range(args.runs)]
+    total = statistics.median(r[args.module][1] for r in runs) / 1000
+    cumulative = {
+        name: statistics.median(r.get(name, (0, 0))[1] for r in runs) / 1000
+        for name in runs[0]
+    }
+    top = sorted(((ms, name) for name, ms in cumulative.items() if name != args.module), reverse=True)[: args.top]
+
+    print(f"import {args.module}: median {total:.1f} ms over {args.runs} runs, {len(runs[0])} modules")
+    for ms, name in top:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    previous = last_recorded()
+    if previous and previous.get("module") == args.module:
+        print(f"last recorded: {previous['median_ms']} ms at {previous['commit']} ({previous['date']})")
+    if args.record:
+        entry = {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": commit(),
+            "python": sys.version.split()[0],
+            "module": args.module,
+            "median_ms": round(total, 1),
+            "modules": len(runs[0]),
+            "top": {name: round(ms, 1) for ms, name in top},
+        }
+        with open(HISTORY, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        print(f"recorded in {os.path.relpath(HISTORY)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Stand-in OTLP/HTTP collector for local runs.
+
+    python bench/otlp_sink.py [--port 4318] [--out otlp.jsonl]
+
+Accepts ``POST /v1/traces`` with a JSON ``ExportTraceServiceRequest`` (what
+``TRACE_EXPORTER=otlp`` sends), appends each body to ``--out`` as one line
+and prints a span count. Point a real collector (OpenTelemetry Collector,
+Jaeger, Tempo) at the same port instead when one is available.
+"""
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(out: str):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/v1/traces":
+                self.send_error(404)
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self.send_error(400, "expected OTLP JSON")
+                return
+            spans = sum(
+                len(scope.get("spans", ()))
+                for rs in payload.get("resourceSpans", ())
+                for scope in rs.get("scopeSpans", ())
+            )
+            with open(out, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+            print(f"received {spans} span(s)")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--out", default="otlp.jsonl")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.out))
+    print(f"listening on http://{args.host}:{args.port}/v1/traces, writing {args.out}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""What a freshly forked worker pays before it is warm.
+
+    python bench/spawntime.py [--runs 7]
+
+gunicorn imports the app in the master (``preload_app``) and forks the
+workers. The app loads Pillow, NumPy, passlib and jose on first use, so a
+worker pays for whatever the master has not imported yet on its first
+requests. This script imports ``app.main`` the way the master does, with
+and without the ``on_starting`` hook of ``gunicorn.conf.py``, then forks
+children. Each child does the first-use work of a new worker: it checks a
+token, loads the bcrypt backend, loads Pillow and loads the analytics
+module. The median time per child is reported for both cases. Run from
+``backend/``.
+"""
+import argparse
+import os
+import runpy
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(HERE)
+
+
+def first_use() -> None:
+    from app.utils import security
+
+    try:
+        security.decode_token("not.a.token")
+    except Exception:
+        pass
+    security.pwd_context().handler("bcrypt").get_backend()
+    from PIL import Image  # noqa: F401
+    from app.utils import analytics  # noqa: F401
+
+
+def master(preload: bool, runs: int) -> list[float]:
+    """Import the app (and run the hook), then time ``runs`` forked children."""
+    import app.main  # noqa: F401
+
+    if preload:
+        runpy.run_path(os.path.join(BACKEND, "gunicorn.conf.py"))["on_starting"](None)
+    times = []
+    for _ in range(runs):
+        r, w = os.pipe()
+        started = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            first_use()
+            os.write(w, str(time.perf_counter() - started).encode())
+            os._exit(0)
+        os.close(w)
+        with os.fdopen(r) as f:
+            times.append(float(f.read()) * 1000)
+        os.waitpid(pid, 0)
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--mode", choices=["lazy", "preload"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        print(statistics.median(master(args.mode == "preload", args.runs)))
+        return
+    for mode in ("lazy", "preload"):
+        # a fresh interpreter per mode, so neither sees the other's imports
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--mode", mode, "--runs", str(args.runs)],
+            cwd=BACKEND, capture_output=True, text=True, env={**os.environ, "PYTHONPATH": BACKEND},
+        )
+        if proc.returncode:
+            sys.exit(proc.stderr)
+        print(f"{mode:8} first use in a forked worker: median {float(proc.stdout):.1f} ms over {args.runs} runs")
+
+
+if __name__ == "__main__":
+    main()
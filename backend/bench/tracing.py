@@ -0,0 +1,120 @@
+"""Per-request cost of tracing (utils/tracing.py), in process.
+
+    python bench/tracing.py [--requests 20000] [--spans 10]
+
+Drives a minimal FastAPI app straight through ASGI (no server, no database)
+with and without :class:`TracingMiddleware`; the endpoint opens ``--spans``
+child spans, standing in for the auth and SQL spans of a real request. Also
+times :func:`span` on its own inside and outside a trace. Exported traces go
+to a temporary file. Run from ``backend/``.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TRACE_FILE", os.path.join(tempfile.mkdtemp(), "traces.jsonl"))
+
+from fastapi import APIRouter, FastAPI  # noqa: E402
+
+from app.middleware.tracing import TracingMiddleware  # noqa: E402
+from app.utils.tracing import Trace, TracedRoute, Tracer, end_trace, span, start_trace  # noqa: E402
+
+
+def build(traced: bool, spans: int, tracer: Tracer | None = None) -> FastAPI:
+    app = FastAPI()
+    router = APIRouter(route_class=TracedRoute) if traced else APIRouter()
+
+    @router.get("/items/{item_id}")
+    async def item(item_id: int):
+        for i in range(spans):
+            with span("work", i=i):
+                pass
+        return {"id": item_id, "name": "x" * 40}
+
+    app.include_router(router)
+    if traced:
+        app.add_middleware(TracingMiddleware, tracer=tracer)
+    return app
+
+
+async def drive(app, n: int) -> list[float]:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/items/1", "raw_path": b"/items/1", "root_path": "",
+        "query_string": b"", "headers": [(b"host", b"bench")], "server": ("bench", 80), "client": ("127.0.0.1", 1),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        await app(dict(scope), receive, send)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def span_cost(n: int) -> tuple[float, float]:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        with span("x"):
+            pass
+    outside = (time.perf_counter() - t0) / n
+    tokens = start_trace(Trace("bench"))
+    t0 = time.perf_counter()
+    for _ in range(n):
+        with span("x"):
+            pass
+    inside = (time.perf_counter() - t0) / n
+    end_trace(tokens)
+    return outside, inside
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--spans", type=int, default=10)
+    args = parser.parse_args()
+
+    outside, inside = span_cost(200_000)
+    print(f"span() outside a trace: {outside * 1e9:7.0f} ns")
+    print(f"span() inside a trace:  {inside * 1e9:7.0f} ns")
+
+    keep_all, keep_none = Tracer(), Tracer()
+    keep_all.sampler.per_second = float("inf")
+    keep_none.sampler.per_second = 0.0
+    keep_none.slow_ns = keep_all.slow_ns = 10**18
+    variants = [
+        ("untraced", build(False, args.spans)),
+        ("traced, dropped", build(True, args.spans, keep_none)),
+        ("traced, exported", build(True, args.spans, keep_all)),
+    ]
+    times = {name: [] for name, _ in variants}
+    for _, app in variants:
+        await drive(app, 500)  # warm up
+    rounds = 10  # interleaved, so drift (turbo, other load) hits every variant alike
+    for _ in range(rounds):
+        for name, app in variants:
+            keep_none.sampler.probability = 0.0
+            times[name] += await drive(app, args.requests // rounds)
+    base = None
+    for name, _ in variants:
+        median = statistics.median(times[name]) * 1e6
+        base = median if base is None else base
+        p99 = statistics.quantiles(times[name], n=100)[98] * 1e6
+        print(f"{name:18} median {median:7.1f} us  p99 {p99:7.1f} us  (+{median - base:5.1f} us)")
+    keep_all.exporter.close()
+    print(f"exporter: {keep_all.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+"""Production launcher: ``gunicorn -c gunicorn.conf.py app.main:app``.
+
+One uvicorn worker process per core (override with WEB_CONCURRENCY). The app
+is imported once in the master and forked, so workers start fast and share
+read-only pages; the database engine opens no connections at import time and
+each worker builds its own pool in the lifespan.
+
+The app defers Pillow, NumPy, passlib and jose to first use, which keeps the
+CLI and ``python -m app.worker`` light. Under gunicorn that would make every
+new worker (including each ``max_requests`` recycle) import them during a
+live request, so :func:`on_starting` imports them in the master instead.
+``python bench/spawntime.py`` measures what a forked worker still pays.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# SIGTERM: stop accepting, let in-flight requests finish for up to
+# graceful_timeout seconds, then run the lifespan shutdown.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+timeout = int(os.getenv("WORKER_TIMEOUT", 60))
+keepalive = 5
+
+# recycle workers now and then so slow leaks cannot accumulate
+max_requests = int(os.getenv("MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+
+
+def on_starting(server):
+    """Load the app's lazily imported dependencies once, before workers fork."""
+    import numpy  # noqa: F401
+    from PIL import Image  # noqa: F401
+    from jose import jwt  # noqa: F401
+
+    from app.utils import analytics, security  # noqa: F401
+
+    security.pwd_context().handler("bcrypt").get_backend()  # passlib loads bcrypt on first hash
+
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
@@ -0,0 +1,13 @@
+"""Settings for the test run, applied before any test module imports ``app``.
+
+``app.core.config.settings`` is read once, at import, so the database and
+the side effects of the app are pointed at throwaway places here.
+"""
+import os
+import tempfile
+
+if os.getenv("TEST_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+os.environ.setdefault("JOB_WORKER_IN_APP", "false")
+os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp())
+os.environ.setdefault("CACHE_BACKEND", "memory")  # nothing left behind, and every run starts cold
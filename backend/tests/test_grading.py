@@ -0,0 +1,114 @@
+"""Answer normalisation and tolerant matching (utils/grading.py); no database."""
+import random
+
+import pytest
+
+from app.core.config import settings
+from app.utils.grading import compile_key, matches, normalize, within
+
+
+def levenshtein(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Ｈｅｌｌｏ  ｗｏｒｌｄ", "hello world"),  # full-width ASCII, doubled space
+    ("ＡＢＣ１２３", "abc123"),
+    ("ﾈｺ", "ねこ"),  # half-width katakana
+    ("ネコ", "ねこ"),
+    ("ヴァイオリン", "ゔぁいおりん"),
+    ("ガッコウ", "がっこう"),  # voiced and small kana
+    ("Straße", "strasse"),  # casefold, not lower
+    ("  two\twords\n ", "two words"),
+    ("ー", "ー"),  # the long vowel mark has no hiragana form
+])
+def test_normalize(text, expected):
+    assert normalize(text) == expected
+
+
+def test_compile_key_alternatives():
+    assert compile_key("ねこ|猫\nネコ") == frozenset({"ねこ", "猫"})
+    assert compile_key("Hello World| hello  world ") == frozenset({"hello world"})
+    assert compile_key("a||\n|b") == frozenset({"a", "b"})
+    assert compile_key("|") == frozenset()
+
+
+@pytest.mark.parametrize("a, b, limit, expected", [
+    ("", "", 0, True),
+    ("kitten", "kitten", 0, True),
+    ("kitten", "sitting", 3, True),
+    ("kitten", "sitting", 2, False),
+    ("abc", "", 3, True),
+    ("abc", "", 2, False),
+    ("a", "abcd", 2, False),  # length difference alone is over the limit
+])
+def test_within(a, b, limit, expected):
+    assert within(a, b, limit) is expected
+    assert within(b, a, limit) is expected
+
+
+def test_within_agrees_with_levenshtein():
+    rng = random.Random(47)
+    for _ in range(2000):
+        a = "".join(rng.choice("abcね") for _ in range(rng.randint(0, 7)))
+        b = "".join(rng.choice("abcね") for _ in range(rng.randint(0, 7)))
+        distance = levenshtein(a, b)
+        for limit in range(5):
+            assert within(a, b, limit) is (distance <= limit), (a, b, limit)
+
+
+class _Counting(str):
+    """A string that counts the characters taken from it."""
+
+    taken = 0
+
+    def __iter__(self):
+        for ch in str.__iter__(self):
+            type(self).taken += 1
+            yield ch
+
+
+def test_within_stops_once_every_path_is_over_the_limit():
+    _Counting.taken = 0
+    assert not within(_Counting("abcdefgh"), "stuvwxyz", 1)
+    assert _Counting.taken == 2  # each row's minimum is already 2 after two characters
+
+
+def test_matches_exact_after_normalising():
+    accepted = compile_key("Hello World|ねこ")
+    assert matches("ｈｅｌｌｏ　ｗｏｒｌｄ", accepted, tolerance=0)
+    assert matches("ﾈｺ", accepted, tolerance=0)
+    assert not matches("hello worl", accepted, tolerance=0)
+
+
+@pytest.mark.parametrize("answer, tolerance, expected", [
+    ("abcdefghi", 0.1, True),  # key of 10: limit int(1.0) = 1, one deletion
+    ("abcdefgh", 0.1, False),  # two edits
+    ("abcdefgh", 0.2, True),  # limit 2
+    ("abcdefg", 0.2, False),
+    ("abcdefg", 0.3, True),
+    ("abcdefgh", 0.19, False),  # limit int(1.9) = 1
+])
+def test_matches_tolerance_boundaries(answer, tolerance, expected):
+    assert matches(answer, compile_key("abcdefghij"), tolerance=tolerance) is expected
+
+
+def test_matches_tolerance_per_alternative():
+    # each alternative gets a limit from its own length
+    accepted = compile_key("ab|abcdefghij")
+    assert not matches("xy", accepted, tolerance=0.1)
+    assert matches("abcdefghiX", accepted, tolerance=0.1)
+
+
+def test_matches_uses_setting_by_default(monkeypatch):
+    accepted = compile_key("abcdefghij")
+    monkeypatch.setattr(settings, "grading_tolerance", 0.0)
+    assert not matches("abcdefghi", accepted)
+    monkeypatch.setattr(settings, "grading_tolerance", 0.1)
+    assert matches("abcdefghi", accepted)
@@ -0,0 +1,155 @@
+"""Every route that declares a ``@query_budget`` stays within it.
+
+Needs a throwaway Postgres database (its tables are created and filled):
+
+    TEST_DATABASE_URL=postgresql+asyncpg://postgres@localhost/ait_test python -m pytest -q tests
+
+The module is skipped without ``TEST_DATABASE_URL``. Each budgeted route is
+called once under ``assert_max_queries(budget_of(endpoint))``.
+A route that gains a budget must get a request in ``REQUESTS`` below.
+"""
+import asyncio
+import os
+
+import pytest
+
+if not os.getenv("TEST_DATABASE_URL"):  # conftest.py points the app at it
+    pytest.skip("TEST_DATABASE_URL is not set", allow_module_level=True)
+
+import httpx  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.utils.queries import assert_max_queries, budget_of  # noqa: E402
+
+# endpoint name -> (method, path, role, json body); filled in from the seed
+REQUESTS = {
+    "my_assignments": ("GET", "/patient/assignments", "patient", None),
+    "next_assignments": ("GET", "/patient/next?limit=10", "patient", None),
+    "my_records": ("GET", "/patient/records", "patient", None),
+    "assigned_assignment_v2": ("GET", "/patient/assignments/v2/{mcq_id}", "patient", None),
+    "assignment_history": ("GET", "/patient/records/{mcq_id}/history", "patient", None),
+    "sync_changes": ("GET", "/patient/sync", "patient", None),
+    "my_caseload": ("GET", "/doctor/caseload", "doctor", None),
+    "list_assignments": ("GET", "/doctor/assignments", "doctor", None),
+    "patient_records": ("GET", "/doctor/patients/{patient_id}/records", "doctor", None),
+    "pending_reviews": ("GET", "/doctor/reviews", "doctor", None),
+    "list_users": ("GET", "/admin/users", "admin", None),
+    "transfer_caseload": ("POST", "/admin/caseload/transfer", "admin",
+                          {"from_doctor_id": "{doctor_id}", "to_doctor_id": "{doctor2_id}", "patient_ids": ["{moved_id}"]}),
+    "unbind_caseload": ("POST", "/admin/caseload/unbind", "admin",
+                        {"doctor_id": "{doctor_id}", "patient_ids": ["{unbound_id}"]}),
+}
+
+
+def _endpoints(routes):
+    for route in routes:
+        included = getattr(route, "original_router", None)  # include_router() wrappers in newer FastAPI
+        if included is not None:
+            yield from _endpoints(included.routes)
+        elif getattr(route, "endpoint", None) is not None:
+            yield route.endpoint
+
+
+def _budgeted():
+    return sorted({(e.__name__, budget_of(e)) for e in _endpoints(app.routes) if budget_of(e) is not None})
+
+
+def _fill(value, seed):
+    if isinstance(value, str):
+        return int(value.format(**seed)) if value.startswith("{") and value.endswith("}") else value.format(**seed)
+    if isinstance(value, list):
+        return [_fill(v, seed) for v in value]
+    if isinstance(value, dict):
+        return {k: _fill(v, seed) for k, v in value.items()}
+    return value
+
+
+async def _seed(c: httpx.AsyncClient) -> dict:
+    """Users, an MCQ and a writing assignment, finished attempts and a pending review.
+
+    No budgeted route is called here, so each is measured with a cold cache.
+    """
+    seed, headers = {}, {}
+    for name, role in [("admin", 1), ("doctor", 2), ("doctor2", 2), ("patient", 3), ("moved", 3), ("unbound", 3)]:
+        r = await c.post("/auth/register", json={
+            "username": name, "email": f"{name}@example.com", "password": "password123", "role": role})
+        assert r.status_code == 201, r.text
+        seed[f"{name}_id"] = r.json()["id"]
+        r = await c.post("/auth/login", data={"username": name, "password": "password123"})
+        assert r.status_code == 200, r.text
+        headers[name] = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    A, D, P = headers["admin"], headers["doctor"], headers["patient"]
+    r = await c.post("/assignments/", headers=A, json={
+        "topic": 1, "title": "mcq", "qtype": "multiple_choice", "properties": {"numChoices": 3},
+        "items": [{"prompt": f"q{i}", "choices": [{"text": "a"}, {"text": "b"}, {"text": "c"}], "answer_key": i % 3}
+                  for i in range(4)]})
+    assert r.status_code == 200, r.text
+    seed["mcq_id"] = r.json()["id"]
+    r = await c.post("/assignments/", headers=A, json={
+        "topic": 2, "title": "writing", "qtype": "writing", "properties": {"manualReview": True},
+        "items": [{"prompt": "w1", "choices": [], "answer_key": "hello"}]})
+    assert r.status_code == 200, r.text
+    seed["writing_id"] = r.json()["id"]
+    mcq_items = [it["id"] for it in (await c.get(f"/assignments/v2/{seed['mcq_id']}", headers=A)).json()["items"]]
+    writing_items = [it["id"] for it in (await c.get(f"/assignments/v2/{seed['writing_id']}", headers=A)).json()["items"]]
+    for name in ("patient", "moved", "unbound"):
+        r = await c.post(f"/doctor/patients/{seed[f'{name}_id']}/bind", headers=D)
+        assert r.status_code == 200, r.text
+        r = await c.post(f"/doctor/patients/{seed[f'{name}_id']}/assign", headers=D,
+                         json={"assignment_ids": [seed["mcq_id"], seed["writing_id"]]})
+        assert r.status_code == 200, r.text
+    for attempt in range(2):
+        assert (await c.post(f"/patient/records/{seed['mcq_id']}/start", headers=P)).status_code == 200
+        for i, item in enumerate(mcq_items):
+            r = await c.post(f"/patient/records/{seed['mcq_id']}/mcq", headers=P,
+                             json={"item_id": item, "choice_index": (i + attempt) % 3, "is_correct": attempt == 0})
+            assert r.status_code == 200, r.text
+        r = await c.post(f"/patient/records/{seed['mcq_id']}/finish", headers=P, json={"score": 4 - 4 * attempt})
+        assert r.status_code == 200, r.text
+    assert (await c.post(f"/patient/records/{seed['writing_id']}/start", headers=P)).status_code == 200
+    r = await c.post(f"/patient/records/{seed['writing_id']}/writing", headers=P,
+                     json={"item_id": writing_items[0], "answer_text": "hello"})
+    assert r.status_code == 200, r.text
+    r = await c.post(f"/patient/records/{seed['writing_id']}/finish", headers=P, json={"score": 0})
+    assert r.status_code == 200, r.text
+    return seed, headers
+
+
+@pytest.fixture(scope="module")
+def client():
+    loop = asyncio.new_event_loop()
+    lifespan = app.router.lifespan_context(app)
+    loop.run_until_complete(lifespan.__aenter__())
+    c = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def ready():
+        for _ in range(200):
+            if (await c.get("/health/ready")).status_code == 200:
+                return
+            await asyncio.sleep(0.05)
+
+    loop.run_until_complete(ready())
+    seed, headers = loop.run_until_complete(_seed(c))
+    yield loop, c, seed, headers
+    loop.run_until_complete(c.aclose())
+    loop.run_until_complete(lifespan.__aexit__(None, None, None))
+    loop.close()
+
+
+def test_every_budget_has_a_request():
+    assert {name for name, _ in _budgeted()} <= REQUESTS.keys()
+
+
+@pytest.mark.parametrize("endpoint, budget", _budgeted())
+def test_route_within_budget(client, endpoint, budget):
+    loop, c, seed, headers = client
+    method, path, role, body = REQUESTS[endpoint]
+
+    async def call():
+        with assert_max_queries(budget) as stats:
+            r = await c.request(method, path.format(**seed), headers=headers[role], json=_fill(body, seed))
+        assert r.status_code == 200, r.text
+        return stats
+
+    stats = loop.run_until_complete(call())
+    assert stats.count > 0
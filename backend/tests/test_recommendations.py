@@ -0,0 +1,68 @@
+"""SM-2 quality and scheduling (utils/recommendations.py); no database."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.utils.recommendations import MIN_EASE, PASS_QUALITY, _State, quality, sm2
+
+T0 = datetime(2026, 1, 5, 9, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("score, items, expected", [
+    (4, 4, 5),
+    (0, 4, 0),
+    (3, 5, 3),
+    (2, 5, 2),
+    (1, 10, 0),  # round(0.5) is 0
+    (3, 10, 2),  # round(1.5) is 2
+    (9, 4, 5),  # capped at the item count
+    (-2, 4, 0),
+    (0, 0, PASS_QUALITY),  # no items: neither pass nor fail the pair
+])
+def test_quality(score, items, expected):
+    assert quality(score, items) == expected
+
+
+def test_successes_grow_the_interval():
+    state = _State(due_at=T0)
+    intervals = []
+    for day in range(4):
+        sm2(state, 5, T0 + timedelta(days=day))
+        intervals.append(state.interval_days)
+    assert intervals[:2] == [1.0, 6.0]
+    assert intervals[2] == round(6.0 * 2.7, 2)  # ease 2.5 + 0.1 per perfect attempt
+    assert intervals[3] == round(intervals[2] * 2.8, 2)
+    assert state.repetitions == state.attempts == 4
+    assert state.ease == pytest.approx(2.9)
+    assert state.last_quality == 5
+    assert state.last_finished_at == T0 + timedelta(days=3)
+    assert state.due_at == state.last_finished_at + timedelta(days=intervals[3])
+
+
+@pytest.mark.parametrize("q, delta", [(5, 0.1), (4, 0.0), (3, -0.14), (2, -0.32), (0, -0.8)])
+def test_ease_moves_with_quality(q, delta):
+    state = _State(due_at=T0)
+    sm2(state, q, T0)
+    assert state.ease == pytest.approx(2.5 + delta)
+
+
+def test_failure_starts_over():
+    state = _State(due_at=T0)
+    for day in range(3):
+        sm2(state, 4, T0 + timedelta(days=day))
+    assert state.repetitions == 3 and state.interval_days > 6
+    sm2(state, PASS_QUALITY - 1, T0 + timedelta(days=10))
+    assert state.repetitions == 0
+    assert state.interval_days == 1.0
+    assert state.due_at == T0 + timedelta(days=11)
+    assert state.attempts == 4
+    sm2(state, PASS_QUALITY, T0 + timedelta(days=11))
+    assert (state.repetitions, state.interval_days) == (1, 1.0)
+
+
+def test_ease_never_drops_below_minimum():
+    state = _State(due_at=T0)
+    for day in range(10):
+        sm2(state, 0, T0 + timedelta(days=day))
+    assert state.ease == MIN_EASE
+    assert state.interval_days == 1.0